@@ -0,0 +1,437 @@
+"""
+Benchmarks do gateway_cli.py contra o gateway_mock_server.py (ou contra um gateway real com --url).
+
+Cenários:
+- poll:  get_delta em loop sobre N conversas com C workers (latência por chamada, chamadas/s, mensagens novas/s)
+- send:  send_text em massa com W workers (latência por envio, msg/s, 429 absorvidos pelo rate limiter)
+- media: upload simples, upload resumível e download em ranges paralelos (latência por operação, MB/s)
+- codec: decode/encode JSON de páginas de mensagens (stdlib x orjson x ijson), offline
+- store: custo por tick do render (sort completo x MessageStore) e memória do store compacto, offline
+
+Uso:
+    python gateway_bench.py                                   # todos os cenários, mock local sem latência
+    python gateway_bench.py poll send --latency-ms 40 --jitter-ms 20 --error-rate 0.01
+    python gateway_bench.py media --media-mb 64 --connections 8
+    python gateway_bench.py poll --slow-rate 0.03 --slow-ms 1000 --hedge delta   # hedging contra a cauda lenta
+    python gateway_bench.py send --url http://127.0.0.1:8000  # servidor já rodando
+    python gateway_bench.py --json > resultado.json
+    python gateway_bench.py codec store --store-sizes 1000,10000
+
+O mock embutido divide o GIL com o cliente: para números de paralelismo (download em ranges,
+muitos workers) prefira subir gateway_mock_server.py em outro processo e usar --url.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import tracemalloc
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import gateway_mock_server as mock
+
+
+SCENARIOS = ("poll", "send", "media", "codec", "store")
+DEFAULT_SCENARIOS = ("poll", "send", "media")  # codec e store são offline (não falam com o gateway)
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+class Recorder:
+    # Latências (s) por operação + contadores; thread-safe
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.units = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, units: int = 0) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+            self.units += units
+
+    def error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def summary(self, name: str, elapsed: float, unit: str, unit_scale: float = 1.0) -> dict:
+        lat = sorted(self.latencies)
+        return {
+            "scenario": name,
+            "ops": len(lat),
+            "errors": self.errors,
+            "elapsed_s": round(elapsed, 3),
+            "ops_per_s": round(len(lat) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(lat, 50) * 1000, 2),
+            "p95_ms": round(percentile(lat, 95) * 1000, 2),
+            "p99_ms": round(percentile(lat, 99) * 1000, 2),
+            "max_ms": round(lat[-1] * 1000, 2) if lat else 0.0,
+            unit: round(self.units / unit_scale / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+def timed(rec: Recorder, fn, *args, units=None, **kwargs):
+    t0 = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception:
+        rec.error()
+        return None
+    rec.record(time.perf_counter() - t0, units(result) if units else 0)
+    return result
+
+
+# ----------------------------
+# Cenários
+# ----------------------------
+def bench_poll(gw, conversations: int, workers: int, duration: float) -> dict:
+    convs = []
+    cursor = None
+    while len(convs) < conversations:
+        page = gw.list_conversations(limit=100, cursor=cursor)
+        convs.extend(c["id"] for c in page.get("items") or [])
+        cursor = page.get("next_cursor")
+        if not cursor:
+            break
+    convs = convs[:conversations]
+    gw.configure_transport(workers)
+
+    # Cursor inicial = fim da história (só mede o custo de polling em regime)
+    cursors: dict[str, tuple[str | None, str | None]] = {}
+    for cid in convs:
+        d = gw.get_delta(cid, None, None, limit=1_000_000)
+        cursors[cid] = (d.get("next_since_cursor"), d.get("server_time"))
+
+    rec = Recorder()
+    stop = time.perf_counter() + duration
+
+    def worker(my: list[str]) -> None:
+        while time.perf_counter() < stop:
+            for cid in my:
+                since, updated = cursors[cid]
+                d = timed(rec, gw.get_delta, cid, since, updated, units=lambda r: len(r.get("items") or []))
+                if d:
+                    cursors[cid] = (d.get("next_since_cursor") or since, d.get("server_time") or updated)
+                if time.perf_counter() >= stop:
+                    break
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(worker, [convs[i::workers] for i in range(workers)]))
+    return rec.summary("poll", time.perf_counter() - t0, "items_per_s")
+
+
+def bench_send(gw, count: int, workers: int) -> dict:
+    gw.configure_transport(workers)
+    rec = Recorder()
+    run = f"bench-{int(time.time() * 1000)}"
+
+    def one(i: int) -> None:
+        timed(rec, gw.send_text, f"55119{i % 1000:08d}", f"bench {i}", message_id=f"{run}-{i}", units=lambda r: 1)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(one, range(count)))
+    return rec.summary("send", time.perf_counter() - t0, "msgs_per_s")
+
+
+def bench_media(gw, size_mb: int, files: int, connections: int) -> list[dict]:
+    out = []
+    with tempfile.TemporaryDirectory(prefix="gateway-bench-") as tmp:
+        paths = []
+        for i in range(files):
+            p = Path(tmp) / f"bench-{i}.bin"
+            p.write_bytes(os.urandom(size_mb * 1024 * 1024))
+            paths.append(p)
+        size_of = lambda r: size_mb * 1024 * 1024  # noqa: E731
+
+        rec = Recorder()
+        t0 = time.perf_counter()
+        assets = [timed(rec, gw.media_upload, str(p), units=size_of) for p in paths]
+        out.append(rec.summary("media-upload", time.perf_counter() - t0, "mb_per_s", 1024 * 1024))
+
+        rec = Recorder()
+        t0 = time.perf_counter()
+        for p in paths:
+            timed(rec, gw.media_upload_resumable, str(p), idempotency_key=f"bench-{time.time_ns()}", progress=False, units=size_of)
+        out.append(rec.summary("media-upload-chunked", time.perf_counter() - t0, "mb_per_s", 1024 * 1024))
+
+        gw.configure_transport(max(connections, 1))
+        ids = [a["media_asset_id"] for a in assets if a]
+        for conns in sorted({1, connections}):
+            rec = Recorder()
+            t0 = time.perf_counter()
+            for i, asset_id in enumerate(ids):
+                timed(
+                    rec,
+                    gw.media_download_file,
+                    asset_id,
+                    out_dir=str(Path(tmp) / f"down-{conns}-{i}"),
+                    connections=conns,
+                    units=lambda p: p.stat().st_size,
+                )
+            out.append(rec.summary(f"media-download-x{conns}", time.perf_counter() - t0, "mb_per_s", 1024 * 1024))
+    return out
+
+
+def codec_page(n_items: int, seed: int = 7) -> dict:
+    # Página de delta/messages com metadata no formato que o gateway repassa do webhook
+    rng = random.Random(seed)
+    statuses = ["received", "sent", "delivered", "read"]
+    items = []
+    for i in range(n_items):
+        created = f"2025-03-01T12:{i // 60 % 60:02d}:{i % 60:02d}.{i:06d}+00:00"
+        items.append(
+            {
+                "id": f"6f1c2a9e-{i:04x}-4b7e-9d3a-{rng.getrandbits(48):012x}",
+                "conversation_id": "c0a8012e-7d4f-4e59-8a1b-3f9e2d6c1b70",
+                "direction": rng.choice(["inbound", "outbound"]),
+                "message_type": "text",
+                "status": rng.choice(statuses),
+                "created_at": created,
+                "updated_at": created,
+                "content": {"text": "Olá! Gostaria de saber o status do pedido nº %d, obrigado 🙏 " % i * 2},
+                "provider_message_id": f"wamid.HBgNNTUxMTk{rng.getrandbits(96):024X}",
+                "error_message": None,
+                "metadata": {
+                    "source": "whatsapp_cloud",
+                    "phone_number_id": "109876543210987",
+                    "wa": {
+                        "pricing": {"billable": True, "pricing_model": "CBP", "category": "service"},
+                        "conversation": {"id": f"{rng.getrandbits(64):016x}", "origin": {"type": "user_initiated"}},
+                        "context": {"from": "5511999990000", "id": f"wamid.{rng.getrandbits(64):016x}"},
+                    },
+                    "tags": ["suporte", "pedido", f"fila-{i % 7}"],
+                    "latency_ms": rng.random() * 900,
+                    "attempts": rng.randint(1, 3),
+                },
+            }
+        )
+    return {
+        "items": items,
+        "next_cursor": None,
+        "next_since_cursor": f"{items[-1]['created_at']}|{items[-1]['id']}" if items else None,
+        "server_time": "2025-03-01T13:00:00+00:00",
+    }
+
+
+def bench_codec(gw, sizes: list[int], rounds: int = 20) -> list[dict]:
+    # ms por página: decode do corpo HTTP e encode para a saída (indentada e compacta).
+    # Offline: não usa o gateway, só os codecs que o gateway_cli tem disponíveis
+    orjson, ijson = gw.orjson, gw.ijson
+
+    def ms(fn) -> float:
+        fn()  # aquece
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        return round((time.perf_counter() - t0) / rounds * 1000, 3)
+
+    rows = []
+    for n in sizes:
+        page = codec_page(n)
+        body = json.dumps(page, ensure_ascii=False).encode("utf-8")
+        row = {
+            "scenario": "codec",
+            "items": n,
+            "kib": round(len(body) / 1024, 1),
+            "stdlib_loads_ms": ms(lambda: json.loads(body)),
+            "stdlib_pretty_ms": ms(lambda: json.dumps(page, ensure_ascii=False, indent=2)),
+            "stdlib_compact_ms": ms(lambda: json.dumps(page, ensure_ascii=False, separators=(",", ":"))),
+        }
+        if orjson is not None:
+            row["orjson_loads_ms"] = ms(lambda: orjson.loads(body))
+            row["orjson_pretty_ms"] = ms(lambda: orjson.dumps(page, option=orjson.OPT_INDENT_2).decode("utf-8"))
+            row["orjson_compact_ms"] = ms(lambda: orjson.dumps(page).decode("utf-8"))
+        if ijson is not None:
+            row["ijson_stream_ms"] = ms(lambda: next(ijson.items(io.BytesIO(body), "", use_float=True)))
+        rows.append(row)
+    return rows
+
+
+def bench_store(gw, sizes: list[int], ticks: int = 200, max_render: int = 30, keep: int = 1000) -> list[dict]:
+    # Compara o custo por tick do sort completo (implementação antiga) com MessageStore.tail,
+    # e a memória de n dicts JSON completos com a do store compacto (sem e com janela keep)
+    def fake(i: int) -> dict:
+        return {
+            "id": f"m{i:08d}",
+            "created_at": f"2025-01-01T00:00:00.{i:08d}+00:00",
+            "direction": "inbound",
+            "message_type": "text",
+            "status": "received",
+            "content": {"text": f"msg {i}"},
+        }
+
+    rows = []
+    for n in sizes:
+        store = gw.MessageStore()
+        local: dict[str, dict] = {}
+        for i in range(n):
+            it = fake(i)
+            store.upsert(it)
+            local[it["id"]] = it
+
+        sort_ticks = max(1, min(ticks, 2_000_000 // max(n, 1)))
+        t0 = time.perf_counter()
+        for _ in range(sort_ticks):
+            ordered = sorted(local.values(), key=lambda x: (x.get("created_at", ""), x.get("id", "")))
+            _ = ordered[-max_render:]
+        sort_us = (time.perf_counter() - t0) / sort_ticks * 1e6
+
+        # Cada tick do store: 1 mensagem nova chegando pelo delta + leitura da janela de render
+        t0 = time.perf_counter()
+        for k in range(ticks):
+            store.upsert(fake(n + k))
+            _ = store.tail(max_render)
+        store_us = (time.perf_counter() - t0) / ticks * 1e6
+
+        tracemalloc.start()
+        dicts = {it["id"]: it for it in map(fake, range(n))}
+        dict_kib = tracemalloc.get_traced_memory()[0] / 1024
+        del dicts
+        tracemalloc.stop()
+        kib = {}
+        for label, capacity in (("store_kib", None), ("window_kib", keep)):
+            tracemalloc.start()
+            compact = gw.MessageStore(capacity=capacity)
+            for i in range(n):
+                compact.upsert(fake(i))
+            kib[label] = round(tracemalloc.get_traced_memory()[0] / 1024, 1)
+            del compact
+            tracemalloc.stop()
+
+        rows.append(
+            {
+                "scenario": "store",
+                "messages": n,
+                "sort_us_per_tick": round(sort_us, 1),
+                "store_us_per_tick": round(store_us, 1),
+                "dict_kib": round(dict_kib, 1),
+                **kib,
+            }
+        )
+    return rows
+
+
+# ----------------------------
+# CLI
+# ----------------------------
+def print_table(results: list[dict]) -> None:
+    cols = ["scenario", "ops", "errors", "ops_per_s", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+    print("  ".join(f"{c:>20}" if i == 0 else f"{c:>10}" for i, c in enumerate(cols)) + "  extra")
+    for r in results:
+        # codec/store não medem ops: só as colunas delas aparecem em extra
+        extra = {k: v for k, v in r.items() if k not in cols and k != "elapsed_s"}
+        line = "  ".join(f"{r.get(c, '-'):>20}" if i == 0 else f"{r.get(c, '-'):>10}" for i, c in enumerate(cols))
+        print(f"{line}  {extra}")
+
+
+def sizes_arg(value: str) -> list[int]:
+    return [int(x) for x in value.split(",") if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do gateway_cli contra o mock (ou um gateway real)")
+    parser.add_argument("scenarios", nargs="*", choices=SCENARIOS, help=f"Default: {' '.join(DEFAULT_SCENARIOS)}")
+    parser.add_argument("--url", default=None, help="Usa um gateway já rodando em vez de subir o mock")
+    parser.add_argument("--json", action="store_true", help="Saída JSON em vez de tabela")
+    # mock
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--send-rate", type=float, default=0.0, help="Capacidade de envio do mock (msg/s)")
+    parser.add_argument("--inbound-rate", type=float, default=20.0)
+    parser.add_argument("--mock-conversations", type=int, default=200)
+    parser.add_argument("--mock-messages", type=int, default=100)
+    # cenários
+    parser.add_argument("--conversations", type=int, default=50, help="poll: conversas acompanhadas")
+    parser.add_argument("--duration", type=float, default=5.0, help="poll: duração (s)")
+    parser.add_argument("--count", type=int, default=500, help="send: mensagens")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--media-mb", type=int, default=16)
+    parser.add_argument("--media-files", type=int, default=2)
+    parser.add_argument("--connections", type=int, default=4, help="media: conexões do download em ranges")
+    parser.add_argument("--hedge", default=None, help='Famílias de GET com hedging no cliente, ex: "delta"')
+    parser.add_argument("--hedge-budget", type=float, default=None)
+    parser.add_argument("--codec-sizes", default="50,200,1000", help="codec: itens por página, separados por vírgula")
+    parser.add_argument("--rounds", type=int, default=20, help="codec: repetições por medida")
+    parser.add_argument("--store-sizes", default="1000,10000,100000", help="store: tamanhos de conversa, separados por vírgula")
+    parser.add_argument("--ticks", type=int, default=200, help="store: ticks medidos")
+    parser.add_argument("--render", type=int, default=30, help="store: mensagens por frame")
+    parser.add_argument("--keep", type=int, default=1000, help="store: janela do store limitado (coluna window_kib)")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        server, url = mock.start_in_thread(
+            mock.MockConfig(
+                conversations=args.mock_conversations,
+                messages_per_conversation=args.mock_messages,
+                inbound_rate=args.inbound_rate,
+                latency_ms=args.latency_ms,
+                jitter_ms=args.jitter_ms,
+                slow_rate=args.slow_rate,
+                slow_ms=args.slow_ms,
+                error_rate=args.error_rate,
+                send_rate=args.send_rate,
+            )
+        )
+    os.environ["GATEWAY_BASE_URL"] = url
+    os.environ.setdefault("WHATSAPP_GATEWAY_API_KEY", "bench")
+
+    # gateway_cli lê o ambiente (e imprime o banner) no import: importa só depois de configurar
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        import gateway_cli as gw
+    finally:
+        sys.stdout = stdout
+    if args.hedge or args.hedge_budget is not None:
+        gw.HEDGER.configure(args.hedge, args.hedge_budget)
+
+    results: list[dict] = []
+    for name in args.scenarios or DEFAULT_SCENARIOS:
+        if name == "poll":
+            results.append(bench_poll(gw, args.conversations, args.workers, args.duration))
+        elif name == "send":
+            results.append(bench_send(gw, args.count, args.workers))
+        elif name == "media":
+            results.extend(bench_media(gw, args.media_mb, args.media_files, args.connections))
+        elif name == "codec":
+            print(f"[codec] orjson={'sim' if gw.orjson else 'não'} ijson={'sim (' + gw.ijson.backend + ')' if gw.ijson else 'não'}", file=sys.stderr)
+            results.extend(bench_codec(gw, sizes_arg(args.codec_sizes), rounds=args.rounds))
+        elif name == "store":
+            results.extend(bench_store(gw, sizes_arg(args.store_sizes), ticks=args.ticks, max_render=args.render, keep=args.keep))
+
+    if gw.HEDGER.families:
+        for r in results:
+            if r["scenario"] == "poll":
+                r["hedge"] = dict(gw.HEDGER.stats)
+    if args.json:
+        print(gw.json_dumps({"base_url": url, "results": results}, indent=True))
+    else:
+        print(f"base_url={url}")
+        print_table(results)
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
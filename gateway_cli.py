@@ -1,10 +1,33 @@
 """
 Requisitos: pip install requests
 Opcional: pip install python-dotenv
+Opcional: pip install pyarrow (comando export)
+Opcional: pip install orjson ijson (codec JSON rápido / parse incremental de respostas grandes)
 Variáveis de ambiente:
 
 - WHATSAPP_GATEWAY_API_KEY (obrigatório)
 - GATEWAY_BASE_URL (opcional, default http://localhost:8000)
+- GATEWAY_POOL_SIZE (opcional, default 10) conexões keep-alive por host
+- GATEWAY_GET_RETRIES (opcional, default 3) retries automáticos em GET/HEAD (conexão e 502/503/504 sem Retry-After)
+- GATEWAY_CACHE_DB (opcional, default ~/.gateway_cli/cache.db) cache local SQLite
+- GATEWAY_MEDIA_TTL_DAYS (opcional, default 30) validade de um media_asset_id no cache de dedup
+- GATEWAY_RATE_LIMITS (opcional, ex: "send=20,delta=10,read=20,media=5") requests/s por família de endpoint
+- GATEWAY_PHONE_RATE (opcional) envios/s por phone_number_id
+- GATEWAY_RATE_RETRIES (opcional, default 5) retentativas após 429 ou 503 com Retry-After (só requests seguros para repetir)
+- GATEWAY_BREAKER_FAILURES (opcional, default 5) falhas seguidas que abrem o circuito de uma família (0 = desligado)
+- GATEWAY_BREAKER_COOLDOWN (opcional, default 5) segundos com o circuito aberto antes da prova (dobra a cada prova falha, até 60)
+- GATEWAY_TIMEOUT_FACTOR (opcional, default 5) timeout adaptativo = fator x p99 da latência observada (0 = timeouts fixos)
+- GATEWAY_TIMEOUT_MIN (opcional, default 5) piso (s) do timeout adaptativo
+- GATEWAY_HEDGE (opcional, ex: "delta") famílias de GET com hedging: 2º request se o 1º passar do p95 (mesmo que --hedge)
+- GATEWAY_HEDGE_BUDGET (opcional, default 0.05) teto de requests extras do hedging, em fração dos requests
+- GATEWAY_OUTBOX_DB (opcional, default ~/.gateway_cli/outbox.db) fila durável de envios (comandos outbox-*)
+- GATEWAY_CAMPAIGN_DB (opcional, default ~/.gateway_cli/campaigns.db) campanhas e checkpoint de envio (comandos campaign-*)
+- GATEWAY_DAEMON_SOCKET (opcional, default ~/.gateway_cli/daemon.sock) socket do comando daemon / gateway_client.py
+- GATEWAY_HTTP_CACHE_TTL (opcional, default 300) vida máxima (s) de uma resposta no cache de GET condicional
+- GATEWAY_HTTP_CACHE_MB (opcional, default 16) tamanho do cache de GET condicional (0 = desligado)
+- GATEWAY_JSON_STREAM_MB (opcional, default 4) respostas maiores que isso são parseadas em streaming (requer ijson)
+- GATEWAY_METRICS_FILE (opcional) arquivo OpenMetrics reescrito periodicamente (mesmo que --metrics-file)
+- GATEWAY_METRICS_INTERVAL (opcional, default 15) segundos entre escritas do arquivo de métricas
 """
 
 
@@ -15,309 +38,4268 @@ except ImportError:  # pragma: no cover
         return False
 import os
 import sys
+import csv
 import time
 import json
+import random
+import hashlib
+import sqlite3
+import shutil
+import socket
+import socketserver
+import traceback
+import mimetypes
+import asyncio
 import argparse
-from datetime import datetime, timezone
+import threading
+import contextvars
+import heapq
+import itertools
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone, time as dtime
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+    pq = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ----------------------------
+# Config
+# ----------------------------
+load_dotenv()
+
+BASE_URL = os.getenv("GATEWAY_BASE_URL").rstrip("/")
+API_KEY = os.getenv("WHATSAPP_GATEWAY_API_KEY")
+print(f'ESTA É A NOSSA LINDA URL=========== {BASE_URL} ===========================')
+print(f'ESTA É A NOSSA API KEY=========== {API_KEY} ===========================')
+
+
+if not API_KEY:
+    print("ERRO: defina a variável WHATSAPP_GATEWAY_API_KEY no ambiente.")
+    sys.exit(1)
+
+HEADERS = {"X-API-Key": API_KEY}
+
+POOL_SIZE = int(os.getenv("GATEWAY_POOL_SIZE", "10"))
+GET_RETRIES = int(os.getenv("GATEWAY_GET_RETRIES", "3"))
+CACHE_DB = os.getenv("GATEWAY_CACHE_DB") or str(Path.home() / ".gateway_cli" / "cache.db")
+MEDIA_TTL = float(os.getenv("GATEWAY_MEDIA_TTL_DAYS", "30")) * 86400
+RATE_RETRIES = int(os.getenv("GATEWAY_RATE_RETRIES", "5"))
+BREAKER_FAILURES = int(os.getenv("GATEWAY_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("GATEWAY_BREAKER_COOLDOWN", "5"))
+TIMEOUT_FACTOR = float(os.getenv("GATEWAY_TIMEOUT_FACTOR", "5"))
+TIMEOUT_MIN = float(os.getenv("GATEWAY_TIMEOUT_MIN", "5"))
+HEDGE_FAMILIES = os.getenv("GATEWAY_HEDGE") or ""
+HEDGE_BUDGET = float(os.getenv("GATEWAY_HEDGE_BUDGET", "0.05"))
+OUTBOX_DB = os.getenv("GATEWAY_OUTBOX_DB") or str(Path.home() / ".gateway_cli" / "outbox.db")
+CAMPAIGN_DB = os.getenv("GATEWAY_CAMPAIGN_DB") or str(Path.home() / ".gateway_cli" / "campaigns.db")
+HTTP_CACHE_TTL = float(os.getenv("GATEWAY_HTTP_CACHE_TTL", "300"))
+HTTP_CACHE_MB = float(os.getenv("GATEWAY_HTTP_CACHE_MB", "16"))
+JSON_STREAM_THRESHOLD = int(float(os.getenv("GATEWAY_JSON_STREAM_MB", "4")) * 1024 * 1024)
+METRICS_FILE = os.getenv("GATEWAY_METRICS_FILE") or None
+METRICS_INTERVAL = float(os.getenv("GATEWAY_METRICS_INTERVAL", "15"))
+DAEMON_SOCKET = os.getenv("GATEWAY_DAEMON_SOCKET") or str(Path.home() / ".gateway_cli" / "daemon.sock")
+
+
+# ----------------------------
+# Codec JSON (orjson quando instalado, stdlib como fallback)
+# ----------------------------
+
+
+def json_loads(data: bytes | str):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj, indent: bool = False) -> str:
+    # Sempre UTF-8 cru (equivale a ensure_ascii=False); compacto por padrão (NDJSON, SQLite)
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode("utf-8")
+        except TypeError:
+            pass  # tipos que só o json da stdlib aceita (ex: int > 64 bits, chaves não-str)
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def print_json(obj) -> None:
+    # --compact é do comando (CommandScope), inclusive quando quem imprime é uma thread worker dele
+    scope = _scope.get()
+    print(json_dumps(obj, indent=not (scope is not None and scope.compact)))
+
+
+def decode_json(r: requests.Response):
+    # Corpo grande + ijson: parse incremental direto do socket, sem o corpo inteiro em bytes na memória.
+    # Só faz diferença com stream=True (senão requests já leu tudo).
+    size = r.headers.get("Content-Length")
+    if ijson is not None and size and size.isdigit() and int(size) >= JSON_STREAM_THRESHOLD and not r._content_consumed:
+        r.raw.decode_content = True
+        try:
+            return next(ijson.items(r.raw, "", use_float=True), {})
+        finally:
+            r.close()
+    body = r.content
+    return json_loads(body) if body else {}
+
+
+# ----------------------------
+# Transporte HTTP (Session compartilhada, pool keep-alive)
+# ----------------------------
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+class TransportRetry(Retry):
+    # Resposta com Retry-After (429, 503 de manutenção) é limite do gateway: quem repete é o
+    # loop do http_request, que pausa o bucket do RATE_LIMITER. Repetir aqui também multiplicaria
+    # as tentativas (GET_RETRIES x RATE_RETRIES) e furaria a pausa.
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if has_retry_after or status_code == 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def build_session(pool_size: int = POOL_SIZE, get_retries: int = GET_RETRIES) -> requests.Session:
+    # Retry só em métodos idempotentes; POST (/gateway/send, upload) nunca é reenviado aqui.
+    # Erros de conexão (antes de enviar o request) são retentados para qualquer método.
+    # 429 e respostas com Retry-After ficam só com o rate limiter (http_request).
+    retry = TransportRetry(
+        total=get_retries,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.hooks["response"].append(_observe_response)
+    return s
+
+
+_session_pool_size = POOL_SIZE
+
+
+def configure_transport(pool_size: int) -> None:
+    # Comandos concorrentes precisam de pelo menos 1 conexão por worker no pool.
+    # O pool só cresce e a Session anterior não é fechada: no daemon outros comandos podem ter
+    # requests em voo nela (as conexões ociosas vão embora quando ninguém mais a referencia).
+    global _session, _session_pool_size
+    with _session_lock:
+        if _session is not None and pool_size <= _session_pool_size:
+            return
+        _session_pool_size = max(pool_size, _session_pool_size)
+        _session = build_session(pool_size=_session_pool_size)
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def transport_stats(scope: "CommandScope | None" = None) -> dict:
+    # num_connections = conexões (handshakes TCP/TLS) abertas; num_requests = requests feitos no pool.
+    # Com escopo, só os requests do comando (no daemon o pool é de todos os clientes).
+    requests_total = 0
+    connections = 0
+    hosts = []
+    if _session is not None:
+        for adapter in {id(a): a for a in _session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_total += pool.num_requests
+                connections += pool.num_connections
+                hosts.append(f"{pool.scheme}://{pool.host}:{pool.port}")
+    if scope is not None:
+        requests_total = scope.counters.get("requests", 0)
+        connections = scope.counters.get("connections_opened", 0)
+    return {
+        "requests": requests_total,
+        "connections_opened": connections,
+        "connections_reused": max(requests_total - connections, 0),
+        "hosts": hosts,
+    }
+
+
+def print_transport_stats(scope: "CommandScope | None" = None) -> None:
+    st = transport_stats(scope)
+    print(
+        f"[transport] requests={st['requests']} conexões_abertas={st['connections_opened']} "
+        f"reusos={st['connections_reused']} hosts={','.join(st['hosts']) or '-'}",
+        file=sys.stderr,
+    )
+    hc = HTTP_CACHE.stats()
+    if scope is not None:
+        # Entradas/bytes são do cache (compartilhado); hits, misses e bytes poupados, do comando
+        hc.update({k: scope.counters.get(f"http_cache_{k}", 0) for k in ("fresh", "not_modified", "miss", "bytes_saved")})
+    if hc["fresh"] or hc["not_modified"] or hc["miss"]:
+        print(
+            f"[http-cache] frescos={hc['fresh']} 304={hc['not_modified']} misses={hc['miss']} "
+            f"bytes_poupados={hc['bytes_saved']} entradas={hc['entries']} ({hc['bytes'] // 1024} KiB)",
+            file=sys.stderr,
+        )
+
+
+# ----------------------------
+# Métricas por endpoint (histogramas de latência, status, bytes, retries) + OpenMetrics
+# ----------------------------
+# Toda resposta que passa pela Session (http_request, SSE, downloads) é registrada por um
+# hook: latência até os headers (Response.elapsed), status, bytes pelos Content-Length e
+# retries feitos pelo urllib3. Custa um lock + alguns incrementos por request.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_ID_PARENTS = {"conversations", "media", "uploads"}
+_FIXED_SEGMENTS = {"upload", "uploads"}
+
+
+def endpoint_label(url: str) -> str:
+    # /gateway/conversations/abc/messages/delta -> /gateway/conversations/{id}/messages/delta
+    parts = urlsplit(url)
+    if not url.startswith(BASE_URL):
+        return f"external:{parts.netloc}"
+    segments = parts.path.strip("/").split("/")
+    out = [
+        "{id}" if i and segments[i - 1] in _ID_PARENTS and seg not in _FIXED_SEGMENTS else seg
+        for i, seg in enumerate(segments)
+    ]
+    return "/" + "/".join(out)
+
+
+class _Series:
+    __slots__ = ("buckets", "count", "total", "recent", "bytes_in", "bytes_out", "retries", "codes", "errors")
+
+    def __init__(self, n_buckets: int):
+        self.buckets = [0] * (n_buckets + 1)  # último = +Inf
+        self.count = 0
+        self.total = 0.0
+        self.recent: deque[float] = deque(maxlen=1024)  # janela para percentis
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+        self.codes: dict[int, int] = {}
+        self.errors: dict[str, int] = {}
+
+
+class MetricsRegistry:
+    """
+    Registro do processo, por (method, endpoint): histograma de latência com buckets fixos
+    (exportado) e as últimas 1024 latências (percentis do --stats). Thread-safe.
+    """
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.bucket_bounds = buckets
+        self._series: dict[tuple[str, str], _Series] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, method: str, endpoint: str) -> _Series:
+        key = (method, endpoint)
+        s = self._series.get(key)
+        if s is None:
+            s = self._series[key] = _Series(len(self.bucket_bounds))
+        return s
+
+    def observe(self, method: str, endpoint: str, status: int, seconds: float, bytes_in: int = 0, bytes_out: int = 0, retries: int = 0) -> None:
+        idx = bisect_left(self.bucket_bounds, seconds)
+        with self._lock:
+            s = self._get(method, endpoint)
+            s.buckets[idx] += 1
+            s.count += 1
+            s.total += seconds
+            s.recent.append(seconds)
+            s.bytes_in += bytes_in
+            s.bytes_out += bytes_out
+            s.retries += retries
+            s.codes[status] = s.codes.get(status, 0) + 1
+
+    def retry(self, method: str, endpoint: str) -> None:
+        with self._lock:
+            self._get(method, endpoint).retries += 1
+
+    def error(self, method: str, endpoint: str, kind: str) -> None:
+        # Falha sem resposta HTTP (timeout, conexão recusada...)
+        with self._lock:
+            s = self._get(method, endpoint)
+            s.errors[kind] = s.errors.get(kind, 0) + 1
+
+    def percentile(self, method: str, endpoint: str, p: float) -> float | None:
+        with self._lock:
+            s = self._series.get((method, endpoint))
+            recent = sorted(s.recent) if s else []
+        if not recent:
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * p / 100))]
+
+    def summary(self) -> list[dict]:
+        with self._lock:
+            items = [(k, s, sorted(s.recent)) for k, s in self._series.items()]
+        rows = []
+        for (method, endpoint), s, recent in sorted(items, key=lambda x: -x[1].count):
+            pct = lambda p: round(recent[min(len(recent) - 1, int(len(recent) * p / 100))] * 1000, 1) if recent else None  # noqa: E731
+            rows.append(
+                {
+                    "method": method,
+                    "endpoint": endpoint,
+                    "requests": s.count,
+                    "p50_ms": pct(50),
+                    "p95_ms": pct(95),
+                    "p99_ms": pct(99),
+                    "max_ms": round(recent[-1] * 1000, 1) if recent else None,
+                    "codes": dict(sorted(s.codes.items())),
+                    "errors": dict(s.errors),
+                    "retries": s.retries,
+                    "bytes_in": s.bytes_in,
+                    "bytes_out": s.bytes_out,
+                }
+            )
+        return rows
+
+    def openmetrics(self) -> str:
+        with self._lock:
+            series = sorted(
+                (k, list(s.buckets), s.count, s.total, dict(s.codes), dict(s.errors), s.bytes_in, s.bytes_out, s.retries)
+                for k, s in self._series.items()
+            )
+        h = "gateway_http_request_duration_seconds"
+        lines = [f"# TYPE {h} histogram", f"# UNIT {h} seconds", f"# HELP {h} Latência até os headers da resposta."]
+        for key, buckets, count, total, *_ in series:
+            labels = _om_labels(key)
+            cumulative = 0
+            for bound, n in zip((*self.bucket_bounds, "+Inf"), buckets):
+                cumulative += n
+                lines.append(f'{h}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{h}_count{{{labels}}} {count}")
+            lines.append(f"{h}_sum{{{labels}}} {total:.6f}")
+
+        def counter(name: str, unit: str | None, help_text: str, samples) -> None:
+            lines.append(f"# TYPE {name} counter")
+            if unit:
+                lines.append(f"# UNIT {name} {unit}")
+            lines.append(f"# HELP {name} {help_text}")
+            lines.extend(f"{name}_total{{{labels}}} {value}" for labels, value in samples)
+
+        counter(
+            "gateway_http_responses", None, "Respostas por status HTTP.",
+            [(f'{_om_labels(k)},code="{code}"', n) for k, _, _, _, codes, *_ in series for code, n in sorted(codes.items())],
+        )
+        counter(
+            "gateway_http_errors", None, "Falhas sem resposta HTTP, por tipo de exceção.",
+            [(f'{_om_labels(k)},error="{kind}"', n) for k, _, _, _, _, errors, *_ in series for kind, n in sorted(errors.items())],
+        )
+        counter("gateway_http_received_bytes", "bytes", "Bytes recebidos (Content-Length das respostas).", [(_om_labels(x[0]), x[6]) for x in series])
+        counter("gateway_http_sent_bytes", "bytes", "Bytes enviados (Content-Length dos requests).", [(_om_labels(x[0]), x[7]) for x in series])
+        counter("gateway_http_retries", None, "Retentativas (urllib3 e 429/503 com Retry-After).", [(_om_labels(x[0]), x[8]) for x in series])
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _om_labels(key: tuple[str, str]) -> str:
+    method, endpoint = key
+    return f'method="{method}",endpoint="{_om_escape(endpoint)}"'
+
+
+def _om_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = MetricsRegistry()
+
+
+def _content_length(headers) -> int:
+    value = headers.get("Content-Length")
+    return int(value) if value and value.isdigit() else 0
+
+
+def _observe_response(r: requests.Response, *args, **kwargs) -> None:
+    retries = r.raw.retries if r.raw is not None else None
+    for registry in metrics_sinks():
+        registry.observe(
+            r.request.method,
+            endpoint_label(r.request.url),
+            r.status_code,
+            r.elapsed.total_seconds(),
+            bytes_in=_content_length(r.headers),
+            bytes_out=_content_length(r.request.headers),
+            retries=len(retries.history) if retries is not None else 0,
+        )
+    scope = _scope.get()
+    if scope is not None:
+        # Conexão ainda sem marca = aberta para este request; com marca = keep-alive reaproveitado
+        conn = getattr(r.raw, "_connection", None)
+        scope.count("requests")
+        if conn is not None and not getattr(conn, "_gateway_seen", False):
+            conn._gateway_seen = True
+            scope.count("connections_opened")
+
+
+def write_metrics_file(path: str) -> None:
+    # Escrita atômica: o coletor nunca lê um arquivo pela metade
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(METRICS.openmetrics())
+    os.replace(tmp, path)
+
+
+class MetricsExporter:
+    """Reescreve o arquivo OpenMetrics a cada `interval` segundos, e uma última vez no stop()."""
+    def __init__(self, path: str, interval: float = METRICS_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+
+    def start(self) -> "MetricsExporter":
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                write_metrics_file(self.path)
+            except OSError as e:
+                print(f"[metrics] falha ao escrever {self.path}: {e}", file=sys.stderr)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        write_metrics_file(self.path)
+
+
+def print_stats(scope: "CommandScope | None" = None) -> None:
+    # Com escopo: só o que o comando fez (no daemon os registros globais somam todos os clientes).
+    # Estado do circuito e timeout adaptativo são do processo e saem como estão.
+    counters = scope.counters if scope is not None else None
+    for family, st in BREAKERS.stats().items():
+        if counters is not None:
+            st.update(opened=counters.get(f"circuit_opened_{family}", 0), rejected=counters.get(f"circuit_rejected_{family}", 0))
+        if st["opened"] or st["rejected"] or st["timeout_s"]:
+            print(
+                f"[circuit] {family}: estado={st['state']} aberturas={st['opened']} rejeitados={st['rejected']} "
+                f"timeout={st['timeout_s'] or 'fixo'}s",
+                file=sys.stderr,
+            )
+    hs = HEDGER.stats if counters is None else {k: counters.get(f"hedge_{k}", 0) for k in HEDGER.stats}
+    if hs["requests"] and HEDGER.families:
+        print(
+            f"[hedge] {','.join(sorted(HEDGER.families))}: requests={hs['requests']} hedges={hs['hedged']} "
+            f"({hs['hedged'] / hs['requests']:.1%}) hedge_venceu={hs['hedge_won']} fora_do_orçamento={hs['over_budget']}",
+            file=sys.stderr,
+        )
+    rows = (METRICS if scope is None else scope.metrics).summary()
+    if not rows:
+        return
+    print(f"{'método':<6} {'endpoint':<48} {'reqs':>6} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'maxms':>8} {'retries':>7}  status/erros", file=sys.stderr)
+    for r in rows:
+        outcomes = " ".join(f"{c}={n}" for c, n in {**r["codes"], **r["errors"]}.items())
+        print(
+            f"{r['method']:<6} {r['endpoint']:<48} {r['requests']:>6} {r['p50_ms'] or '-':>8} {r['p95_ms'] or '-':>8} "
+            f"{r['p99_ms'] or '-':>8} {r['max_ms'] or '-':>8} {r['retries']:>7}  {outcomes}",
+            file=sys.stderr,
+        )
+
+
+# ----------------------------
+# Rate limiting (token bucket por família de endpoint e por phone_number_id)
+# ----------------------------
+def endpoint_family(path: str) -> str:
+    if path.startswith("/gateway/send"):
+        return "send"
+    if path.endswith("/messages/delta"):
+        return "delta"
+    if path.startswith("/gateway/media"):
+        return "media"
+    return "read"
+
+
+def parse_rate_limits(spec: str | None) -> dict[str, float]:
+    # "send=20,delta=10" -> {"send": 20.0, "delta": 10.0}
+    limits = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            limits[k.strip()] = float(v)
+    return limits
+
+
+class TokenBucket:
+    """
+    Bucket com taxa configurada (teto) e taxa efetiva adaptativa (AIMD):
+    cada 429 corta a taxa efetiva pela metade e pausa o bucket pelo Retry-After;
+    cada sucesso devolve um pouco de taxa. Assim a vazão converge para a
+    capacidade real do gateway em vez de alternar entre rajada e erro.
+    rate=None = sem limite até o primeiro 429 (aí parte da vazão observada).
+    """
+    def __init__(self, rate: float | None, burst: float | None = None, min_rate: float = 0.2):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = burst or max(1.0, rate or 1.0)
+        self.tokens = self.capacity
+        self.paused_until = 0.0
+        self._last_cut = float("-inf")
+        self._updated = time.monotonic()
+        self._recent: deque[float] = deque(maxlen=4096)
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait_s = self.paused_until - now
+                elif not self.rate or self.tokens >= 1:
+                    if self.rate:
+                        self.tokens -= 1
+                    self._recent.append(now)
+                    return
+                else:
+                    wait_s = (1 - self.tokens) / self.rate
+            time.sleep(wait_s)
+
+    def throttled(self, wait_s: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, now + wait_s)
+            # Vários requests em voo recebem 429 juntos: é um único evento de congestionamento,
+            # então a taxa só é cortada uma vez por janela
+            if now < self._last_cut + max(wait_s, 1.0):
+                return
+            self._last_cut = now
+            if self.rate is None:
+                observed = sum(1 for t in self._recent if now - t <= 1.0)
+                self.rate = float(max(observed, 1))
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Depois do primeiro 429 a vazão passa a ser espaçada (sem rajadas)
+            self.capacity = 1.0
+
+    def succeeded(self) -> None:
+        if self.rate is None or self.rate == self.max_rate:
+            return
+        with self._lock:
+            # Aumento aditivo de ~2 req/s por segundo de sucesso (step por request = 2/rate)
+            step = 2.0 / max(self.rate, 1.0)
+            self.rate = self.rate + step if self.max_rate is None else min(self.max_rate, self.rate + step)
+
+    def pause(self, wait_s: float) -> None:
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + wait_s)
+
+
+class RateLimiter:
+    """
+    Registro compartilhado de buckets: um por família de endpoint (send, delta, read, media)
+    e, para /gateway/send, um por phone_number_id. Todas as threads do processo usam o mesmo.
+    """
+    def __init__(self, endpoint_rates: dict[str, float] | None = None, phone_rate: float | None = None):
+        self.endpoint_rates = dict(endpoint_rates or {})
+        self.phone_rate = phone_rate
+        self._buckets: dict[tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, endpoint_rates: dict[str, float] | None = None, phone_rate: float | None = None) -> None:
+        with self._lock:
+            if endpoint_rates:
+                self.endpoint_rates.update(endpoint_rates)
+            if phone_rate is not None:
+                self.phone_rate = phone_rate or None
+            self._buckets.clear()
+
+    def _bucket(self, kind: str, key: str) -> TokenBucket:
+        with self._lock:
+            b = self._buckets.get((kind, key))
+            if b is None:
+                rate = self.endpoint_rates.get(key) if kind == "endpoint" else self.phone_rate
+                b = self._buckets[(kind, key)] = TokenBucket(rate)
+            return b
+
+    def buckets_for(self, family: str, phone_number_id: str | None) -> list[TokenBucket]:
+        buckets = [self._bucket("endpoint", family)]
+        if family == "send":
+            buckets.append(self._bucket("phone", phone_number_id or "default"))
+        return buckets
+
+    def acquire(self, family: str, phone_number_id: str | None = None) -> None:
+        for b in self.buckets_for(family, phone_number_id):
+            b.acquire()
+
+    def observe(self, family: str, phone_number_id: str | None, response: requests.Response) -> float | None:
+        # Devolve quanto esperar se o gateway sinalizou limite (429, ou 503 com Retry-After)
+        buckets = self.buckets_for(family, phone_number_id)
+        target = buckets[-1]  # em send, o limite mais provável é o do número
+        wait_s = rate_limit_wait(response)
+        if wait_s is not None:
+            target.throttled(wait_s)
+            return wait_s
+        # Cota esgotada anunciada em header: pausa antes de tomar o 429
+        remaining = response.headers.get("X-RateLimit-Remaining") or response.headers.get("RateLimit-Remaining")
+        reset = _rate_limit_reset(response)
+        if remaining is not None and remaining.strip() == "0" and reset:
+            target.pause(reset)
+        for b in buckets:
+            b.succeeded()
+        return None
+
+
+def _rate_limit_reset(response: requests.Response) -> float | None:
+    value = response.headers.get("X-RateLimit-Reset") or response.headers.get("RateLimit-Reset")
+    if not value:
+        return None
+    try:
+        n = float(value)
+    except ValueError:
+        return None
+    # Alguns gateways mandam epoch, outros segundos restantes
+    return max(0.0, n - time.time()) if n > 1e9 else max(0.0, n)
+
+
+def rate_limit_wait(response: requests.Response) -> float | None:
+    if response.status_code == 429:
+        return parse_retry_after(response) or _rate_limit_reset(response) or 1.0
+    if response.status_code == 503:
+        return parse_retry_after(response)
+    return None
+
+
+RATE_LIMITER = RateLimiter(
+    parse_rate_limits(os.getenv("GATEWAY_RATE_LIMITS")),
+    float(os.getenv("GATEWAY_PHONE_RATE")) if os.getenv("GATEWAY_PHONE_RATE") else None,
+)
+
+
+# ----------------------------
+# Escopo do comando (o que é de um comando, não do processo)
+# ----------------------------
+# No daemon vários comandos rodam juntos no mesmo processo. Pool HTTP, RATE_LIMITER, breakers
+# e hedger são do processo e nenhum comando os reconfigura; o que o --stats mostra e o teto de
+# envio pedido pelo próprio comando (--rate de send-bulk/outbox-drain) ficam no escopo, que
+# acompanha o comando pelas threads dele (ScopedThreadPool copia o contexto a cada tarefa).
+class CommandScope:
+    def __init__(self, phone_rate: float | None = None, compact: bool = False):
+        self.metrics = MetricsRegistry()
+        self.counters: dict[str, int] = {}
+        self.phone_rate = phone_rate
+        self.compact = compact
+        self._phone_buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def cap_send(self, phone_number_id: str | None) -> None:
+        # Teto do comando por número, aplicado além dos buckets do RATE_LIMITER
+        if not self.phone_rate:
+            return
+        key = phone_number_id or "default"
+        with self._lock:
+            bucket = self._phone_buckets.get(key)
+            if bucket is None:
+                bucket = self._phone_buckets[key] = TokenBucket(self.phone_rate)
+        bucket.acquire()
+
+
+_scope: contextvars.ContextVar[CommandScope | None] = contextvars.ContextVar("gateway_command_scope", default=None)
+
+
+def scope_count(key: str, n: int = 1) -> None:
+    scope = _scope.get()
+    if scope is not None:
+        scope.count(key, n)
+
+
+def metrics_sinks() -> tuple[MetricsRegistry, ...]:
+    scope = _scope.get()
+    return (METRICS,) if scope is None else (METRICS, scope.metrics)
+
+
+def limit_command_sends(phone_rate: float | None) -> None:
+    # Envios/s por número só para o comando atual (0/None = sem teto próprio)
+    scope = _scope.get()
+    if scope is None:
+        scope = CommandScope()
+        _scope.set(scope)
+    scope.phone_rate = phone_rate or None
+
+
+class ScopedThreadPool(ThreadPoolExecutor):
+    # Cada tarefa roda no contexto de quem a submeteu: os requests dos workers contam no comando certo
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# ----------------------------
+# Circuit breaker e timeout adaptativo (por família de endpoint)
+# ----------------------------
+class CircuitOpen(requests.RequestException):
+    """Circuito aberto: o request nem saiu. retry_in = segundos até a próxima prova."""
+    def __init__(self, family: str, retry_in: float):
+        super().__init__(f"circuito {family} aberto (gateway falhando): nova prova em {retry_in:.1f}s")
+        self.family = family
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    closed: requests normais; N falhas seguidas (erro de conexão, timeout ou 5xx) abrem o circuito.
+    open: todo request falha na hora com CircuitOpen até o cooldown passar.
+    half_open: passa um único request de prova; sucesso fecha, falha reabre com o cooldown dobrado.
+    Guarda também a latência dos sucessos: o timeout vira factor x p99, entre min_timeout e o pedido.
+    """
+    FAILURE_STATUS = (500, 502, 503, 504)
+
+    def __init__(
+        self,
+        family: str,
+        failure_threshold: int = BREAKER_FAILURES,
+        cooldown: float = BREAKER_COOLDOWN,
+        max_cooldown: float = 60.0,
+        timeout_factor: float = TIMEOUT_FACTOR,
+        min_timeout: float = TIMEOUT_MIN,
+    ):
+        self.family = family
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.cooldown = cooldown
+        self.open_until = 0.0
+        self.stats = {"opened": 0, "rejected": 0}
+        self._probing = False
+        self._latencies: deque[float] = deque(maxlen=256)
+        self._lock = threading.Lock()
+
+    def before_request(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if self.state == "open" and now < self.open_until:
+                self.stats["rejected"] += 1
+                scope_count(f"circuit_rejected_{self.family}")
+                raise CircuitOpen(self.family, self.open_until - now)
+            if self._probing:
+                # Outra thread já está fazendo a prova
+                self.stats["rejected"] += 1
+                scope_count(f"circuit_rejected_{self.family}")
+                raise CircuitOpen(self.family, min(self.cooldown, 1.0))
+            self.state = "half_open"
+            self._probing = True
+
+    def on_response(self, r: requests.Response) -> None:
+        if r.status_code in self.FAILURE_STATUS:
+            self.on_failure()
+            return
+        with self._lock:
+            self._latencies.append(r.elapsed.total_seconds())
+            self.failures = 0
+            self._probing = False
+            if self.state != "closed":
+                self.state = "closed"
+                self.cooldown = self.base_cooldown
+                print(f"[circuit] {self.family}: gateway respondeu, circuito fechado", file=sys.stderr)
+
+    def on_failure(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._probing = False
+            if self.state == "half_open":
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self._open(f"prova falhou, nova em {self.cooldown:.0f}s")
+                return
+            self.failures += 1
+            if self.state == "closed" and self.failures >= self.failure_threshold:
+                self._open(f"{self.failures} falhas seguidas, prova em {self.cooldown:.0f}s")
+
+    def on_abort(self) -> None:
+        # Request interrompido do nosso lado (Ctrl+C): não conta, mas libera a prova
+        with self._lock:
+            self._probing = False
+
+    def _open(self, reason: str) -> None:
+        self.state = "open"
+        self.open_until = time.monotonic() + self.cooldown
+        self.stats["opened"] += 1
+        scope_count(f"circuit_opened_{self.family}")
+        print(f"[circuit] {self.family}: circuito aberto ({reason})", file=sys.stderr)
+
+    def adaptive_timeout(self) -> float | None:
+        # None = sem amostras suficientes (ou fator 0): vale o timeout pedido pelo chamador
+        if self.timeout_factor <= 0 or len(self._latencies) < 20:
+            return None
+        with self._lock:
+            recent = sorted(self._latencies)
+        p99 = recent[min(len(recent) - 1, int(len(recent) * 0.99))]
+        return max(self.min_timeout, self.timeout_factor * p99)
+
+    def timeout(self, requested: float) -> float:
+        adaptive = self.adaptive_timeout()
+        return requested if adaptive is None else min(requested, adaptive)
+
+
+class BreakerRegistry:
+    # Um breaker por família; media fica fora do timeout adaptativo (upload grande leva o que precisar)
+    FIXED_TIMEOUT_FAMILIES = ("media",)
+
+    def __init__(self):
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, family: str) -> CircuitBreaker:
+        with self._lock:
+            b = self._breakers.get(family)
+            if b is None:
+                factor = 0.0 if family in self.FIXED_TIMEOUT_FAMILIES else TIMEOUT_FACTOR
+                b = self._breakers[family] = CircuitBreaker(family, timeout_factor=factor)
+            return b
+
+    def stats(self) -> dict[str, dict]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        stats = {}
+        for b in breakers:
+            adaptive = b.adaptive_timeout()
+            stats[b.family] = {"state": b.state, **b.stats, "timeout_s": round(adaptive, 2) if adaptive else None}
+        return stats
+
+
+BREAKERS = BreakerRegistry()
+
+
+def retry_hint(e: requests.RequestException) -> float | None:
+    # Quanto esperar antes de tentar de novo, quando quem falhou disse (Retry-After ou circuito aberto)
+    if isinstance(e, CircuitOpen):
+        return e.retry_in
+    if isinstance(e, requests.HTTPError):
+        return parse_retry_after(e.response)
+    return None
+
+
+# ----------------------------
+# Hedging de GETs idempotentes (opt-in por família: --hedge delta)
+# ----------------------------
+class Hedger:
+    """
+    Se o request não respondeu até o p95 observado do endpoint (latência ponta a ponta
+    dos requests primários, incluindo o corpo), dispara um segundo
+    (outra conexão do pool) e fica com o que terminar primeiro. O custo extra é limitado
+    por um bucket: cada request rende `budget` fichas (até `burst`), cada hedge gasta 1,
+    então no regime o extra nunca passa de budget x requests. O perdedor termina em
+    background e o resultado é descartado (GET: sem efeito colateral).
+    """
+    def __init__(self, families: str = HEDGE_FAMILIES, budget: float = HEDGE_BUDGET, burst: float = 10.0, min_samples: int = 20):
+        self.families: set[str] = set()
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.stats = {"requests": 0, "hedged": 0, "hedge_won": 0, "over_budget": 0}
+        self._tokens = 1.0
+        self._latencies: dict[str, deque[float]] = {}
+        self._pool: ScopedThreadPool | None = None
+        self._lock = threading.Lock()
+        self.configure(families, budget)
+
+    def configure(self, families: str | None = None, budget: float | None = None) -> None:
+        if families is not None:
+            self.families = {f.strip() for f in families.split(",") if f.strip()}
+        if budget is not None:
+            self.budget = budget
+
+    def enabled(self, family: str) -> bool:
+        return family in self.families and self.budget > 0
+
+    def _executor(self) -> ScopedThreadPool:
+        with self._lock:
+            if self._pool is None:
+                # Primário + backup por chamador, mais perdedores ainda presos na cauda lenta:
+                # pool apertado faria o próprio hedge entrar em fila
+                self._pool = ScopedThreadPool(max_workers=max(4 * POOL_SIZE, 32), thread_name_prefix="hedge")
+            return self._pool
+
+    def _delay(self, label: str) -> float | None:
+        # p95 só depois de amostras suficientes; antes disso não há hedge
+        with self._lock:
+            recent = sorted(self._latencies.get(label) or ())
+        if len(recent) < self.min_samples:
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+
+    def _observe(self, label: str, t0: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(label, deque(maxlen=512)).append(time.perf_counter() - t0)
+
+    def _count(self, key: str) -> None:
+        # Chamado com o lock em mãos: total do processo + escopo do comando (--stats)
+        self.stats[key] += 1
+        scope_count(f"hedge_{key}")
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._count("hedged")
+                return True
+            self._count("over_budget")
+            return False
+
+    def call(self, url: str, fn):
+        label = endpoint_label(url)
+        with self._lock:
+            self._count("requests")
+            self._tokens = min(self.burst, self._tokens + self.budget)
+        delay = self._delay(label)
+        t0 = time.perf_counter()
+        if delay is None:
+            try:
+                return fn()
+            finally:
+                self._observe(label, t0)
+        pool = self._executor()
+        primary = pool.submit(fn)
+        # Latência do primário mesmo quando o hedge vence: é a distribuição sem hedge que define o p95
+        primary.add_done_callback(lambda _: self._observe(label, t0))
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_token():
+            return primary.result()
+        backup = pool.submit(fn)
+        done, pending = wait([primary, backup], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and pending:
+            # O primeiro a terminar falhou: vale o outro
+            winner = pending.pop()
+        if winner is backup:
+            with self._lock:
+                self._count("hedge_won")
+        return winner.result()
+
+
+HEDGER = Hedger()
+
+
+# ----------------------------
+# Cache HTTP de GET condicional (ETag / Last-Modified)
+# ----------------------------
+def _max_age(cache_control: str) -> float | None:
+    for directive in cache_control.lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        if name == "max-age" and value.strip().isdigit():
+            return float(value)
+    return None
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str | None
+    last_modified: str | None
+    stored_at: float
+    fresh_until: float
+
+
+class HttpCache:
+    """
+    Respostas de GET com seus validadores, em LRU limitado por bytes.
+    Dentro do max-age do servidor a resposta sai direto da memória; depois disso vai
+    um GET condicional (If-None-Match / If-Modified-Since) e um 304 reaproveita o
+    corpo guardado. Nenhuma entrada vive mais que ttl segundos; no-store não é guardado.
+    O corpo fica em bytes e é decodificado a cada uso: quem chama pode mutar o dict.
+    """
+    def __init__(self, ttl: float = HTTP_CACHE_TTL, max_bytes: int = int(HTTP_CACHE_MB * 1024 * 1024)):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"fresh": 0, "not_modified": 0, "miss": 0, "bytes_saved": 0}
+
+    @staticmethod
+    def key(path: str, params: dict) -> tuple:
+        return (path, tuple(sorted((k, str(v)) for k, v in params.items())))
+
+    def lookup(self, key: tuple) -> CachedResponse | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry.stored_at > self.ttl:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def fresh(self, entry: CachedResponse) -> bool:
+        if entry.fresh_until <= time.time():
+            return False
+        self._count("fresh", len(entry.body))
+        return True
+
+    def store(self, key: tuple, r: requests.Response) -> None:
+        cache_control = r.headers.get("Cache-Control") or ""
+        etag = r.headers.get("ETag")
+        last_modified = r.headers.get("Last-Modified")
+        max_age = _max_age(cache_control)
+        body = r.content
+        with self._lock:
+            self._stats["miss"] += 1
+            if key in self._entries:
+                self._drop(key)
+            if "no-store" in cache_control.lower() or not (etag or last_modified or max_age):
+                return
+            if len(body) > self.max_bytes:
+                return
+            now = time.time()
+            self._entries[key] = CachedResponse(body, etag, last_modified, now, now + (max_age or 0))
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def revalidated(self, key: tuple, entry: CachedResponse, r: requests.Response) -> None:
+        # 304: o corpo guardado continua valendo; renova validade e validadores
+        max_age = _max_age(r.headers.get("Cache-Control") or "")
+        now = time.time()
+        with self._lock:
+            entry.stored_at = now
+            entry.fresh_until = now + (max_age or 0)
+            entry.etag = r.headers.get("ETag") or entry.etag
+            entry.last_modified = r.headers.get("Last-Modified") or entry.last_modified
+        self._count("not_modified", len(entry.body))
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    def _count(self, kind: str, saved: int) -> None:
+        with self._lock:
+            self._stats[kind] += 1
+            self._stats["bytes_saved"] += saved
+        scope_count(f"http_cache_{kind}")
+        scope_count("http_cache_bytes_saved", saved)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "bytes": self._bytes}
+
+
+HTTP_CACHE = HttpCache()
+
+
+# ----------------------------
+# HTTP helpers
+# ----------------------------
+def _phone_number_id_of(kwargs: dict) -> str | None:
+    for key in ("json", "params"):
+        value = kwargs.get(key)
+        if isinstance(value, dict) and value.get("phone_number_id"):
+            return value["phone_number_id"]
+    return None
+
+
+def _safe_to_repeat(method: str, kwargs: dict) -> bool:
+    # GET é idempotente; POST JSON com message_id é deduplicado pelo gateway.
+    # Corpo em stream (upload) não pode ser reenviado daqui.
+    if method in ("GET", "HEAD"):
+        return True
+    if "data" in kwargs or "files" in kwargs:
+        return False
+    payload = kwargs.get("json")
+    return isinstance(payload, dict) and bool(payload.get("message_id"))
+
+
+def http_request(method: str, path: str, *, timeout: float, headers: dict | None = None, **kwargs) -> requests.Response:
+    url = f"{BASE_URL}{path}"
+    h = dict(HEADERS)
+    if headers:
+        h.update(headers)
+    family = endpoint_family(path)
+    phone_number_id = _phone_number_id_of(kwargs)
+    retries = RATE_RETRIES if _safe_to_repeat(method, kwargs) else 0
+
+    breaker = BREAKERS.get(family)
+    scope = _scope.get()
+
+    for attempt in range(retries + 1):
+        if scope is not None and family == "send":
+            scope.cap_send(phone_number_id)
+        RATE_LIMITER.acquire(family, phone_number_id)
+        breaker.before_request()
+        try:
+            r = get_session().request(method, url, headers=h, timeout=breaker.timeout(timeout), **kwargs)
+        except requests.RequestException as e:
+            breaker.on_failure()
+            for registry in metrics_sinks():
+                registry.error(method, endpoint_label(url), type(e).__name__)
+            raise
+        except BaseException:
+            breaker.on_abort()
+            raise
+        breaker.on_response(r)
+        throttled = RATE_LIMITER.observe(family, phone_number_id, r)
+        if throttled is None or attempt == retries:
+            break
+        # O bucket já está pausado pelo Retry-After: o próximo acquire espera o tempo certo
+        for registry in metrics_sinks():
+            registry.retry(method, endpoint_label(url))
+        r.close()
+    r.raise_for_status()
+    return r
+
+
+def http_get(path: str, params: dict | None = None, conditional: bool = False) -> dict:
+    # conditional: leitura que costuma repetir sem mudanças (listas, estado); passa pelo HTTP_CACHE
+    params = params or {}
+    if not conditional or HTTP_CACHE.max_bytes <= 0:
+        if HEDGER.enabled(endpoint_family(path)):
+            # O corpo também entra na corrida: decode_json dentro da thread do request
+            return HEDGER.call(f"{BASE_URL}{path}", lambda: decode_json(http_request("GET", path, params=params, timeout=30, stream=True)))
+        r = http_request("GET", path, params=params, timeout=30, stream=True)
+        return decode_json(r)
+
+    key = HTTP_CACHE.key(path, params)
+    entry = HTTP_CACHE.lookup(key)
+    if entry and HTTP_CACHE.fresh(entry):
+        return json_loads(entry.body)
+    headers = {}
+    if entry and entry.etag:
+        headers["If-None-Match"] = entry.etag
+    if entry and entry.last_modified:
+        headers["If-Modified-Since"] = entry.last_modified
+    r = http_request("GET", path, headers=headers, params=params, timeout=30)
+    if r.status_code == 304 and entry:
+        HTTP_CACHE.revalidated(key, entry, r)
+        return json_loads(entry.body)
+    HTTP_CACHE.store(key, r)
+    return decode_json(r)
+
+
+def http_post_json(path: str, payload: dict | None = None, headers: dict | None = None) -> dict:
+    h = dict(headers or {})
+    if payload is not None:
+        h["Content-Type"] = "application/json"
+    r = http_request("POST", path, headers=h, json=payload, timeout=60)
+    return decode_json(r)
+
+
+def compact_payload(payload: dict) -> dict:
+    return {k: v for k, v in payload.items() if v is not None}
+
+
+_message_seq = itertools.count()
+
+
+def new_message_id(prefix: str = "cli") -> str:
+    # ns + pid + contador: único mesmo com vários envios no mesmo segundo/processo
+    return f"{prefix}-{time.time_ns():x}-{os.getpid():x}-{next(_message_seq)}"
+
+
+# ----------------------------
+# Gateway: Send
+# ----------------------------
+def send_media(
+    to: str,
+    media_asset_id: str,
+    msg_type: str,
+    message_id: str | None = None,
+    caption: str | None = None,
+    phone_number_id: str | None = None,
+) -> dict:
+    payload = compact_payload(
+        {
+            "to": to,
+            "type": msg_type,  # "audio" ou "document"
+            "media_asset_id": media_asset_id,
+            "message_id": message_id or new_message_id(),
+            "caption": caption,
+            "phone_number_id": phone_number_id,
+        }
+    )
+    return http_post_json("/gateway/send", payload)
+
+
+def send_text(to: str, text: str, message_id: str | None = None, phone_number_id: str | None = None) -> dict:
+    payload = compact_payload(
+        {
+            "to": to,
+            "type": "text",
+            "text": text,
+            "message_id": message_id or new_message_id(),
+            "phone_number_id": phone_number_id,
+        }
+    )
+    return http_post_json("/gateway/send", payload)
+
+
+def send_template(
+    to: str,
+    template_name: str,
+    language: str = "pt_BR",
+    message_id: str | None = None,
+    phone_number_id: str | None = None,
+    components: list[dict] | None = None,
+) -> dict:
+    template = {"name": template_name, "language": language}
+    if components:
+        template["components"] = components
+    payload = compact_payload(
+        {
+            "to": to,
+            "type": "template",
+            "template": template,
+            "message_id": message_id or new_message_id(),
+            "phone_number_id": phone_number_id,
+        }
+    )
+    return http_post_json("/gateway/send", payload)
+
+
+def template_components(row: dict) -> list[dict] | None:
+    # Variáveis do corpo ({{1}}, {{2}}...): "params" (lista, JSONL/CLI) ou colunas param1..paramN (CSV).
+    # "components" (JSONL) vai como está, para header, botões etc.
+    if row.get("components"):
+        return row["components"]
+    params = row.get("params")
+    if params is None:
+        keys = sorted((k for k in row if k.startswith("param") and k[5:].isdigit()), key=lambda k: int(k[5:]))
+        params = [row[k] for k in keys]
+    if not params:
+        return None
+    return [{"type": "body", "parameters": [{"type": "text", "text": str(p)} for p in params]}]
+
+
+def get_conversation_state(external_id: str, phone_number_id: str | None = None) -> dict:
+    params = {}
+    if phone_number_id:
+        params["phone_number_id"] = phone_number_id
+    return http_get(f"/gateway/conversations/{external_id}", params=params, conditional=True)
+
+
+def iso_now_utc() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# ----------------------------
+# Gateway: Conversations & Messages
+# ----------------------------
+def list_conversations(limit: int = 20, phone_number_id: str | None = None, cursor: str | None = None) -> dict:
+    params = {"limit": limit}
+    if phone_number_id:
+        params["phone_number_id"] = phone_number_id
+    if cursor:
+        params["cursor"] = cursor
+    return http_get("/gateway/conversations", params=params, conditional=True)
+
+
+def list_messages(conversation_id: str, limit: int = 50, cursor: str | None = None) -> dict:
+    params = {"limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    return http_get(f"/gateway/conversations/{conversation_id}/messages", params=params)
+
+
+def get_delta(conversation_id: str, since_cursor: str | None, updated_since: str | None, limit: int = 200) -> dict:
+    params = {"limit": limit}
+    if since_cursor:
+        params["since_cursor"] = since_cursor
+    if updated_since:
+        params["updated_since"] = updated_since
+    return http_get(f"/gateway/conversations/{conversation_id}/messages/delta", params=params)
+
+
+# ----------------------------
+# Paginação automática (streaming)
+# ----------------------------
+def iter_pages(fetch_page, cursor: str | None = None):
+    # fetch_page(cursor) -> página com "items" e "next_cursor".
+    # A próxima página é buscada numa thread enquanto o chamador consome a atual;
+    # em memória ficam no máximo 2 páginas, independente do tamanho da conversa.
+    seen: set[str] = set()
+    with ScopedThreadPool(max_workers=1) as prefetch:
+        fut = prefetch.submit(fetch_page, cursor)
+        while fut is not None:
+            page = fut.result()
+            nxt = page.get("next_cursor")
+            fut = None
+            if nxt and nxt not in seen:
+                seen.add(nxt)
+                fut = prefetch.submit(fetch_page, nxt)
+            yield page
+
+
+def iter_messages(conversation_id: str, page_size: int = 200, cursor: str | None = None):
+    for page in iter_pages(lambda c: list_messages(conversation_id, limit=page_size, cursor=c), cursor):
+        yield from page.get("items", [])
+
+
+def iter_conversations(page_size: int = 100, phone_number_id: str | None = None):
+    for page in iter_pages(lambda c: list_conversations(limit=page_size, phone_number_id=phone_number_id, cursor=c)):
+        yield from page.get("items", [])
+
+
+def export_messages_ndjson(out, conversation_ids, page_size: int = 200, cursor: str | None = None) -> int:
+    n = 0
+    for conversation_id in conversation_ids:
+        for it in iter_messages(conversation_id, page_size=page_size, cursor=cursor):
+            if "conversation_id" not in it:
+                it = {**it, "conversation_id": conversation_id}
+            out.write(json_dumps(it) + "\n")
+            n += 1
+    out.flush()
+    return n
+
+
+MUTABLE_FIELDS = ["status", "updated_at", "error_message", "content", "provider_message_id", "metadata"]
+
+
+def upsert(local_by_id: dict[str, dict], item: dict) -> None:
+    msg_id = item.get("id")
+    if not msg_id:
+        return
+
+    if msg_id in local_by_id:
+        # Atualiza campos mutáveis
+        for k in MUTABLE_FIELDS:
+            if k in item:
+                local_by_id[msg_id][k] = item[k]
+    else:
+        local_by_id[msg_id] = item
+
+
+def cursor_of(m: dict) -> str:
+    # Mesmo formato de since_cursor que o delta devolve em next_since_cursor
+    return f"{m.get('created_at')}|{m.get('id')}"
+
+
+def message_sort_key(m: dict) -> tuple[str, str]:
+    return (m.get("created_at") or "", m.get("id") or "")
+
+
+BODY_MAX = 512  # o render corta na largura do terminal; o resto do conteúdo não precisa ficar em memória
+
+
+def message_body(mtype: str, content) -> str:
+    # Texto
+    if isinstance(content, dict) and "text" in content:
+        return content.get("text", "")
+
+    # Placeholder de mídia
+    if isinstance(content, dict) and content.get("media_asset_id"):
+        fname = content.get("file_name") or "media"
+        return f"[MEDIA {mtype}] {fname} (media_asset_id={content.get('media_asset_id')})"
+
+    return str(content)[:120]
+
+
+def _intern(value: str | None) -> str:
+    # direction/status/message_type se repetem em todas as mensagens: 1 objeto str por valor
+    return sys.intern(value) if isinstance(value, str) else "?"
+
+
+@dataclass(slots=True)
+class MessageRecord:
+    # Só o que o render usa; o JSON completo fica no LocalCache (quando habilitado)
+    id: str
+    created_at: str
+    updated_at: str
+    direction: str
+    message_type: str
+    status: str
+    body: str
+    revision: int = 0
+
+    @classmethod
+    def from_item(cls, item: dict) -> "MessageRecord":
+        mtype = _intern(item.get("message_type"))
+        return cls(
+            id=item["id"],
+            created_at=item.get("created_at") or "",
+            updated_at=item.get("updated_at") or "",
+            direction=_intern(item.get("direction")),
+            message_type=mtype,
+            status=_intern(item.get("status")),
+            body=message_body(mtype, item.get("content") or {})[:BODY_MAX],
+        )
+
+    def apply(self, item: dict) -> bool:
+        # Mesma regra do upsert: só campos mutáveis mudam; devolve se algo visível mudou
+        changed = False
+        if "status" in item and item["status"] != self.status:
+            self.status = _intern(item["status"])
+            changed = True
+        if "updated_at" in item and (item["updated_at"] or "") != self.updated_at:
+            self.updated_at = item["updated_at"] or ""
+            changed = True
+        if "content" in item:
+            body = message_body(self.message_type, item["content"] or {})[:BODY_MAX]
+            if body != self.body:
+                self.body = body
+                changed = True
+        return changed
+
+    def cursor(self) -> str:
+        return f"{self.created_at}|{self.id}"
+
+
+class MessageStore:
+    """
+    Registros compactos por id + índice ordenado por (created_at, id).
+    created_at não é campo mutável, então a chave de uma mensagem nunca muda: cada
+    mensagem entra no índice uma vez e tail(n) lê só as últimas n chaves.
+    Custo do insert: mensagem mais nova que todas (o caso do delta) é append, O(1);
+    fora de ordem (histórico, replay) é insort: busca O(log n) + deslocamento O(n) da lista.
+    Com capacity, só as capacity mensagens mais recentes ficam em memória: as mais
+    antigas são descartadas em lote (o LocalCache guarda o histórico completo).
+    """
+    def __init__(self, capacity: int | None = None):
+        self.by_id: dict[str, MessageRecord] = {}
+        self._keys: list[tuple[str, str]] = []
+        self.version = 0  # incrementa a cada mudança real; útil para saber se precisa redesenhar
+        self.capacity = capacity
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def upsert(self, item: dict) -> bool:
+        msg_id = item.get("id")
+        if not msg_id:
+            return False
+
+        current = self.by_id.get(msg_id)
+        if current is None:
+            key = message_sort_key(item)
+            if self.capacity and len(self._keys) >= self.capacity and key < self._keys[0]:
+                return False  # mais antiga que a janela mantida
+            if not self._keys or key > self._keys[-1]:
+                self._keys.append(key)
+            else:
+                insort(self._keys, key)
+            current = self.by_id[msg_id] = MessageRecord.from_item(item)
+            self._evict()
+        elif not current.apply(item):
+            return False
+
+        self.version += 1
+        current.revision = self.version
+        return True
+
+    def _evict(self) -> None:
+        # Folga de 25% para descartar em lote: del de um prefixo da lista é O(n), não dá para fazer a cada insert
+        if not self.capacity or len(self._keys) <= self.capacity + max(self.capacity // 4, 16):
+            return
+        drop = len(self._keys) - self.capacity
+        for _, msg_id in self._keys[:drop]:
+            del self.by_id[msg_id]
+        del self._keys[:drop]
+        self.evicted += drop
+
+    def revision(self, msg_id: str) -> int:
+        rec = self.by_id.get(msg_id)
+        return rec.revision if rec else 0
+
+    def tail(self, n: int) -> list[MessageRecord]:
+        if n <= 0:
+            return []
+        return [self.by_id[msg_id] for _, msg_id in self._keys[-n:]]
+
+    def last(self) -> MessageRecord | None:
+        if not self._keys:
+            return None
+        return self.by_id[self._keys[-1][1]]
+
+
+def format_msg(m: dict) -> str:
+    direction = m.get("direction", "?")
+    mtype = m.get("message_type", "?")
+    status = m.get("status", "?")
+    created_at = (m.get("created_at") or "")[:19].replace("T", " ")
+    updated_at = (m.get("updated_at") or "")[:19].replace("T", " ")
+    body = message_body(mtype, m.get("content") or {})
+    return f"{created_at} [{direction}] {mtype} {status} | {body} | upd={updated_at}"
+
+
+def format_record(r: MessageRecord) -> str:
+    created_at = r.created_at[:19].replace("T", " ")
+    updated_at = r.updated_at[:19].replace("T", " ")
+    return f"{created_at} [{r.direction}] {r.message_type} {r.status} | {r.body} | upd={updated_at}"
+
+
+# ----------------------------
+# Render incremental do terminal
+# ----------------------------
+class TerminalRenderer:
+    """
+    Guarda o frame anterior e reescreve só as linhas que mudaram, posicionando o
+    cursor com ANSI (CSI linha;coluna H) e limpando o resto da linha (CSI K).
+    Linhas são cortadas na largura do terminal para que 1 linha lógica = 1 linha na tela;
+    se o terminal muda de tamanho, o próximo frame é completo.
+    """
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self._prev: list[str] | None = None
+        self._size: tuple[int, int] | None = None
+        self._format_cache: dict[str, tuple[int, str]] = {}
+        if os.name == "nt":
+            os.system("")  # habilita sequências ANSI no console do Windows (uma vez só)
+
+    def format(self, r: MessageRecord) -> str:
+        cached = self._format_cache.get(r.id)
+        if cached and cached[0] == r.revision:
+            return cached[1]
+        line = format_record(r).replace("\r", " ").replace("\n", " ")
+        self._format_cache[r.id] = (r.revision, line)
+        return line
+
+    def forget(self, keep_ids: set[str]) -> None:
+        for msg_id in [k for k in self._format_cache if k not in keep_ids]:
+            del self._format_cache[msg_id]
+
+    def render(self, lines: list[str]) -> int:
+        size = shutil.get_terminal_size()
+        width = max(size.columns - 1, 20)
+        lines = [ln[:width] for ln in lines]
+
+        buf = []
+        if self._prev is None or size != self._size:
+            buf.append("\x1b[2J\x1b[H")
+            prev: list[str] = []
+        else:
+            prev = self._prev
+
+        changed = 0
+        for i, line in enumerate(lines):
+            if i < len(prev) and prev[i] == line:
+                continue
+            buf.append(f"\x1b[{i + 1};1H{line}\x1b[K")
+            changed += 1
+        for i in range(len(lines), len(prev)):
+            buf.append(f"\x1b[{i + 1};1H\x1b[K")
+        buf.append(f"\x1b[{len(lines) + 1};1H")
+
+        self.out.write("".join(buf))
+        self.out.flush()
+        self._prev = lines
+        self._size = size
+        return changed
+
+
+# ----------------------------
+# Cache local (SQLite em modo WAL)
+# ----------------------------
+class LocalCache:
+    """
+    Mensagens e watermarks do delta (since_cursor/updated_since) por conversa.
+    Cada delta vira uma única transação (mensagens + watermark juntos), então um
+    restart sempre retoma de um watermark coerente com as mensagens gravadas.
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS messages (
+        id TEXT PRIMARY KEY,
+        conversation_id TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ix_messages_conversation ON messages (conversation_id, created_at, id);
+    CREATE TABLE IF NOT EXISTS watermarks (
+        conversation_id TEXT PRIMARY KEY,
+        since_cursor TEXT,
+        updated_since TEXT,
+        saved_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS media_assets (
+        sha256 TEXT PRIMARY KEY,
+        media_asset_id TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        file_name TEXT,
+        uploaded_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ix_media_assets_expires ON media_assets (expires_at);
+    CREATE TABLE IF NOT EXISTS file_hashes (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        sha256 TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS conversation_states (
+        external_id TEXT NOT NULL,
+        phone_number_id TEXT NOT NULL,
+        data TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        PRIMARY KEY (external_id, phone_number_id)
+    );
+    """
+
+    def __init__(self, path: str = CACHE_DB):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    def apply_delta(
+        self,
+        conversation_id: str,
+        items: list[dict],
+        since_cursor: str | None = None,
+        updated_since: str | None = None,
+    ) -> None:
+        with self._lock, self.conn:
+            for it in items:
+                msg_id = it.get("id")
+                if not msg_id:
+                    continue
+                row = self.conn.execute("SELECT data FROM messages WHERE id = ?", (msg_id,)).fetchone()
+                if row:
+                    # Mesma semântica do upsert em memória: só campos mutáveis mudam
+                    merged = {msg_id: json_loads(row[0])}
+                    upsert(merged, it)
+                    data = merged[msg_id]
+                else:
+                    data = it
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO messages (id, conversation_id, created_at, data) VALUES (?, ?, ?, ?)",
+                    (msg_id, conversation_id, data.get("created_at") or "", json_dumps(data)),
+                )
+            if since_cursor is not None or updated_since is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO watermarks (conversation_id, since_cursor, updated_since, saved_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (conversation_id, since_cursor, updated_since, iso_now_utc()),
+                )
+
+    def watermark(self, conversation_id: str) -> tuple[str | None, str | None] | None:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT since_cursor, updated_since FROM watermarks WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def recent_messages(self, conversation_id: str, limit: int) -> list[dict]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT data FROM messages WHERE conversation_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+                (conversation_id, limit),
+            ).fetchall()
+        return [json_loads(r[0]) for r in reversed(rows)]
+
+    # --- Dedup de mídia: sha256 do conteúdo -> media_asset_id já enviado ao gateway ---
+
+    def file_sha256(self, p: Path) -> str:
+        # Hash em streaming; arquivo inalterado (mesmo size/mtime) não é lido de novo
+        st = p.stat()
+        key = str(p.resolve())
+        with self._lock:
+            row = self.conn.execute("SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path = ?", (key,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        with p.open("rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                (key, st.st_size, st.st_mtime_ns, digest),
+            )
+        return digest
+
+    def lookup_media(self, sha256: str, min_validity: float = 3600.0) -> dict | None:
+        # Asset que expira em menos de min_validity já não serve: o envio poderia falhar no gateway
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT media_asset_id, size, file_name, uploaded_at, expires_at FROM media_assets "
+                "WHERE sha256 = ? AND expires_at > ?",
+                (sha256, time.time() + min_validity),
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            "media_asset_id": row[0],
+            "size": row[1],
+            "file_name": row[2],
+            "uploaded_at": row[3],
+            "expires_at": row[4],
+        }
+
+    def remember_media(self, sha256: str, media_asset_id: str, size: int, file_name: str, expires_at: float) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO media_assets (sha256, media_asset_id, size, file_name, uploaded_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (sha256, media_asset_id, size, file_name, time.time(), expires_at),
+            )
+
+    def evict_media(self) -> tuple[int, int]:
+        # Remove assets expirados e hashes de arquivos que não existem mais
+        with self._lock, self.conn:
+            expired = self.conn.execute("DELETE FROM media_assets WHERE expires_at <= ?", (time.time(),)).rowcount
+            paths = [r[0] for r in self.conn.execute("SELECT path FROM file_hashes").fetchall()]
+            gone = [(path,) for path in paths if not os.path.exists(path)]
+            self.conn.executemany("DELETE FROM file_hashes WHERE path = ?", gone)
+        return expired, len(gone)
+
+    # --- Estado de conversa por external_id (conversation-state --batch) ---
+
+    def lookup_states(self, external_ids: list[str], phone_number_id: str | None, max_age: float) -> dict[str, dict]:
+        found: dict[str, dict] = {}
+        cutoff = time.time() - max_age
+        with self._lock:
+            for i in range(0, len(external_ids), 500):
+                chunk = external_ids[i : i + 500]
+                rows = self.conn.execute(
+                    "SELECT external_id, data FROM conversation_states WHERE phone_number_id = ? AND fetched_at > ? "
+                    f"AND external_id IN ({','.join('?' * len(chunk))})",
+                    (phone_number_id or "", cutoff, *chunk),
+                ).fetchall()
+                found.update((external_id, json_loads(data)) for external_id, data in rows)
+        return found
+
+    def remember_states(self, states: list[tuple[str, dict]], phone_number_id: str | None) -> None:
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO conversation_states (external_id, phone_number_id, data, fetched_at) VALUES (?, ?, ?, ?)",
+                [(external_id, phone_number_id or "", json_dumps(data), now) for external_id, data in states],
+            )
+
+
+_open_caches: dict[str, LocalCache] = {}
+_open_caches_lock = threading.Lock()
+
+
+def open_cache(path: str | None) -> LocalCache | None:
+    # Uma conexão por arquivo no processo (o daemon reaproveita entre comandos)
+    if not path:
+        return None
+    with _open_caches_lock:
+        cache = _open_caches.get(path)
+        if cache is None:
+            cache = _open_caches[path] = LocalCache(path)
+        return cache
+
+
+def parse_retry_after(response: requests.Response | None) -> float | None:
+    # Retry-After só é considerado em 429/503; aceita segundos ou HTTP-date
+    if response is None or response.status_code not in (429, 503):
+        return None
+    value = (response.headers.get("Retry-After") or "").strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class PollScheduler:
+    """
+    Intervalo adaptativo do polling:
+    - delta com itens: volta para min_interval (conversa ativa, sem latência extra)
+    - delta vazio: cresce exponencialmente até max_interval (conversa ociosa)
+    - erro: backoff exponencial pelo número de erros seguidos; Retry-After tem prioridade
+    O jitter evita que vários pollers batam no gateway sincronizados.
+    """
+    def __init__(
+        self,
+        base_interval: float,
+        min_interval: float,
+        max_interval: float,
+        factor: float = 1.6,
+        jitter: float = 0.2,
+    ):
+        self.min_interval = min(min_interval, base_interval)
+        self.max_interval = max(max_interval, base_interval)
+        self.base_interval = base_interval
+        self.factor = factor
+        self.jitter = jitter
+        self.interval = base_interval
+        self.errors = 0
+
+    def _jittered(self, seconds: float) -> float:
+        if not self.jitter:
+            return seconds
+        return seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def on_success(self, n_items: int) -> float:
+        self.errors = 0
+        if n_items:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.factor)
+        return self._jittered(self.interval)
+
+    def on_error(self, retry_after: float | None = None) -> float:
+        self.errors += 1
+        backoff = min(self.max_interval, self.base_interval * (self.factor ** self.errors))
+        self.interval = max(self.interval, backoff)
+        if retry_after is not None:
+            # Nunca antes do que o gateway pediu; jitter só para cima
+            return retry_after + random.uniform(0, self.jitter * max(retry_after, self.min_interval))
+        return self._jittered(backoff)
+
+
+def run_poll(
+    conversation_id: str,
+    history_limit: int,
+    poll_interval: float,
+    delta_limit: int,
+    max_render: int,
+    min_interval: float = 1.0,
+    max_interval: float = 30.0,
+    cache: LocalCache | None = None,
+    keep: int = 1000,
+):
+    local = MessageStore(capacity=max(keep, max_render, history_limit))
+    watermark = cache.watermark(conversation_id) if cache else None
+
+    if watermark:
+        # 1) Warm start: mensagens e watermark do cache local; o primeiro delta cobre o que mudou
+        for it in cache.recent_messages(conversation_id, history_limit):
+            local.upsert(it)
+        since_cursor, updated_since = watermark
+        updated_since = updated_since or iso_now_utc()
+        print(f"Retomando do cache {cache.path} ({len(local)} mensagens)")
+    else:
+        # 1) Cold start: histórico
+        hist = list_messages(conversation_id, limit=history_limit)
+        for it in hist.get("items", []):
+            local.upsert(it)
+
+        # Inicialização pragmática de since_cursor (o delta devolverá next_since_cursor oficial)
+        since_cursor = None
+        last = local.last()
+        if last:
+            since_cursor = last.cursor()
+
+        # updated_since inicial: agora; depois vira server_time do gateway
+        updated_since = iso_now_utc()
+
+        if cache:
+            cache.apply_delta(conversation_id, hist.get("items", []), since_cursor, updated_since)
+
+    print(f"Polling conversation_id={conversation_id}")
+    print("Ctrl+C para sair.\n")
+
+    sched = PollScheduler(poll_interval, min_interval=min_interval, max_interval=max_interval)
+    renderer = TerminalRenderer()
+    last_frame_key = None
+    status = ""
+
+    while True:
+        try:
+            # Renderiza só quando mensagens ou status mudam. updated_since fica fora da chave: ele
+            # avança a cada delta, até vazio, e o cabeçalho mostra o valor do último frame
+            frame_key = (local.version, since_cursor, status)
+            if frame_key != last_frame_key:
+                tail = local.tail(max_render)
+                lines = [
+                    f"Gateway: {BASE_URL}",
+                    f"Conversation: {conversation_id}",
+                    f"since_cursor: {since_cursor}",
+                    f"updated_since: {updated_since}",
+                    "-" * 110,
+                ]
+                lines.extend(renderer.format(r) for r in tail)
+                lines.append("-" * 110)
+                lines.append(
+                    f"Polling adaptativo {sched.min_interval}s..{sched.max_interval}s | delta_limit={delta_limit}"
+                )
+                if status:
+                    lines.append(status)
+                renderer.render(lines)
+                renderer.forget({r.id for r in tail})
+                last_frame_key = frame_key
+
+            # 2) Delta
+            delta = get_delta(conversation_id, since_cursor=since_cursor, updated_since=updated_since, limit=delta_limit)
+
+            for it in delta.get("items", []):
+                local.upsert(it)
+
+            if delta.get("next_since_cursor"):
+                since_cursor = delta["next_since_cursor"]
+
+            updated_since = delta.get("server_time") or updated_since
+
+            if cache:
+                cache.apply_delta(conversation_id, delta.get("items", []), since_cursor, updated_since)
+
+            status = ""
+            time.sleep(sched.on_success(len(delta.get("items", []))))
+
+        except requests.HTTPError as e:
+            wait_s = sched.on_error(parse_retry_after(e.response))
+            status = f"HTTPError: {e} | nova tentativa em {wait_s:.1f}s"
+            time.sleep(wait_s)
+        except requests.RequestException as e:
+            wait_s = sched.on_error(retry_hint(e))
+            status = f"{type(e).__name__}: {e} | nova tentativa em {wait_s:.1f}s"
+            time.sleep(wait_s)
+
+
+# ----------------------------
+# Polling multiplexado (poll-all)
+# ----------------------------
+@dataclass
+class ConversationCursor:
+    conversation_id: str
+    sched: PollScheduler
+    since_cursor: str | None = None
+    updated_since: str | None = None
+    primed: bool = False
+    polls: int = 0
+    items: int = 0
+
+
+@dataclass
+class PollAllStats:
+    started: float = field(default_factory=time.monotonic)
+    polls: int = 0
+    items: int = 0
+    errors: int = 0
+
+
+def _conversation_id(c: dict) -> str | None:
+    return c.get("id") or c.get("conversation_id")
+
+
+def _prime_cursor(st: ConversationCursor) -> None:
+    # Só a última mensagem: suficiente para o since_cursor, sem baixar histórico
+    page = list_messages(st.conversation_id, limit=1)
+    items = sorted(page.get("items", []), key=message_sort_key)
+    if items:
+        st.since_cursor = cursor_of(items[-1])
+    st.updated_since = iso_now_utc()
+    st.primed = True
+
+
+def _poll_conversation_once(st: ConversationCursor, delta_limit: int, cache: LocalCache | None = None) -> list[dict]:
+    if not st.primed:
+        watermark = cache.watermark(st.conversation_id) if cache else None
+        if watermark:
+            st.since_cursor, st.updated_since = watermark
+            st.primed = True
+        else:
+            _prime_cursor(st)
+    delta = get_delta(st.conversation_id, since_cursor=st.since_cursor, updated_since=st.updated_since, limit=delta_limit)
+    if delta.get("next_since_cursor"):
+        st.since_cursor = delta["next_since_cursor"]
+    st.updated_since = delta.get("server_time") or st.updated_since
+    if cache:
+        cache.apply_delta(st.conversation_id, delta.get("items", []), st.since_cursor, st.updated_since)
+    return delta.get("items", [])
+
+
+async def run_poll_all(
+    concurrency: int,
+    conversations_limit: int,
+    phone_number_id: str | None,
+    delta_limit: int,
+    poll_interval: float,
+    min_interval: float,
+    max_interval: float,
+    discover_every: float,
+    status_every: float = 30.0,
+    cache: LocalCache | None = None,
+):
+    """
+    Um único event loop acompanha todas as conversas do tenant.
+    Fila de prioridade por "próximo vencimento": cada conversa tem seu PollScheduler,
+    então conversas quentes voltam para a fila com intervalo curto e as ociosas com
+    intervalo longo. O semáforo limita quantos get_delta ficam em voo ao mesmo tempo;
+    ele é adquirido antes de criar a task, então a ordem de atendimento é a da fila.
+    """
+    if concurrency > POOL_SIZE:
+        configure_transport(concurrency)
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ScopedThreadPool(max_workers=concurrency))
+
+    states: dict[str, ConversationCursor] = {}
+    due: list[tuple[float, int, str]] = []
+    seq = 0
+    sem = asyncio.Semaphore(concurrency)
+    stats = PollAllStats()
+    tasks: set[asyncio.Task] = set()
+
+    def schedule(conversation_id: str, delay: float) -> None:
+        nonlocal seq
+        seq += 1
+        heapq.heappush(due, (loop.time() + delay, seq, conversation_id))
+
+    def list_all() -> list[dict]:
+        # Segue next_cursor: com mais conversas do que cabem numa página, as demais também entram
+        return list(itertools.islice(iter_conversations(phone_number_id=phone_number_id), conversations_limit or None))
+
+    async def discover() -> None:
+        found = await asyncio.to_thread(list_all)
+        new = 0
+        for c in found:
+            cid = _conversation_id(c)
+            if not cid or cid in states:
+                continue
+            states[cid] = ConversationCursor(cid, PollScheduler(poll_interval, min_interval, max_interval))
+            # Espalha a primeira rodada para não disparar todas de uma vez
+            schedule(cid, random.uniform(0, poll_interval))
+            new += 1
+        if new:
+            print(f"[poll-all] {new} conversas novas (total {len(states)})", file=sys.stderr)
+
+    async def poll_one(st: ConversationCursor) -> None:
+        try:
+            items = await asyncio.to_thread(_poll_conversation_once, st, delta_limit, cache)
+            st.polls += 1
+            st.items += len(items)
+            stats.polls += 1
+            stats.items += len(items)
+            for it in sorted(items, key=message_sort_key):
+                print(f"[{st.conversation_id}] {format_msg(it)}", flush=True)
+            wait_s = st.sched.on_success(len(items))
+        except requests.HTTPError as e:
+            stats.errors += 1
+            wait_s = st.sched.on_error(parse_retry_after(e.response))
+            print(f"[{st.conversation_id}] HTTPError: {e} | nova tentativa em {wait_s:.1f}s", file=sys.stderr)
+        except requests.RequestException as e:
+            stats.errors += 1
+            wait_s = st.sched.on_error(retry_hint(e))
+            print(f"[{st.conversation_id}] {type(e).__name__}: {e} | nova tentativa em {wait_s:.1f}s", file=sys.stderr)
+        except Exception as e:
+            # Resposta inesperada (JSON inválido, campo faltando): erro com backoff, a conversa continua na fila
+            stats.errors += 1
+            wait_s = st.sched.on_error(None)
+            print(f"[{st.conversation_id}] {type(e).__name__}: {e} | nova tentativa em {wait_s:.1f}s", file=sys.stderr)
+        finally:
+            sem.release()
+        schedule(st.conversation_id, wait_s)
+
+    next_discover = loop.time()
+    next_status = loop.time() + status_every
+
+    while True:
+        now = loop.time()
+        if now >= next_discover:
+            try:
+                await discover()
+            except Exception as e:
+                print(f"[poll-all] falha ao listar conversas: {type(e).__name__}: {e}", file=sys.stderr)
+            next_discover = loop.time() + discover_every
+
+        if status_every and now >= next_status:
+            elapsed = time.monotonic() - stats.started
+            hot = sum(1 for st in states.values() if st.sched.interval <= st.sched.min_interval)
+            print(
+                f"[poll-all] conversas={len(states)} quentes={hot} polls={stats.polls} "
+                f"({stats.polls / elapsed:.1f}/s) itens={stats.items} erros={stats.errors} em_voo={len(tasks)}",
+                file=sys.stderr,
+            )
+            next_status = now + status_every
+
+        if not due or due[0][0] > now:
+            wake = min(next_discover, next_status if status_every else next_discover)
+            if due:
+                wake = min(wake, due[0][0])
+            await asyncio.sleep(max(0.0, wake - now))
+            continue
+
+        await sem.acquire()
+        _, _, cid = heapq.heappop(due)
+        task = asyncio.create_task(poll_one(states[cid]))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+
+# ----------------------------
+# Push (SSE) com fallback para o delta (subscribe)
+# ----------------------------
+# GET /gateway/events?conversation_id=a&conversation_id=b  (Accept: text/event-stream, Last-Event-ID)
+#   event: message -> id: <seq do servidor>, data: {"conversation_id", "item": {...mensagem...}}
+#   event: reset   -> Last-Event-ID fora da janela de replay: o cliente recupera pelo delta
+#   ": ping" a cada ~15 s mantém a conexão viva (o read timeout detecta conexão morta)
+SSE_READ_TIMEOUT = 45.0
+
+
+class PushUnavailable(Exception):
+    pass
+
+
+@dataclass
+class SseEvent:
+    event: str = "message"
+    data: str = ""
+    id: str | None = None
+
+
+def iter_sse(lines):
+    # Parser de text/event-stream: campos até a linha vazia formam um evento
+    ev = SseEvent()
+    data: list[str] = []
+    for line in lines:
+        if line == "":
+            if data:
+                ev.data = "\n".join(data)
+                yield ev
+            ev, data = SseEvent(), []
+            continue
+        if line.startswith(":"):
+            continue
+        name, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if name == "event":
+            ev.event = value
+        elif name == "data":
+            data.append(value)
+        elif name == "id":
+            ev.id = value
+
+
+def sse_lines(r: requests.Response):
+    # text/event-stream é sempre UTF-8 (a spec ignora charset). Sem charset no Content-Type o
+    # requests decodificaria como ISO-8859-1; e str.splitlines quebraria em U+2028 dentro do JSON.
+    # Então: linhas em bytes (quebra só em CR/LF) e decode UTF-8 de cada uma.
+    # chunk_size=None: cada chunk do servidor é entregue assim que chega
+    for line in r.iter_lines(chunk_size=None):
+        yield line.decode("utf-8", errors="replace")
+
+
+def open_event_stream(conversation_ids: list[str], last_event_id: str | None) -> requests.Response:
+    headers = {**HEADERS, "Accept": "text/event-stream", "Cache-Control": "no-cache"}
+    if last_event_id:
+        headers["Last-Event-ID"] = last_event_id
+    r = get_session().get(
+        f"{BASE_URL}/gateway/events",
+        params=[("conversation_id", cid) for cid in conversation_ids],
+        headers=headers,
+        stream=True,
+        timeout=(10, SSE_READ_TIMEOUT),
+    )
+    content_type = r.headers.get("Content-Type") or ""
+    if r.status_code in (404, 405, 406, 501) or (r.ok and not content_type.startswith("text/event-stream")):
+        r.close()
+        raise PushUnavailable(f"HTTP {r.status_code} {content_type}".strip())
+    if not r.ok:
+        r.close()
+        r.raise_for_status()
+    return r
+
+
+def _cursor_after(cursor: str | None, item: dict) -> bool:
+    if not cursor:
+        return True
+    created_at, _, msg_id = cursor.partition("|")
+    return message_sort_key(item) > (created_at, msg_id)
+
+
+class Subscriber:
+    """
+    Acompanha conversas por push (SSE) e cai para o delta quando o push não existe
+    ou falha repetidamente. Eventos e deltas passam pelo mesmo MessageStore.upsert,
+    então o replay após reconexão (Last-Event-ID) ou a sobreposição com o delta não
+    imprime nada duplicado. O since_cursor de cada conversa avança com os eventos:
+    quando volta para o delta, ele continua de onde o push parou.
+    """
+    def __init__(
+        self,
+        conversation_ids: list[str],
+        delta_limit: int = 200,
+        poll_interval: float = 2.5,
+        min_interval: float = 1.0,
+        max_interval: float = 30.0,
+        retry_push_every: float = 60.0,
+        cache: LocalCache | None = None,
+        keep: int = 1000,
+    ):
+        self.cursors = {
+            cid: ConversationCursor(cid, PollScheduler(poll_interval, min_interval, max_interval))
+            for cid in conversation_ids
+        }
+        self.stores = {cid: MessageStore(capacity=keep) for cid in conversation_ids}
+        self.delta_limit = delta_limit
+        self.retry_push_every = retry_push_every
+        self.cache = cache
+        self.last_event_id: str | None = None
+        self.stats = {"events": 0, "deltas": 0, "reconnects": 0}
+
+    def apply(self, conversation_id: str, items: list[dict]) -> None:
+        store = self.stores[conversation_id]
+        for it in sorted(items, key=message_sort_key):
+            if store.upsert(it):
+                print(f"[{conversation_id}] {format_msg(it)}", flush=True)
+
+    def catch_up(self) -> None:
+        # Delta de todas as conversas: prime inicial e recuperação após reset/fallback
+        for st in self.cursors.values():
+            self.apply(st.conversation_id, _poll_conversation_once(st, self.delta_limit, self.cache))
+            self.stats["deltas"] += 1
+
+    def on_event(self, ev: SseEvent) -> None:
+        if ev.id:
+            self.last_event_id = ev.id
+        if ev.event == "reset":
+            print("[subscribe] servidor sem replay desde o último evento: recuperando pelo delta", file=sys.stderr)
+            self.catch_up()
+            return
+        if ev.event != "message":
+            return
+        # Um evento malformado não derruba o subscribe: é descartado e o stream segue
+        try:
+            payload = json_loads(ev.data)
+        except ValueError as e:
+            print(f"[subscribe] evento {ev.id or '?'} ignorado: data não é JSON ({e})", file=sys.stderr)
+            return
+        item = payload.get("item") if isinstance(payload, dict) else None
+        cid = payload.get("conversation_id") if isinstance(payload, dict) else None
+        if not isinstance(item, dict) or not isinstance(cid, str):
+            print(f"[subscribe] evento {ev.id or '?'} ignorado: esperado {{conversation_id, item}}", file=sys.stderr)
+            return
+        st = self.cursors.get(cid)
+        if st is None or not item.get("id"):
+            return
+        self.stats["events"] += 1
+        if _cursor_after(st.since_cursor, item):
+            st.since_cursor = cursor_of(item)
+        if self.cache:
+            self.cache.apply_delta(cid, [item], st.since_cursor, st.updated_since)
+        self.apply(cid, [item])
+
+    def run_push(self) -> None:
+        with open_event_stream(list(self.cursors), self.last_event_id) as r:
+            print(f"[subscribe] push conectado ({len(self.cursors)} conversas)", file=sys.stderr)
+            for ev in iter_sse(sse_lines(r)):
+                self.on_event(ev)
+
+    def run_fallback(self, duration: float) -> None:
+        # Delta com PollScheduler por conversa (mesma regra do poll-all), até tentar o push de novo
+        deadline = time.monotonic() + duration
+        due = [(time.monotonic(), cid) for cid in self.cursors]
+        heapq.heapify(due)
+        while due:
+            at, cid = heapq.heappop(due)
+            now = time.monotonic()
+            if at >= deadline:
+                time.sleep(max(0.0, deadline - now))
+                return
+            time.sleep(max(0.0, at - now))
+            st = self.cursors[cid]
+            try:
+                items = _poll_conversation_once(st, self.delta_limit, self.cache)
+                self.stats["deltas"] += 1
+                self.apply(cid, items)
+                wait_s = st.sched.on_success(len(items))
+            except requests.HTTPError as e:
+                wait_s = st.sched.on_error(parse_retry_after(e.response))
+                print(f"[{cid}] HTTPError: {e} | nova tentativa em {wait_s:.1f}s", file=sys.stderr)
+            except requests.RequestException as e:
+                wait_s = st.sched.on_error(retry_hint(e))
+                print(f"[{cid}] {type(e).__name__}: {e} | nova tentativa em {wait_s:.1f}s", file=sys.stderr)
+            except Exception as e:
+                # Resposta inesperada: backoff e a conversa continua na fila (como no poll-all)
+                wait_s = st.sched.on_error(None)
+                print(f"[{cid}] {type(e).__name__}: {e} | nova tentativa em {wait_s:.1f}s", file=sys.stderr)
+            heapq.heappush(due, (time.monotonic() + wait_s, cid))
+
+    def run(self, max_push_failures: int = 3) -> None:
+        try:
+            self.catch_up()
+        except requests.RequestException as e:
+            # Gateway fora no início: segue para o push, e o backoff/fallback abaixo cuida do resto
+            print(f"[subscribe] delta inicial falhou ({type(e).__name__}: {e}): tentando o push", file=sys.stderr)
+        backoff = PollScheduler(1.0, min_interval=1.0, max_interval=30.0)
+        failures = 0
+        while True:
+            try:
+                self.run_push()
+                # Servidor (ou proxy que corta streams ociosos) fechou normalmente: reconecta após o
+                # intervalo mínimo, nunca em loop apertado
+                failures = 0
+                time.sleep(backoff.on_success(1))
+            except PushUnavailable as e:
+                print(f"[subscribe] push indisponível ({e}): delta por {self.retry_push_every:.0f}s", file=sys.stderr)
+                self.run_fallback(self.retry_push_every)
+                continue
+            except requests.RequestException as e:
+                failures += 1
+                if failures >= max_push_failures:
+                    print(f"[subscribe] push falhou {failures}x ({e}): delta por {self.retry_push_every:.0f}s", file=sys.stderr)
+                    self.run_fallback(self.retry_push_every)
+                    failures = 0
+                    continue
+                wait_s = backoff.on_error()
+                print(f"[subscribe] conexão perdida ({type(e).__name__}): reconectando em {wait_s:.1f}s", file=sys.stderr)
+                time.sleep(wait_s)
+            self.stats["reconnects"] += 1
+
+
+# ----------------------------
+# Gateway: Media
+# ----------------------------
+def media_upload(file_path: str, idempotency_key: str | None = None) -> dict:
+    p = Path(file_path)
+    if not p.exists() or not p.is_file():
+        raise FileNotFoundError(f"Arquivo não encontrado: {file_path}")
+
+    headers = {}
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+
+    with p.open("rb") as f:
+        files = {"file": (p.name, f)}
+        r = http_request("POST", "/gateway/media/upload", headers=headers, files=files, timeout=120)
+        return decode_json(r)
+
+
+# Upload resumível em chunks:
+#   POST /gateway/media/uploads              {file_name, size, content_type} + Idempotency-Key -> {upload_id, offset}
+#   GET  /gateway/media/uploads/{upload_id}  -> {upload_id, offset, size}
+#   PUT  /gateway/media/uploads/{upload_id}  Content-Range: bytes a-b/total (corpo = chunk) -> {offset}
+#   POST /gateway/media/uploads/{upload_id}/complete -> mesmo JSON de /gateway/media/upload
+# A mesma Idempotency-Key devolve a mesma sessão de upload, então um processo novo retoma do offset do gateway.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def file_idempotency_key(p: Path) -> str:
+    st = p.stat()
+    raw = f"{p.resolve()}|{st.st_size}|{st.st_mtime_ns}"
+    return f"up-{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:24]}"
+
+
+class _ChunkReader:
+    # Corpo "file-like" com tamanho conhecido: requests envia Content-Length e o
+    # http.client lê em blocos, sem carregar o chunk inteiro em memória.
+    def __init__(self, f, start: int, length: int, on_bytes=None):
+        self._f = f
+        self._remaining = length
+        self._length = length
+        self._on_bytes = on_bytes
+        f.seek(start)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, n: int = -1) -> bytes:
+        if self._remaining <= 0:
+            return b""
+        if n is None or n < 0 or n > self._remaining:
+            n = self._remaining
+        data = self._f.read(n)
+        self._remaining -= len(data)
+        if self._on_bytes and data:
+            self._on_bytes(len(data))
+        return data
+
+
+def _print_progress(name: str, done: int, total: int) -> None:
+    pct = (done / total * 100) if total else 100.0
+    print(f"\r[upload] {name} {pct:5.1f}% ({done / 1048576:.1f}/{total / 1048576:.1f} MiB)", end="", file=sys.stderr, flush=True)
+
+
+def media_upload_resumable(
+    file_path: str,
+    idempotency_key: str | None = None,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    max_retries: int = 5,
+    progress: bool = True,
+) -> dict:
+    p = Path(file_path)
+    if not p.exists() or not p.is_file():
+        raise FileNotFoundError(f"Arquivo não encontrado: {file_path}")
+
+    size = p.stat().st_size
+    key = idempotency_key or file_idempotency_key(p)
+    session = http_post_json(
+        "/gateway/media/uploads",
+        {
+            "file_name": p.name,
+            "size": size,
+            "content_type": mimetypes.guess_type(p.name)[0] or "application/octet-stream",
+        },
+        headers={"Idempotency-Key": key},
+    )
+    upload_id = session["upload_id"]
+    offset = int(session.get("offset") or 0)
+    chunk_size = int(session.get("chunk_size") or chunk_size)
+
+    sent = offset
+    last_print = 0.0
+    on_bytes = None
+    if progress:
+        def on_bytes(n: int) -> None:
+            nonlocal sent, last_print
+            sent += n
+            now = time.monotonic()
+            if now - last_print >= 0.25:
+                last_print = now
+                _print_progress(p.name, sent, size)
+
+    failures = 0
+    with p.open("rb") as f:
+        while offset < size:
+            length = min(chunk_size, size - offset)
+            try:
+                r = http_request(
+                    "PUT",
+                    f"/gateway/media/uploads/{upload_id}",
+                    headers={
+                        "Content-Range": f"bytes {offset}-{offset + length - 1}/{size}",
+                        "Content-Type": "application/octet-stream",
+                        "Idempotency-Key": key,
+                    },
+                    data=_ChunkReader(f, offset, length, on_bytes),
+                    timeout=120,
+                )
+                offset = int(r.json().get("offset", offset + length))
+                failures = 0
+            except requests.RequestException as e:
+                failures += 1
+                if failures > max_retries:
+                    raise
+                # Conexão caiu no meio do chunk: pergunta ao gateway até onde chegou e continua dali
+                time.sleep(min(30.0, 0.5 * 2 ** failures))
+                try:
+                    offset = int(http_get(f"/gateway/media/uploads/{upload_id}").get("offset", offset))
+                except requests.RequestException:
+                    pass
+                if progress:
+                    print(f"\n[upload] {type(e).__name__}: retomando de {offset} bytes", file=sys.stderr)
+            sent = offset
+
+    result = http_post_json(
+        f"/gateway/media/uploads/{upload_id}/complete", None, headers={"Idempotency-Key": key}
+    )
+    if progress:
+        _print_progress(p.name, size, size)
+        print(file=sys.stderr)
+    return result
+
+
+def _expires_at(resp: dict) -> float:
+    value = resp.get("expires_at")
+    if value:
+        try:
+            when = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=timezone.utc)
+            return when.timestamp()
+        except ValueError:
+            pass
+    return time.time() + MEDIA_TTL
+
+
+def media_upload_dedup(
+    file_path: str,
+    cache: LocalCache | None,
+    idempotency_key: str | None = None,
+    chunked: bool = False,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    progress: bool = True,
+) -> dict:
+    # Consulta o índice por conteúdo antes de transferir; sem cache, é um upload normal
+    if cache is None:
+        if chunked:
+            return media_upload_resumable(file_path, idempotency_key, chunk_size=chunk_size, progress=progress)
+        return media_upload(file_path, idempotency_key=idempotency_key)
+
+    p = Path(file_path)
+    if not p.exists() or not p.is_file():
+        raise FileNotFoundError(f"Arquivo não encontrado: {file_path}")
+    digest = cache.file_sha256(p)
+    hit = cache.lookup_media(digest)
+    if hit:
+        return {**hit, "sha256": digest, "dedup": True}
+
+    if chunked:
+        resp = media_upload_resumable(file_path, idempotency_key, chunk_size=chunk_size, progress=progress)
+    else:
+        resp = media_upload(file_path, idempotency_key=idempotency_key)
+    if resp.get("media_asset_id"):
+        cache.remember_media(digest, resp["media_asset_id"], p.stat().st_size, p.name, _expires_at(resp))
+    return {**resp, "sha256": digest, "dedup": False}
+
+
+def _upload_one(path: Path, chunked: bool, chunk_size: int, cache: LocalCache | None = None) -> dict:
+    t0 = time.perf_counter()
+    result = {"file": str(path), "size": path.stat().st_size}
+    try:
+        key = file_idempotency_key(path)
+        resp = media_upload_dedup(
+            str(path), cache, idempotency_key=key, chunked=chunked, chunk_size=chunk_size, progress=False
+        )
+        result["ok"] = True
+        result["media_asset_id"] = resp.get("media_asset_id")
+        result["response"] = resp
+    except (requests.RequestException, OSError, KeyError, ValueError) as e:
+        result["ok"] = False
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return result
+
+
+def media_upload_dir(
+    directory: str,
+    pattern: str = "*",
+    recursive: bool = False,
+    workers: int = 4,
+    chunked: bool = False,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    cache: LocalCache | None = None,
+):
+    base = Path(directory)
+    if not base.is_dir():
+        raise FileNotFoundError(f"Diretório não encontrado: {directory}")
+    files = sorted(p for p in (base.rglob(pattern) if recursive else base.glob(pattern)) if p.is_file())
+    if workers > POOL_SIZE:
+        configure_transport(workers)
+    with ScopedThreadPool(max_workers=workers) as pool:
+        futures = [pool.submit(_upload_one, p, chunked, chunk_size, cache) for p in files]
+        for fut in futures:
+            yield fut.result()
+
+
+def media_download_info(media_asset_id: str) -> dict:
+    return http_get(f"/gateway/media/{media_asset_id}/download", conditional=True)
+
+
+DOWNLOAD_SEGMENT_SIZE = 8 * 1024 * 1024
+DOWNLOAD_PARALLEL_MIN_SIZE = 16 * 1024 * 1024
+
+
+def _pwrite(fd: int, data: bytes, offset: int, lock: threading.Lock) -> None:
+    # os.pwrite não existe no Windows: cai para lseek+write serializado
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            n = os.pwrite(fd, view, offset)
+        else:
+            with lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                n = os.write(fd, view)
+        view = view[n:]
+        offset += n
+
+
+def _probe_ranges(download_url: str) -> tuple[int | None, bool, str | None]:
+    # GET bytes=0-0 em vez de HEAD: URLs assinadas costumam ser válidas só para GET
+    with get_session().get(download_url, headers={"Range": "bytes=0-0"}, stream=True, timeout=30) as r:
+        r.raise_for_status()
+        validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+        if r.status_code == 206:
+            total = (r.headers.get("Content-Range") or "").rpartition("/")[2]
+            return (int(total) if total.isdigit() else None), True, validator
+        length = r.headers.get("Content-Length")
+        return (int(length) if length and length.isdigit() else None), False, validator
+
+
+class _DownloadProgress:
+    # Sidecar JSON com os segmentos já gravados; reescrito atomicamente a cada segmento concluído
+    def __init__(self, path: Path, size: int, segment_size: int, validator: str | None):
+        self.path = path
+        self.size = size
+        self.segment_size = segment_size
+        self.validator = validator
+        self.done: set[int] = set()
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        # Só reaproveita se o arquivo remoto é o mesmo (tamanho/validador) e a segmentação também
+        if (data.get("size"), data.get("segment_size"), data.get("validator")) == (
+            self.size,
+            self.segment_size,
+            self.validator,
+        ):
+            self.done = set(data.get("done", []))
+
+    def mark(self, index: int) -> None:
+        with self._lock:
+            self.done.add(index)
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(
+                json.dumps(
+                    {
+                        "size": self.size,
+                        "segment_size": self.segment_size,
+                        "validator": self.validator,
+                        "done": sorted(self.done),
+                    }
+                ),
+                encoding="utf-8",
+            )
+            os.replace(tmp, self.path)
+
+
+def _download_segment(download_url: str, fd: int, start: int, end: int, lock: threading.Lock, retries: int = 3) -> None:
+    for attempt in range(retries + 1):
+        pos = start
+        try:
+            with get_session().get(
+                download_url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=180
+            ) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise RuntimeError(f"Range ignorado pelo servidor (status {r.status_code})")
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    if chunk:
+                        _pwrite(fd, chunk, pos, lock)
+                        pos += len(chunk)
+            if pos != end + 1:
+                raise requests.ConnectionError(f"segmento incompleto: {pos - start} de {end - start + 1} bytes")
+            return
+        except requests.RequestException:
+            if attempt == retries:
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+
+
+def _download_stream(download_url: str, tmp_path: Path, sidecar: Path | None, size: int | None, validator: str | None) -> None:
+    # Stream único (arquivo pequeno, 1 conexão). Com sidecar (servidor aceita Range), um .part da
+    # mesma versão do arquivo continua do fim com Range: bytes=N-; If-Range garante que um
+    # arquivo trocado no servidor volta inteiro (200) em vez de emendar bytes de outra versão
+    offset = 0
+    if sidecar is not None:
+        try:
+            data = json.loads(sidecar.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+        if data == {"mode": "stream", "size": size, "validator": validator} and tmp_path.exists():
+            offset = tmp_path.stat().st_size
+            if size is not None and offset > size:
+                offset = 0
+        sidecar.write_text(json.dumps({"mode": "stream", "size": size, "validator": validator}), encoding="utf-8")
+    if offset and offset == size:
+        return
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        if validator:
+            headers["If-Range"] = validator
+    with get_session().get(download_url, headers=headers, stream=True, timeout=180) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            offset = 0
+        with tmp_path.open("ab" if offset else "wb") as w:
+            for chunk in r.iter_content(chunk_size=1024 * 1024):
+                if chunk:
+                    w.write(chunk)
+
+
+def media_download_file(
+    media_asset_id: str,
+    out_dir: str = ".",
+    connections: int = 4,
+    segment_size: int = DOWNLOAD_SEGMENT_SIZE,
+) -> Path:
+    info = media_download_info(media_asset_id)
+    download_url = info.get("download_url")
+    if not download_url:
+        raise RuntimeError(f"Resposta sem download_url: {info}")
+
+    filename = info.get("file_name") or f"{media_asset_id}.bin"
+    out_path = Path(out_dir) / filename
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    # Grava em .part e só renomeia no fim: o caminho final nunca fica com arquivo parcial
+    tmp_path = out_path.with_name(out_path.name + ".part")
+    sidecar = out_path.with_name(out_path.name + ".part.json")
+
+    # baixa o binário direto da signed URL (sem X-API-Key: é outro host)
+    size, ranges, validator = _probe_ranges(download_url)
+
+    if ranges and size and size >= DOWNLOAD_PARALLEL_MIN_SIZE and connections > 1:
+        progress = _DownloadProgress(sidecar, size, segment_size, validator)
+        if tmp_path.exists():
+            progress.load()
+        segments = [(i, off, min(off + segment_size, size) - 1) for i, off in enumerate(range(0, size, segment_size))]
+        pending = [seg for seg in segments if seg[0] not in progress.done]
+
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            os.ftruncate(fd, size)
+            lock = threading.Lock()
+
+            def fetch(seg: tuple[int, int, int]) -> None:
+                index, start, end = seg
+                _download_segment(download_url, fd, start, end, lock)
+                progress.mark(index)
+
+            with ScopedThreadPool(max_workers=connections) as pool:
+                for fut in [pool.submit(fetch, seg) for seg in pending]:
+                    fut.result()
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    else:
+        _download_stream(download_url, tmp_path, sidecar if ranges else None, size, validator)
+
+    os.replace(tmp_path, out_path)
+    sidecar.unlink(missing_ok=True)
+    return out_path
+
+
+def media_download_many(
+    media_asset_ids: list[str],
+    out_dir: str = ".",
+    parallel: int = 1,
+    connections: int = 4,
+):
+    needed = max(parallel, 1) * max(connections, 1)
+    if needed > POOL_SIZE:
+        configure_transport(needed)
+
+    def one(media_asset_id: str) -> tuple[str, Path | None, Exception | None]:
+        try:
+            return media_asset_id, media_download_file(media_asset_id, out_dir=out_dir, connections=connections), None
+        except (requests.RequestException, OSError, RuntimeError) as e:
+            return media_asset_id, None, e
+
+    with ScopedThreadPool(max_workers=max(parallel, 1)) as pool:
+        yield from pool.map(one, media_asset_ids)
+
+
+# ----------------------------
+# Exportação colunar (Parquet / Arrow IPC)
+# ----------------------------
+def _columnar_schema():
+    ts = pa.timestamp("us", tz="UTC")
+    return pa.schema(
+        [
+            ("conversation_id", pa.string()),
+            ("id", pa.string()),
+            ("direction", pa.string()),
+            ("message_type", pa.string()),
+            ("status", pa.string()),
+            ("created_at", ts),
+            ("updated_at", ts),
+            ("text", pa.string()),
+            ("media_asset_id", pa.string()),
+            ("file_name", pa.string()),
+            ("provider_message_id", pa.string()),
+            ("error_message", pa.string()),
+            ("content_json", pa.string()),
+            ("metadata_json", pa.string()),
+        ]
+    )
+
+
+def _parse_ts(value) -> datetime | None:
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def message_to_row(conversation_id: str, m: dict) -> dict:
+    content = m.get("content")
+    content_d = content if isinstance(content, dict) else {}
+    metadata = m.get("metadata")
+    return {
+        "conversation_id": m.get("conversation_id") or conversation_id,
+        "id": m.get("id"),
+        "direction": m.get("direction"),
+        "message_type": m.get("message_type"),
+        "status": m.get("status"),
+        "created_at": _parse_ts(m.get("created_at")),
+        "updated_at": _parse_ts(m.get("updated_at")),
+        "text": content_d.get("text"),
+        "media_asset_id": content_d.get("media_asset_id"),
+        "file_name": content_d.get("file_name"),
+        "provider_message_id": m.get("provider_message_id"),
+        "error_message": m.get("error_message"),
+        "content_json": json.dumps(content, ensure_ascii=False) if content is not None else None,
+        "metadata_json": json.dumps(metadata, ensure_ascii=False) if metadata is not None else None,
+    }
+
+
+class ColumnarWriter:
+    """
+    Acumula até batch_rows linhas em listas por coluna e grava cada lote como um
+    row group (Parquet) ou record batch (Arrow IPC). Memória limitada ao lote.
+    """
+    def __init__(self, path: Path, fmt: str = "parquet", batch_rows: int = 50_000):
+        self.path = path
+        self.fmt = fmt
+        self.batch_rows = batch_rows
+        self.schema = _columnar_schema()
+        self.rows = 0
+        self._buf: dict[str, list] = {name: [] for name in self.schema.names}
+        self._writer = None
+        self._sink = None
+
+    def add(self, row: dict) -> None:
+        for name, col in self._buf.items():
+            col.append(row.get(name))
+        if len(self._buf["id"]) >= self.batch_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        n = len(self._buf["id"])
+        if not n:
+            return
+        table = pa.Table.from_pydict(self._buf, schema=self.schema)
+        if self._writer is None:
+            if self.fmt == "parquet":
+                self._writer = pq.ParquetWriter(str(self.path), self.schema, compression="zstd")
+            else:
+                self._sink = pa.OSFile(str(self.path), "wb")
+                self._writer = pa.ipc.new_file(self._sink, self.schema)
+        if self.fmt == "parquet":
+            self._writer.write_table(table, row_group_size=n)
+        else:
+            self._writer.write_table(table)
+        self.rows += n
+        self._buf = {name: [] for name in self.schema.names}
+
+    def close(self) -> None:
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+
+
+def iter_delta_pages(conversation_id: str, since_cursor: str | None, updated_since: str | None, limit: int = 200):
+    # Pagina o delta pelo since_cursor até vir uma página incompleta (ou o cursor parar de andar)
+    while True:
+        delta = get_delta(conversation_id, since_cursor=since_cursor, updated_since=updated_since, limit=limit)
+        yield delta
+        nxt = delta.get("next_since_cursor")
+        if len(delta.get("items", [])) < limit or not nxt or nxt == since_cursor:
+            return
+        since_cursor = nxt
+
+
+def run_columnar_export(
+    out_dir: str,
+    fmt: str = "parquet",
+    batch_rows: int = 50_000,
+    page_size: int = 200,
+    phone_number_id: str | None = None,
+    full: bool = False,
+) -> dict:
+    """
+    Exporta para out_dir/part-<timestamp>.<ext> e mantém out_dir/_watermarks.json.
+    Conversas com watermark só exportam o delta desde a última execução (apêndice);
+    conversas novas (ou --full) exportam o histórico inteiro. Mensagens atualizadas
+    reaparecem como nova linha: na análise, fique com a de maior updated_at por id.
+    """
+    if pa is None:
+        raise SystemExit("ERRO: exportação colunar requer pyarrow (pip install pyarrow)")
+
+    base = Path(out_dir)
+    base.mkdir(parents=True, exist_ok=True)
+    wm_path = base / "_watermarks.json"
+    watermarks: dict[str, dict] = {}
+    if wm_path.exists() and not full:
+        watermarks = json.loads(wm_path.read_text(encoding="utf-8"))
+
+    ext = "parquet" if fmt == "parquet" else "arrow"
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    final_path = base / f"part-{stamp}.{ext}"
+    tmp_path = base / f".part-{stamp}.{ext}.tmp"
+
+    writer = ColumnarWriter(tmp_path, fmt=fmt, batch_rows=batch_rows)
+    new_watermarks = dict(watermarks)
+    conversations = 0
+    try:
+        for c in iter_conversations(page_size=page_size, phone_number_id=phone_number_id):
+            cid = _conversation_id(c)
+            if not cid:
+                continue
+            conversations += 1
+            wm = watermarks.get(cid)
+            if wm:
+                since_cursor, updated_since = wm.get("since_cursor"), wm.get("updated_since")
+                for delta in iter_delta_pages(cid, since_cursor, updated_since, limit=page_size):
+                    for it in delta.get("items", []):
+                        writer.add(message_to_row(cid, it))
+                    since_cursor = delta.get("next_since_cursor") or since_cursor
+                    updated_since = delta.get("server_time") or updated_since
+                new_watermarks[cid] = {"since_cursor": since_cursor, "updated_since": updated_since}
+            else:
+                # updated_since capturado antes de ler o histórico: nada atualizado durante a leitura se perde
+                updated_since = iso_now_utc()
+                last_key = None
+                for it in iter_messages(cid, page_size=page_size):
+                    writer.add(message_to_row(cid, it))
+                    key = message_sort_key(it)
+                    if last_key is None or key > last_key:
+                        last_key = key
+                since_cursor = f"{last_key[0]}|{last_key[1]}" if last_key else None
+                new_watermarks[cid] = {"since_cursor": since_cursor, "updated_since": updated_since}
+        writer.close()
+    except BaseException:
+        writer.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    # Watermarks só avançam depois que o arquivo está completo no disco
+    if writer.rows:
+        os.replace(tmp_path, final_path)
+    else:
+        tmp_path.unlink(missing_ok=True)
+    wm_tmp = wm_path.with_name(wm_path.name + ".tmp")
+    wm_tmp.write_text(json.dumps(new_watermarks, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(wm_tmp, wm_path)
+
+    return {
+        "conversations": conversations,
+        "rows": writer.rows,
+        "file": str(final_path) if writer.rows else None,
+        "watermarks": str(wm_path),
+    }
+
+
+# ----------------------------
+# Envio em lote (send-bulk)
+# ----------------------------
+BULK_FIELDS = ["type", "to", "text", "template", "lang", "params", "media_asset_id", "caption", "message_id", "phone_number_id"]
+
+
+def iter_bulk_rows(path: str):
+    # (row, None) por registro, ou (None, erro) para uma linha JSONL inválida: quem lê decide
+    # se o erro derruba o arquivo inteiro ou vira só o resultado daquela linha
+    p = Path(path)
+    with p.open("r", encoding="utf-8", newline="") as f:
+        if p.suffix.lower() == ".csv":
+            for row in csv.DictReader(f):
+                yield {k: v for k, v in row.items() if k and v not in (None, "")}, None
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield None, f"JSON inválido: {e}"
+                    continue
+                if isinstance(row, dict):
+                    yield row, None
+                else:
+                    yield None, f"esperado um objeto JSON, veio {type(row).__name__}"
+
+
+def read_bulk_rows(path: str):
+    for i, (row, error) in enumerate(iter_bulk_rows(path), start=1):
+        if error:
+            raise ValueError(f"{path}: registro {i}: {error}")
+        yield row
+
+
+def row_type(row: dict) -> str:
+    return row.get("type") or ("template" if row.get("template") else "text")
+
+
+def bulk_message_id(row: dict, seen: dict[str, int], prefix: str = "bulk", run_id: str | None = None) -> str:
+    # Derivado do conteúdo (número de origem, destino, tipo e payload) e do run_id: reexecutar
+    # o mesmo lote com o mesmo run_id reaproveita a idempotência do gateway, e um arquivo
+    # reescrito com outro conteúdo nunca reaproveita um id. Sem run_id o id é só do conteúdo
+    # (o mesmo conteúdo sai uma única vez, em qualquer execução).
+    # `seen` conta linhas idênticas no mesmo arquivo: a 2ª cópia é outro envio.
+    content = {k: v for k, v in row.items() if k != "message_id"}
+    content["type"] = row_type(row)
+    key = json.dumps(content, sort_keys=True, ensure_ascii=False)
+    if run_id:
+        key = f"{run_id}\n{key}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+    n = seen[digest] = seen.get(digest, 0) + 1
+    return f"{prefix}-{digest}" if n == 1 else f"{prefix}-{digest}-{n}"
+
+
+def dispatch_row(row: dict) -> dict:
+    msg_type = row_type(row)
+    if msg_type == "text":
+        return send_text(
+            to=row["to"],
+            text=row["text"],
+            message_id=row.get("message_id"),
+            phone_number_id=row.get("phone_number_id"),
+        )
+    if msg_type == "template":
+        return send_template(
+            to=row["to"],
+            template_name=row["template"],
+            language=row.get("lang") or "pt_BR",
+            message_id=row.get("message_id"),
+            phone_number_id=row.get("phone_number_id"),
+            components=template_components(row),
+        )
+    if msg_type in ("audio", "document"):
+        return send_media(
+            to=row["to"],
+            media_asset_id=row["media_asset_id"],
+            msg_type=msg_type,
+            message_id=row.get("message_id"),
+            caption=row.get("caption"),
+            phone_number_id=row.get("phone_number_id"),
+        )
+    raise ValueError(f"type inválido: {msg_type}")
+
+
+def _bulk_send_one(row_index: int, row: dict) -> dict:
+    t0 = time.perf_counter()
+    result = {"row": row_index, "to": row.get("to"), "message_id": row.get("message_id")}
+    try:
+        result["response"] = dispatch_row(row)
+        result["ok"] = True
+        # Gateway já tinha esse message_id: aceito, mas nada foi enviado de novo
+        result["duplicate"] = isinstance(result["response"], dict) and bool(result["response"].get("duplicate"))
+    except requests.HTTPError as e:
+        result["ok"] = False
+        result["status_code"] = e.response.status_code if e.response is not None else None
+        result["error"] = str(e)
+    except (requests.RequestException, KeyError, ValueError) as e:
+        result["ok"] = False
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return result
+
+
+def run_send_bulk(
+    source: str,
+    out_path: str,
+    workers: int,
+    rate: float | None,
+    phone_number_id: str | None = None,
+    progress_every: float = 5.0,
+    run_id: str | None = None,
+) -> dict:
+    if workers > POOL_SIZE:
+        configure_transport(workers)
+    # Teto por número só deste lote (escopo do comando, aplicado em http_request); o RATE_LIMITER
+    # do processo continua valendo por cima. Sem --rate e sem --phone-rate no processo: 10/s.
+    if rate is None and RATE_LIMITER.phone_rate is None:
+        rate = 10.0
+    limit_command_sends(rate)
+
+    # ok = enviados agora; duplicates = o gateway já tinha o message_id (nada saiu de novo)
+    ok = duplicates = failed = 0
+    t_start = time.perf_counter()
+    last_report = t_start
+    max_in_flight = workers * 4
+
+    with ScopedThreadPool(max_workers=workers) as pool, open(out_path, "w", encoding="utf-8") as out:
+        pending = set()
+
+        def drain(block_until_one: bool) -> None:
+            nonlocal pending, ok, duplicates, failed
+            done, pending = wait(pending, return_when=FIRST_COMPLETED, timeout=None if block_until_one else 0)
+            for fut in done:
+                res = fut.result()
+                if not res["ok"]:
+                    failed += 1
+                elif res["duplicate"]:
+                    duplicates += 1
+                else:
+                    ok += 1
+                out.write(json_dumps(res) + "\n")
+
+        seen_ids: dict[str, int] = {}
+        for i, (row, error) in enumerate(iter_bulk_rows(source), start=1):
+            if error:
+                # Linha ilegível não derruba o lote: vira o resultado dela no arquivo de saída
+                failed += 1
+                out.write(json_dumps({"row": i, "to": None, "message_id": None, "ok": False, "error": error}) + "\n")
+                continue
+            if phone_number_id and not row.get("phone_number_id"):
+                row["phone_number_id"] = phone_number_id
+            if not row.get("message_id"):
+                row["message_id"] = bulk_message_id(row, seen_ids, run_id=run_id)
+            pending.add(pool.submit(_bulk_send_one, i, row))
+            if len(pending) >= max_in_flight:
+                drain(block_until_one=True)
+
+            now = time.perf_counter()
+            if progress_every and now - last_report >= progress_every:
+                last_report = now
+                done_count = ok + duplicates + failed
+                print(
+                    f"[bulk] {done_count} concluídos ({ok} ok, {duplicates} duplicados, {failed} falhas) | {done_count / (now - t_start):.1f} msg/s",
+                    file=sys.stderr,
+                )
+
+        while pending:
+            drain(block_until_one=True)
+
+    elapsed = time.perf_counter() - t_start
+    total = ok + duplicates + failed
+    return {
+        "run_id": run_id,
+        "total": total,
+        "ok": ok,
+        "duplicates": duplicates,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_msg_s": round(total / elapsed, 2) if elapsed > 0 else None,
+        "sent_msg_s": round(ok / elapsed, 2) if elapsed > 0 else None,
+        "out": out_path,
+    }
+
+
+# ----------------------------
+# Estado de conversas em lote (conversation-state --batch)
+# ----------------------------
+def read_batch_ids(source: str) -> tuple[list[str], int]:
+    # Um external_id por linha (ou a 1ª coluna de um CSV); "-" lê do stdin.
+    # Devolve os ids únicos na ordem de entrada + quantas linhas válidas foram lidas.
+    f = sys.stdin if source == "-" else open(source, "r", encoding="utf-8", newline="")
+    try:
+        ids = [line.split(",", 1)[0].strip().strip('"') for line in f]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    ids = [i for i in ids if i and not i.startswith("#") and i != "external_id"]
+    return list(dict.fromkeys(ids)), len(ids)
+
+
+def _state_one(external_id: str, phone_number_id: str | None) -> dict:
+    result = {"external_id": external_id, "cached": False}
+    try:
+        result["state"] = get_conversation_state(external_id, phone_number_id=phone_number_id)
+        result["ok"] = True
+    except requests.HTTPError as e:
+        result["ok"] = False
+        result["status_code"] = e.response.status_code if e.response is not None else None
+        result["error"] = str(e)
+    except requests.RequestException as e:
+        result["ok"] = False
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def run_state_batch(
+    source: str,
+    out_path: str | None,
+    workers: int,
+    phone_number_id: str | None = None,
+    cache: LocalCache | None = None,
+    max_age: float = 300.0,
+    progress_every: float = 5.0,
+) -> dict:
+    """
+    Resolve muitos external_id de uma vez: repetidos viram uma consulta só, os resolvidos
+    há menos de max_age segundos saem do cache local e o resto vai ao gateway com até
+    `workers` GETs em paralelo. Cada resultado é uma linha NDJSON, na ordem de conclusão.
+    """
+    if workers > POOL_SIZE:
+        configure_transport(workers)
+
+    t_start = time.perf_counter()
+    ids, read = read_batch_ids(source)
+    cached = cache.lookup_states(ids, phone_number_id, max_age) if cache is not None and max_age > 0 else {}
+    todo = [i for i in ids if i not in cached]
+
+    ok = failed = 0
+    fresh: list[tuple[str, dict]] = []  # gravados no cache em lotes (1 transação a cada 500)
+    last_report = t_start
+    max_in_flight = workers * 4
+    out = sys.stdout if out_path in (None, "-") else open(out_path, "w", encoding="utf-8")
+    try:
+        for external_id in ids:
+            if external_id in cached:
+                out.write(json_dumps({"external_id": external_id, "cached": True, "state": cached[external_id], "ok": True}) + "\n")
+
+        with ScopedThreadPool(max_workers=max(workers, 1)) as pool:
+            pending = set()
+
+            def drain(block_until_one: bool) -> None:
+                nonlocal pending, ok, failed
+                done, pending = wait(pending, return_when=FIRST_COMPLETED, timeout=None if block_until_one else 0)
+                for fut in done:
+                    res = fut.result()
+                    if res["ok"]:
+                        ok += 1
+                        fresh.append((res["external_id"], res["state"]))
+                    else:
+                        failed += 1
+                    out.write(json_dumps(res) + "\n")
+                if cache is not None and len(fresh) >= 500:
+                    cache.remember_states(fresh, phone_number_id)
+                    fresh.clear()
+
+            for external_id in todo:
+                pending.add(pool.submit(_state_one, external_id, phone_number_id))
+                if len(pending) >= max_in_flight:
+                    drain(block_until_one=True)
+
+                now = time.perf_counter()
+                if progress_every and now - last_report >= progress_every:
+                    last_report = now
+                    done_count = ok + failed
+                    print(f"[state] {done_count}/{len(todo)} consultados ({failed} falhas) | {done_count / (now - t_start):.1f} ids/s", file=sys.stderr)
+
+            while pending:
+                drain(block_until_one=True)
+    finally:
+        if cache is not None and fresh:
+            cache.remember_states(fresh, phone_number_id)
+        if out is not sys.stdout:
+            out.close()
+        else:
+            out.flush()
+
+    elapsed = time.perf_counter() - t_start
+    return {
+        "read": read,
+        "unique": len(ids),
+        "cached": len(cached),
+        "fetched": ok + failed,
+        "ok": ok + len(cached),
+        "failed": failed,
+        "elapsed_s": round(elapsed, 3),
+        "ids_per_s": round(len(ids) / elapsed, 1) if elapsed > 0 else None,
+        "out": out_path or "-",
+    }
+
+
+# ----------------------------
+# Outbox (fila durável de envios)
+# ----------------------------
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    # Zumbi (morto, ainda não colhido pelo pai) também conta como morto
+    try:
+        return Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return True
+
+
+class Outbox:
+    """
+    Fila de envios em SQLite WAL. O enqueue só grava a linha (com o message_id já
+    fixado); o drainer reivindica lotes com lease, envia e confirma (ack). Se o
+    processo morre no meio, o lease expira e a linha é reentregue com o mesmo
+    message_id, que o gateway deduplica.
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id TEXT NOT NULL UNIQUE,
+        row TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        lease_until REAL,
+        lease_owner TEXT,
+        last_error TEXT,
+        response TEXT,
+        created_at REAL NOT NULL,
+        sent_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS ix_outbox_due ON outbox (state, next_attempt_at, seq);
+    """
+    STATES = ("pending", "inflight", "sent", "failed")
+    OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+    def __init__(self, path: str = OUTBOX_DB):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        # timeout: outro processo (produtor ou drainer) pode estar com o lock de escrita
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    def enqueue(self, row: dict) -> str:
+        return self.enqueue_many([row])[0]
+
+    def enqueue_many(self, rows) -> list[str]:
+        # message_id repetido é ignorado: reenfileirar o mesmo lote não duplica envios
+        now = time.time()
+        ids = []
+        with self._lock, self.conn:
+            for row in rows:
+                row = {k: v for k, v in row.items() if v is not None}
+                row.setdefault("message_id", new_message_id("outbox"))
+                self.conn.execute(
+                    "INSERT INTO outbox (message_id, row, next_attempt_at, created_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(message_id) DO NOTHING",
+                    (row["message_id"], json_dumps(row), now, now),
+                )
+                ids.append(row["message_id"])
+        return ids
+
+    def claim(self, limit: int, lease_s: float) -> list[tuple[int, int, dict]]:
+        # BEGIN IMMEDIATE: dois drainers (processos) nunca reivindicam a mesma linha
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute(
+                "SELECT seq, attempts, row FROM outbox "
+                "WHERE (state = 'pending' AND next_attempt_at <= ?) OR (state = 'inflight' AND lease_until < ?) "
+                "ORDER BY seq LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE outbox SET state = 'inflight', lease_until = ?, lease_owner = ?, attempts = attempts + 1 "
+                "WHERE seq = ?",
+                [(now + lease_s, self.OWNER, seq) for seq, _, _ in rows],
+            )
+        return [(seq, attempts + 1, json_loads(row)) for seq, attempts, row in rows]
+
+    def recover_orphans(self) -> int:
+        # Drainer desta máquina que morreu (pid não existe mais): não precisa esperar o lease expirar
+        if os.name != "posix":
+            return 0
+        host = socket.gethostname()
+        dead = []
+        with self._lock:
+            owners = self.conn.execute(
+                "SELECT DISTINCT lease_owner FROM outbox WHERE state = 'inflight' AND lease_owner IS NOT NULL"
+            ).fetchall()
+        for (owner,) in owners:
+            owner_host, _, pid = owner.rpartition(":")
+            if owner_host == host and pid.isdigit() and owner != self.OWNER and not _pid_alive(int(pid)):
+                dead.append(owner)
+        if not dead:
+            return 0
+        with self._lock, self.conn:
+            return self.conn.executemany(
+                "UPDATE outbox SET state = 'pending', lease_until = NULL, lease_owner = NULL "
+                "WHERE state = 'inflight' AND lease_owner = ?",
+                [(owner,) for owner in dead],
+            ).rowcount
+
+    def ack(self, seq: int, response: dict) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET state = 'sent', sent_at = ?, lease_until = NULL, last_error = NULL, response = ? "
+                "WHERE seq = ?",
+                (time.time(), json_dumps(response), seq),
+            )
+
+    def retry(self, seq: int, error: str, delay_s: float) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET state = 'pending', next_attempt_at = ?, lease_until = NULL, last_error = ? "
+                "WHERE seq = ?",
+                (time.time() + delay_s, error, seq),
+            )
+
+    def fail(self, seq: int, error: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET state = 'failed', lease_until = NULL, last_error = ? WHERE seq = ?",
+                (error, seq),
+            )
+
+    def outstanding(self) -> int:
+        # pending (inclusive os agendados para retry) + inflight
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE state IN ('pending', 'inflight')"
+            ).fetchone()[0]
+
+    def status(self, failed_limit: int = 0) -> dict:
+        with self._lock:
+            counts = dict(self.conn.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall())
+            oldest = self.conn.execute(
+                "SELECT MIN(created_at) FROM outbox WHERE state IN ('pending', 'inflight')"
+            ).fetchone()[0]
+            failed = self.conn.execute(
+                "SELECT message_id, attempts, last_error FROM outbox WHERE state = 'failed' ORDER BY seq DESC LIMIT ?",
+                (failed_limit,),
+            ).fetchall()
+        result = {state: counts.get(state, 0) for state in self.STATES}
+        result["oldest_outstanding_s"] = round(time.time() - oldest, 1) if oldest else None
+        if failed_limit:
+            result["recent_failed"] = [
+                {"message_id": mid, "attempts": attempts, "error": err} for mid, attempts, err in failed
+            ]
+        return result
+
+    def requeue_failed(self) -> int:
+        with self._lock, self.conn:
+            return self.conn.execute(
+                "UPDATE outbox SET state = 'pending', attempts = 0, next_attempt_at = ? WHERE state = 'failed'",
+                (time.time(),),
+            ).rowcount
+
+    def purge_sent(self, older_than_s: float) -> int:
+        with self._lock, self.conn:
+            return self.conn.execute(
+                "DELETE FROM outbox WHERE state = 'sent' AND sent_at < ?", (time.time() - older_than_s,)
+            ).rowcount
+
+
+class OutboxDrainer:
+    """
+    Entrega a outbox em background: a thread do drainer reivindica lotes e um pool
+    de workers envia. 429 já é absorvido no http_request (token bucket); aqui 4xx
+    definitivo vira failed e o resto volta para a fila com backoff exponencial.
+    """
+    TRANSIENT_4XX = (408, 425, 429)
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        workers: int = 8,
+        lease_s: float = 120.0,
+        max_attempts: int = 8,
+        base_delay: float = 2.0,
+        max_delay: float = 300.0,
+        idle_sleep: float = 0.5,
+    ):
+        self.outbox = outbox
+        self.workers = workers
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idle_sleep = idle_sleep
+        self.stats = {"sent": 0, "retried": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self, until_empty: bool = False) -> None:
+        # Contexto de quem iniciou: os envios contam no escopo (e no --rate) do comando
+        ctx = contextvars.copy_context()
+        self._thread = threading.Thread(target=ctx.run, args=(self.run, until_empty), name="outbox-drainer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        # Para de reivindicar; o que já está em voo termina e é confirmado
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _settle_error(self, seq: int, attempts: int, error: str, permanent: bool) -> None:
+        if permanent or attempts >= self.max_attempts:
+            self.outbox.fail(seq, error)
+            self._count("failed")
+            return
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+        self.outbox.retry(seq, error, delay)
+        self._count("retried")
+
+    def _deliver(self, seq: int, attempts: int, row: dict) -> None:
+        try:
+            response = dispatch_row(row)
+        except requests.HTTPError as e:
+            code = e.response.status_code if e.response is not None else None
+            permanent = code is not None and 400 <= code < 500 and code not in self.TRANSIENT_4XX
+            self._settle_error(seq, attempts, f"HTTP {code}: {e}", permanent)
+        except (KeyError, ValueError) as e:
+            self._settle_error(seq, attempts, f"{type(e).__name__}: {e}", permanent=True)
+        except requests.RequestException as e:
+            self._settle_error(seq, attempts, f"{type(e).__name__}: {e}", permanent=False)
+        else:
+            self.outbox.ack(seq, response)
+            self._count("sent")
+
+    def run(self, until_empty: bool = False) -> None:
+        recovered = self.outbox.recover_orphans()
+        if recovered:
+            print(f"[outbox] {recovered} envios em voo de um drainer encerrado voltaram para a fila", file=sys.stderr)
+        in_flight: set = set()
+        with ScopedThreadPool(max_workers=self.workers) as pool:
+            while not self._stop.is_set():
+                # Até 2x workers em voo: o pool nunca fica ocioso esperando o próximo claim
+                free = self.workers * 2 - len(in_flight)
+                batch = self.outbox.claim(free, self.lease_s) if free > 0 else []
+                for seq, attempts, row in batch:
+                    in_flight.add(pool.submit(self._deliver, seq, attempts, row))
+                if in_flight:
+                    done, in_flight = wait(in_flight, timeout=self.idle_sleep, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        fut.result()
+                elif until_empty and not self.outbox.outstanding():
+                    break
+                else:
+                    self._stop.wait(self.idle_sleep)
+            for fut in in_flight:
+                fut.result()
+
 
-# ----------------------------
-# Config
-# ----------------------------
-load_dotenv()
+_open_outboxes: dict[str, Outbox] = {}
+_open_outboxes_lock = threading.Lock()
 
-BASE_URL = os.getenv("GATEWAY_BASE_URL").rstrip("/")
-API_KEY = os.getenv("WHATSAPP_GATEWAY_API_KEY")
-print(f'ESTA É A NOSSA LINDA URL=========== {BASE_URL} ===========================')
-print(f'ESTA É A NOSSA API KEY=========== {API_KEY} ===========================')
 
+def open_outbox(path: str = OUTBOX_DB) -> Outbox:
+    with _open_outboxes_lock:
+        outbox = _open_outboxes.get(path)
+        if outbox is None:
+            outbox = _open_outboxes[path] = Outbox(path)
+        return outbox
 
-if not API_KEY:
-    print("ERRO: defina a variável WHATSAPP_GATEWAY_API_KEY no ambiente.")
-    sys.exit(1)
 
-HEADERS = {"X-API-Key": API_KEY}
+def outbox_row_from_args(args: argparse.Namespace) -> dict:
+    row = {
+        "to": args.to,
+        "message_id": args.message_id,
+        "phone_number_id": args.phone_number_id,
+    }
+    if args.cmd == "send-text":
+        row.update(type="text", text=args.text)
+    elif args.cmd == "send-template":
+        row.update(type="template", template=args.name, lang=args.lang, params=args.param)
+    else:
+        row.update(type=args.type, media_asset_id=args.media_asset_id, caption=args.caption)
+    row = compact_payload(row)
+    if not row.get("message_id"):
+        # Mesmo id por conteúdo do outbox-enqueue: o produtor que cai e roda de novo não
+        # enfileira o envio duas vezes (um envio novo com o mesmo conteúdo pede --message-id)
+        row["message_id"] = bulk_message_id(row, {}, prefix="outbox")
+    return row
+
+
+def run_outbox_drain(outbox: Outbox, workers: int, follow: bool, lease_s: float, max_attempts: int, progress_every: float = 5.0) -> dict:
+    if workers > POOL_SIZE:
+        configure_transport(workers)
+    drainer = OutboxDrainer(outbox, workers=workers, lease_s=lease_s, max_attempts=max_attempts)
+    t_start = time.perf_counter()
+    drainer.start(until_empty=not follow)
+    try:
+        while drainer.is_alive():
+            drainer._thread.join(progress_every)
+            if drainer.is_alive():
+                s = drainer.stats
+                print(
+                    f"[outbox] {s['sent']} enviados, {s['retried']} retries, {s['failed']} falhas | "
+                    f"{outbox.outstanding()} pendentes",
+                    file=sys.stderr,
+                )
+    except KeyboardInterrupt:
+        print("\n[outbox] parando: aguardando envios em voo...", file=sys.stderr)
+        drainer.stop()
+    elapsed = time.perf_counter() - t_start
+    return {
+        **drainer.stats,
+        "outstanding": outbox.outstanding(),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_msg_s": round(drainer.stats["sent"] / elapsed, 2) if elapsed > 0 else None,
+    }
 
 
 # ----------------------------
-# HTTP helpers
+# Campanhas de template (ritmo por phone_number_id, janelas de envio, checkpoint)
 # ----------------------------
-def http_get(path: str, params: dict | None = None) -> dict:
-    url = f"{BASE_URL}{path}"
-    r = requests.get(url, headers=HEADERS, params=params or {}, timeout=30)
-    r.raise_for_status()
-    if not r.content:
-        return {}
-    return r.json()
+WEEKDAYS = {
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+    "seg": 0, "ter": 1, "qua": 2, "qui": 3, "sex": 4, "sab": 5, "dom": 6,
+}
 
 
-def http_post_json(path: str, payload: dict | None = None) -> dict:
-    url = f"{BASE_URL}{path}"
-    headers = dict(HEADERS)
-    if payload is not None:
-        headers["Content-Type"] = "application/json"
-    r = requests.post(
-        url,
-        headers=headers,
-        json=payload,
-        timeout=60,
-    )
-    r.raise_for_status()
-    if not r.content:
-        return {}
-    return r.json()
+@dataclass(frozen=True)
+class SendWindow:
+    """Dias da semana (0 = segunda) + horário local [start, end); end <= start cruza a meia-noite."""
+    days: frozenset[int]
+    start: dtime
+    end: dtime
 
+    @classmethod
+    def parse(cls, spec: str) -> "SendWindow":
+        # "09:00-18:00" (todo dia), "mon-fri 09:00-18:00", "sat,sun 10:00-14:00", "seg-sex 08:00-20:00"
+        try:
+            *day_spec, hours = spec.split()
+            if len(day_spec) > 1:
+                raise ValueError
+            days = set(range(7)) if not day_spec else set()
+            for item in day_spec[0].lower().split(",") if day_spec else []:
+                first, _, last = item.partition("-")
+                a, b = WEEKDAYS[first], WEEKDAYS[last or first]
+                days.update(range(a, b + 1) if a <= b else [*range(a, 7), *range(0, b + 1)])
+            start, end = hours.split("-")
+            return cls(frozenset(days), dtime.fromisoformat(start), dtime.fromisoformat(end))
+        except (KeyError, ValueError):
+            raise ValueError(f"janela inválida: {spec!r} (ex: \"mon-fri 09:00-18:00\")") from None
 
-def compact_payload(payload: dict) -> dict:
-    return {k: v for k, v in payload.items() if v is not None}
 
+def window_state(windows: list[SendWindow], now: datetime) -> tuple[bool, datetime | None]:
+    # (aberta agora?, quando isso muda); sem janelas = sempre aberta
+    if not windows:
+        return True, None
+    spans = []
+    for offset in range(-1, 8):
+        day = (now + timedelta(days=offset)).date()
+        for w in windows:
+            if day.weekday() not in w.days:
+                continue
+            start = datetime.combine(day, w.start, tzinfo=now.tzinfo)
+            end = datetime.combine(day + timedelta(days=1) if w.end <= w.start else day, w.end, tzinfo=now.tzinfo)
+            spans.append((start, end))
+    open_until = [end for start, end in spans if start <= now < end]
+    if open_until:
+        return True, max(open_until)
+    upcoming = [start for start, _ in spans if start > now]
+    return False, min(upcoming) if upcoming else None
 
-# ----------------------------
-# Gateway: Send
-# ----------------------------
-def send_media(
-    to: str,
-    media_asset_id: str,
-    msg_type: str,
-    message_id: str | None = None,
-    caption: str | None = None,
-    phone_number_id: str | None = None,
-) -> dict:
-    payload = compact_payload(
-        {
-            "to": to,
-            "type": msg_type,  # "audio" ou "document"
-            "media_asset_id": media_asset_id,
-            "message_id": message_id or f"cli-{int(time.time())}",
-            "caption": caption,
-            "phone_number_id": phone_number_id,
-        }
-    )
-    return http_post_json("/gateway/send", payload)
 
+class CampaignStore:
+    """
+    Campanhas e destinatários em SQLite WAL; a tabela de destinatários é o checkpoint.
+    Um destinatário só sai de 'pending' quando o envio termina, então um runner
+    interrompido retoma dos pendentes, e quem estava em voo é reenviado com o mesmo
+    message_id (o gateway deduplica).
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS campaigns (
+        name TEXT PRIMARY KEY,
+        config TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'ready',
+        runner TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS campaign_recipients (
+        campaign TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        message_id TEXT NOT NULL UNIQUE,
+        row TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        sent_at REAL,
+        PRIMARY KEY (campaign, seq)
+    );
+    CREATE INDEX IF NOT EXISTS ix_campaign_recipients_state ON campaign_recipients (campaign, state, seq);
+    """
+    OWNER = Outbox.OWNER
 
-def send_text(to: str, text: str, message_id: str | None = None, phone_number_id: str | None = None) -> dict:
-    payload = compact_payload(
-        {
-            "to": to,
-            "type": "text",
-            "text": text,
-            "message_id": message_id or f"cli-{int(time.time())}",
-            "phone_number_id": phone_number_id,
-        }
-    )
-    return http_post_json("/gateway/send", payload)
+    def __init__(self, path: str = CAMPAIGN_DB):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
 
+    def create(self, name: str, config: dict, rows: list[tuple[int, dict]], replace: bool = False) -> int:
+        # Recriar com os mesmos destinatários só atualiza a config (message_id por conteúdo).
+        # Destinatários diferentes exigem replace: sem isso a campanha antiga seguiria valendo
+        # em silêncio. No replace, quem já recebeu a mesma mensagem tem o mesmo message_id e
+        # o gateway deduplica; linhas novas ou alteradas saem com id novo.
+        config = {**config, "rows_sha256": campaign_rows_digest(rows)}
+        now = time.time()
+        with self._lock, self.conn:
+            existing = self.conn.execute("SELECT config, state FROM campaigns WHERE name = ?", (name,)).fetchone()
+            if existing is not None and json_loads(existing[0]).get("rows_sha256") != config["rows_sha256"]:
+                previous = json_loads(existing[0]).get("source") or "outro arquivo"
+                if not replace:
+                    raise ValueError(
+                        f"campanha {name!r} já existe com outros destinatários ({previous}): "
+                        "use --replace para trocar a lista ou outro nome"
+                    )
+                if existing[1] == "running":
+                    raise ValueError(f"campanha {name!r} está rodando: campaign-pause antes do --replace")
+                self.conn.execute("DELETE FROM campaign_recipients WHERE campaign = ?", (name,))
+            self.conn.execute(
+                "INSERT INTO campaigns (name, config, created_at, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET config = excluded.config, updated_at = excluded.updated_at",
+                (name, json_dumps(config), now, now),
+            )
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT INTO campaign_recipients (campaign, seq, message_id, row) VALUES (?, ?, ?, ?) ON CONFLICT DO NOTHING",
+                ((name, seq, row["message_id"], json_dumps(row)) for seq, row in rows),
+            )
+            return self.conn.total_changes - before
 
-def send_template(
-    to: str,
-    template_name: str,
-    language: str = "pt_BR",
-    message_id: str | None = None,
-    phone_number_id: str | None = None,
-) -> dict:
-    payload = compact_payload(
-        {
-            "to": to,
-            "type": "template",
-            "template": {"name": template_name, "language": language},
-            "message_id": message_id or f"cli-{int(time.time())}",
-            "phone_number_id": phone_number_id,
-        }
-    )
-    return http_post_json("/gateway/send", payload)
+    def config(self, name: str) -> dict:
+        with self._lock:
+            row = self.conn.execute("SELECT config FROM campaigns WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return json_loads(row[0])
 
+    def state(self, name: str) -> str | None:
+        with self._lock:
+            row = self.conn.execute("SELECT state FROM campaigns WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
 
-def get_conversation_state(external_id: str, phone_number_id: str | None = None) -> dict:
-    params = {}
-    if phone_number_id:
-        params["phone_number_id"] = phone_number_id
-    return http_get(f"/gateway/conversations/{external_id}", params=params)
+    def set_state(self, name: str, state: str) -> None:
+        runner = self.OWNER if state == "running" else None
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE campaigns SET state = ?, runner = ?, updated_at = ? WHERE name = ?", (state, runner, time.time(), name)
+            )
 
+    def claim(self, name: str) -> None:
+        # Um runner por campanha; o de um processo morto não conta
+        with self._lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("SELECT state, runner FROM campaigns WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise KeyError(name)
+            state, runner = row
+            if state == "running" and runner and runner != self.OWNER:
+                host, _, pid = runner.rpartition(":")
+                if host != socket.gethostname() or _pid_alive(int(pid)):
+                    raise RuntimeError(f"campanha {name!r} já está rodando em {runner}")
+            self.conn.execute(
+                "UPDATE campaigns SET state = 'running', runner = ?, updated_at = ? WHERE name = ?", (self.OWNER, time.time(), name)
+            )
 
-def iso_now_utc() -> str:
-    return datetime.now(timezone.utc).isoformat()
+    def pending(self, name: str, after_seq: int, limit: int) -> list[tuple[int, int, dict]]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT seq, attempts, row FROM campaign_recipients WHERE campaign = ? AND state = 'pending' AND seq > ? "
+                "ORDER BY seq LIMIT ?",
+                (name, after_seq, limit),
+            ).fetchall()
+        return [(seq, attempts, json_loads(row)) for seq, attempts, row in rows]
 
+    def settle(self, name: str, seq: int, state: str, attempts: int, error: str | None = None) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE campaign_recipients SET state = ?, attempts = ?, last_error = ?, sent_at = ? WHERE campaign = ? AND seq = ?",
+                (state, attempts, error, time.time() if state == "sent" else None, name, seq),
+            )
 
-# ----------------------------
-# Gateway: Conversations & Messages
-# ----------------------------
-def list_conversations(limit: int = 20, phone_number_id: str | None = None) -> dict:
-    params = {"limit": limit}
-    if phone_number_id:
-        params["phone_number_id"] = phone_number_id
-    return http_get("/gateway/conversations", params=params)
+    def retry_failed(self, name: str) -> int:
+        with self._lock, self.conn:
+            return self.conn.execute(
+                "UPDATE campaign_recipients SET state = 'pending', attempts = 0 WHERE campaign = ? AND state = 'failed'", (name,)
+            ).rowcount
 
+    def counts(self, name: str) -> dict[str, int]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT state, COUNT(*) FROM campaign_recipients WHERE campaign = ? GROUP BY state", (name,)
+            ).fetchall()
+        counts = {"pending": 0, "sent": 0, "failed": 0, **dict(rows)}
+        counts["total"] = sum(counts.values())
+        return counts
 
-def list_messages(conversation_id: str, limit: int = 50, cursor: str | None = None) -> dict:
-    params = {"limit": limit}
-    if cursor:
-        params["cursor"] = cursor
-    return http_get(f"/gateway/conversations/{conversation_id}/messages", params=params)
+    def status(self, name: str | None = None) -> list[dict]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT name, config, state, runner, updated_at FROM campaigns WHERE ? IS NULL OR name = ? ORDER BY created_at",
+                (name, name),
+            ).fetchall()
+        return [
+            {
+                "name": n,
+                "state": state,
+                "runner": runner,
+                "updated_at": datetime.fromtimestamp(updated, timezone.utc).isoformat(),
+                **self.counts(n),
+                "config": json_loads(config),
+            }
+            for n, config, state, runner, updated in rows
+        ]
 
 
-def get_delta(conversation_id: str, since_cursor: str | None, updated_since: str | None, limit: int = 200) -> dict:
-    params = {"limit": limit}
-    if since_cursor:
-        params["since_cursor"] = since_cursor
-    if updated_since:
-        params["updated_since"] = updated_since
-    return http_get(f"/gateway/conversations/{conversation_id}/messages/delta", params=params)
+_open_campaign_stores: dict[str, CampaignStore] = {}
 
 
-def upsert(local_by_id: dict[str, dict], item: dict) -> None:
-    msg_id = item.get("id")
-    if not msg_id:
-        return
+def open_campaigns(path: str = CAMPAIGN_DB) -> CampaignStore:
+    with _open_caches_lock:
+        store = _open_campaign_stores.get(path)
+        if store is None:
+            store = _open_campaign_stores[path] = CampaignStore(path)
+        return store
 
-    if msg_id in local_by_id:
-        # Atualiza campos mutáveis
-        for k in ["status", "updated_at", "error_message", "content", "provider_message_id", "metadata"]:
-            if k in item:
-                local_by_id[msg_id][k] = item[k]
-    else:
-        local_by_id[msg_id] = item
 
+def load_campaign_rows(source: str, name: str, phone_number_id: str | None) -> list[tuple[int, dict]]:
+    rows = []
+    seen_ids: dict[str, int] = {}
+    for i, row in enumerate(read_bulk_rows(source), start=1):
+        if not row.get("to"):
+            raise ValueError(f"{source}:{i}: campo 'to' ausente")
+        if phone_number_id and not row.get("phone_number_id"):
+            row["phone_number_id"] = phone_number_id
+        if not row.get("message_id"):
+            row["message_id"] = bulk_message_id(row, seen_ids, prefix=f"camp-{name}")
+        rows.append((i, row))
+    return rows
 
-def format_msg(m: dict) -> str:
-    direction = m.get("direction", "?")
-    mtype = m.get("message_type", "?")
-    status = m.get("status", "?")
-    created_at = (m.get("created_at") or "")[:19].replace("T", " ")
-    updated_at = (m.get("updated_at") or "")[:19].replace("T", " ")
-    content = m.get("content") or {}
 
-    # Texto
-    if isinstance(content, dict) and "text" in content:
-        body = content.get("text", "")
+def campaign_rows_digest(rows: list[tuple[int, dict]]) -> str:
+    # Identidade da lista de destinatários (ordem e conteúdo), para o campaign-create saber se mudou
+    h = hashlib.sha256()
+    for seq, row in rows:
+        h.update(json.dumps([seq, row], sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
 
-    # Placeholder de mídia
-    elif isinstance(content, dict) and content.get("media_asset_id"):
-        fname = content.get("file_name") or "media"
-        body = f"[MEDIA {mtype}] {fname} (media_asset_id={content.get('media_asset_id')})"
 
-    else:
-        body = str(content)[:120]
+class CampaignRunner:
+    """
+    Envia os pendentes de uma campanha no ritmo configurado por phone_number_id.
+    Cada número tem o seu próximo horário livre (1/rate depois do anterior, sem acumular
+    atraso) e um heap escolhe sempre o número mais adiantado: vários números intercalam
+    sem rajadas. Fora das janelas o runner dorme até a próxima abertura; campaign-pause
+    (ou Ctrl+C) para de agendar, espera os envios em voo e deixa a campanha 'paused'.
+    """
+    TRANSIENT_4XX = OutboxDrainer.TRANSIENT_4XX
 
-    return f"{created_at} [{direction}] {mtype} {status} | {body} | upd={updated_at}"
+    def __init__(self, store: CampaignStore, name: str, workers: int = 4, max_attempts: int = 5, progress_every: float = 5.0):
+        self.store = store
+        self.name = name
+        self.config = store.config(name)
+        self.interval = 1.0 / float(self.config["rate"])
+        self.windows = [SendWindow.parse(w) for w in self.config.get("windows") or []]
+        self.tz = ZoneInfo(self.config["tz"]) if self.config.get("tz") else None
+        self.workers = max(workers, 1)
+        self.max_attempts = max_attempts
+        self.progress_every = progress_every
+        self.stats = {"sent": 0, "failed": 0, "retried": 0}
+        self._queues: dict[str, deque] = {}
+        self._next_slot: dict[str, float] = {}
+        self._heap: list[tuple[float, str]] = []
+        self._last_seq = 0
+        self._exhausted = False
+        self._in_flight: dict = {}  # future -> (seq, attempts, row)
+        self._hold_until = 0.0  # circuito de send aberto: nada é agendado antes disso
 
+    def now(self) -> datetime:
+        return datetime.now(self.tz) if self.tz else datetime.now().astimezone()
 
-def run_poll(conversation_id: str, history_limit: int, poll_interval: float, delta_limit: int, max_render: int):
-    # 1) Cold start: histórico
-    hist = list_messages(conversation_id, limit=history_limit)
-    local: dict[str, dict] = {}
-    for it in hist.get("items", []):
-        upsert(local, it)
+    # --- fila em memória: um deque por número + heap (próximo horário, número) ---
 
-    ordered = sorted(local.values(), key=lambda x: (x.get("created_at", ""), x.get("id", "")))
+    def _push(self, item: tuple[int, int, dict]) -> None:
+        phone = item[2].get("phone_number_id") or ""
+        q = self._queues.setdefault(phone, deque())
+        if not q:
+            heapq.heappush(self._heap, (self._next_slot.get(phone, 0.0), phone))
+        q.append(item)
 
-    # Inicialização pragmática de since_cursor (o delta devolverá next_since_cursor oficial)
-    since_cursor = None
-    if ordered:
-        last = ordered[-1]
-        since_cursor = f"{last.get('created_at')}|{last.get('id')}"
+    def _buffered(self) -> int:
+        return sum(len(q) for q in self._queues.values())
 
-    # updated_since inicial: agora; depois vira server_time do gateway
-    updated_since = iso_now_utc()
+    def _refill(self) -> None:
+        if self._exhausted or self._buffered() >= 500:
+            return
+        rows = self.store.pending(self.name, self._last_seq, 2000)
+        if not rows:
+            self._exhausted = True
+        for item in rows:
+            self._last_seq = item[0]
+            self._push(item)
 
-    print(f"Polling conversation_id={conversation_id}")
-    print("Ctrl+C para sair.\n")
+    # --- envio ---
 
-    while True:
+    def _send(self, row: dict) -> dict:
+        return send_template(
+            to=row["to"],
+            template_name=row.get("template") or self.config["template"],
+            language=row.get("lang") or self.config["lang"],
+            message_id=row["message_id"],
+            phone_number_id=row.get("phone_number_id"),
+            components=template_components(row),
+        )
+
+    def _settle(self, fut, item: tuple[int, int, dict]) -> None:
+        seq, attempts, row = item
+        attempts += 1
         try:
-            # Renderiza
-            ordered = sorted(local.values(), key=lambda x: (x.get("created_at", ""), x.get("id", "")))
-            os.system("cls" if os.name == "nt" else "clear")
+            fut.result()
+        except CircuitOpen as e:
+            # Nada saiu: volta para a fila sem gastar tentativa e o agendamento espera a prova
+            self._hold_until = max(self._hold_until, time.monotonic() + e.retry_in)
+            self._push(item)
+        except requests.HTTPError as e:
+            code = e.response.status_code if e.response is not None else None
+            permanent = code is not None and 400 <= code < 500 and code not in self.TRANSIENT_4XX
+            self._failed(item, attempts, f"HTTP {code}: {e}", permanent)
+        except (KeyError, ValueError) as e:
+            self._failed(item, attempts, f"{type(e).__name__}: {e}", permanent=True)
+        except requests.RequestException as e:
+            self._failed(item, attempts, f"{type(e).__name__}: {e}", permanent=False)
+        else:
+            self.store.settle(self.name, seq, "sent", attempts)
+            self.stats["sent"] += 1
 
-            print(f"Gateway: {BASE_URL}")
-            print(f"Conversation: {conversation_id}")
-            print(f"since_cursor: {since_cursor}")
-            print(f"updated_since: {updated_since}")
-            print("-" * 110)
+    def _failed(self, item: tuple[int, int, dict], attempts: int, error: str, permanent: bool) -> None:
+        seq, _, row = item
+        if permanent or attempts >= self.max_attempts:
+            self.store.settle(self.name, seq, "failed", attempts, error)
+            self.stats["failed"] += 1
+            return
+        # Transitório: volta para o fim da fila do número (o ritmo já espaça a nova tentativa)
+        self.store.settle(self.name, seq, "pending", attempts, error)
+        self.stats["retried"] += 1
+        self._push((seq, attempts, row))
 
-            tail = ordered[-max_render:] if len(ordered) > max_render else ordered
-            for m in tail:
-                print(format_msg(m))
+    def _collect(self, timeout: float | None) -> None:
+        if not self._in_flight:
+            if timeout:
+                time.sleep(timeout)
+            return
+        done, _ = wait(self._in_flight.keys(), timeout=timeout, return_when=FIRST_COMPLETED)
+        for fut in done:
+            self._settle(fut, self._in_flight.pop(fut))
 
-            print("-" * 110)
-            print(f"Polling a cada {poll_interval}s | delta_limit={delta_limit}")
+    def progress(self) -> str:
+        c = self.store.counts(self.name)
+        return f"[campaign] {self.name}: {c['sent']} enviados, {c['failed']} falhas, {c['pending']} restantes"
 
-            # 2) Delta
-            delta = get_delta(conversation_id, since_cursor=since_cursor, updated_since=updated_since, limit=delta_limit)
+    def run(self) -> str:
+        # Devolve o estado final: done, paused ou waiting (sem janela futura)
+        self.store.claim(self.name)
+        final = "paused"
+        announced = None
+        last_report = last_check = time.monotonic()
+        try:
+            with ScopedThreadPool(max_workers=self.workers) as pool:
+                try:
+                    while True:
+                        now = time.monotonic()
+                        if now - last_check >= 1.0:
+                            last_check = now
+                            if self.store.state(self.name) == "paused":
+                                print(f"[campaign] {self.name}: pausada por campaign-pause", file=sys.stderr)
+                                break
+                        if self.progress_every and now - last_report >= self.progress_every:
+                            last_report = now
+                            print(self.progress(), file=sys.stderr)
 
-            for it in delta.get("items", []):
-                upsert(local, it)
+                        is_open, change_at = window_state(self.windows, self.now())
+                        if not is_open:
+                            if change_at is None:
+                                final = "waiting"
+                                print(f"[campaign] {self.name}: nenhuma janela de envio futura", file=sys.stderr)
+                                break
+                            if change_at != announced:
+                                announced = change_at
+                                print(f"[campaign] {self.name}: fora da janela, retoma às {change_at.isoformat(timespec='minutes')}", file=sys.stderr)
+                            self._collect(timeout=min(1.0, max((change_at - self.now()).total_seconds(), 0.05)))
+                            continue
 
-            if delta.get("next_since_cursor"):
-                since_cursor = delta["next_since_cursor"]
+                        self._refill()
+                        if not self._heap:
+                            if not self._in_flight:
+                                final = "done"
+                                break
+                            self._collect(timeout=1.0)
+                            continue
 
-            updated_since = delta.get("server_time") or updated_since
+                        due, phone = self._heap[0]
+                        delay = max(due, self._hold_until) - time.monotonic()
+                        if delay > 0:
+                            self._collect(timeout=min(delay, 1.0))
+                            continue
+                        if len(self._in_flight) >= self.workers * 2:
+                            self._collect(timeout=1.0)
+                            continue
 
-            time.sleep(poll_interval)
+                        heapq.heappop(self._heap)
+                        item = self._queues[phone].popleft()
+                        self._in_flight[pool.submit(self._send, item[2])] = item
+                        # Atraso (workers ocupados, gateway lento) não vira rajada depois
+                        self._next_slot[phone] = max(due, time.monotonic()) + self.interval
+                        if self._queues[phone]:
+                            heapq.heappush(self._heap, (self._next_slot[phone], phone))
+                except KeyboardInterrupt:
+                    print(f"\n[campaign] {self.name}: pausando, aguardando envios em voo...", file=sys.stderr)
+                while self._in_flight:
+                    self._collect(timeout=None)
+        finally:
+            self.store.set_state(self.name, final)
+        return final
 
-        except requests.HTTPError as e:
-            print(f"HTTPError: {e}")
-            time.sleep(poll_interval)
-        except requests.RequestException as e:
-            print(f"RequestException: {e}")
-            time.sleep(poll_interval)
+
+def run_campaign(store: CampaignStore, name: str, workers: int, max_attempts: int, progress_every: float = 5.0) -> dict:
+    if workers > POOL_SIZE:
+        configure_transport(workers)
+    runner = CampaignRunner(store, name, workers=workers, max_attempts=max_attempts, progress_every=progress_every)
+    t_start = time.perf_counter()
+    final = runner.run()
+    elapsed = time.perf_counter() - t_start
+    counts = store.counts(name)
+    return {
+        "campaign": name,
+        "state": final,
+        **runner.stats,
+        "remaining": counts["pending"],
+        "total": counts["total"],
+        "elapsed_s": round(elapsed, 3),
+        "throughput_msg_s": round(runner.stats["sent"] / elapsed, 2) if elapsed > 0 else None,
+    }
 
 
 # ----------------------------
-# Gateway: Media
+# Daemon (socket Unix): pool HTTP, caches e rate limiters ficam residentes
 # ----------------------------
-def media_upload(file_path: str, idempotency_key: str | None = None) -> dict:
-    p = Path(file_path)
-    if not p.exists() or not p.is_file():
-        raise FileNotFoundError(f"Arquivo não encontrado: {file_path}")
+# Protocolo: o cliente (gateway_client.py) manda 1 linha JSON {"argv", "cwd", "tty"};
+# o daemon responde com frames: tipo (1 byte: "1" stdout, "2" stderr, "x" exit code)
+# + tamanho (4 bytes big-endian) + payload.
+DAEMON_PATH_ARGS = ("file", "directory", "out", "cache", "batch")
 
-    url = f"{BASE_URL}/gateway/media/upload"
-    headers = dict(HEADERS)
-    if idempotency_key:
-        headers["Idempotency-Key"] = idempotency_key
 
-    with p.open("rb") as f:
-        files = {"file": (p.name, f)}
-        r = requests.post(url, headers=headers, files=files, timeout=120)
-        r.raise_for_status()
-        return r.json()
+# (stdout, stderr) do cliente da conexão. Num ContextVar e não em threading.local: as threads
+# do comando (ScopedThreadPool, drainer da outbox) herdam o contexto e escrevem no mesmo cliente
+_client_streams: contextvars.ContextVar[tuple | None] = contextvars.ContextVar("gateway_client_streams", default=None)
 
 
-def media_download_info(media_asset_id: str) -> dict:
-    return http_get(f"/gateway/media/{media_asset_id}/download")
+class _ClientStream:
+    # sys.stdout/sys.stderr do daemon: cada comando escreve no seu cliente, o resto no terminal do daemon
+    def __init__(self, default, index: int):
+        self._default = default
+        self._index = index
 
+    def _target(self):
+        streams = _client_streams.get()
+        return streams[self._index] if streams else self._default
 
-def media_download_file(media_asset_id: str, out_dir: str = ".") -> Path:
-    info = media_download_info(media_asset_id)
-    download_url = info.get("download_url")
-    if not download_url:
-        raise RuntimeError(f"Resposta sem download_url: {info}")
+    def write(self, s: str) -> int:
+        return self._target().write(s)
 
-    filename = info.get("file_name") or f"{media_asset_id}.bin"
-    out_path = Path(out_dir) / filename
+    def flush(self) -> None:
+        self._target().flush()
 
-    # baixa o binário direto da signed URL
-    r = requests.get(download_url, stream=True, timeout=180)
-    r.raise_for_status()
+    def isatty(self) -> bool:
+        return self._target().isatty()
 
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with out_path.open("wb") as w:
-        for chunk in r.iter_content(chunk_size=1024 * 1024):
-            if chunk:
-                w.write(chunk)
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
 
-    return out_path
+
+class _FrameWriter:
+    def __init__(self, sock: socket.socket, kind: bytes, lock: threading.Lock, closed: threading.Event, tty: bool):
+        self._sock = sock
+        self._kind = kind
+        self._lock = lock
+        self._closed = closed
+        self._tty = tty
+
+    def write(self, s: str) -> int:
+        # Cliente desconectou (Ctrl+C): a próxima escrita interrompe o comando
+        if self._closed.is_set():
+            raise BrokenPipeError("cliente desconectou")
+        data = s.encode("utf-8", errors="replace")
+        if data:
+            with self._lock:
+                self._sock.sendall(self._kind + len(data).to_bytes(4, "big") + data)
+        return len(s)
+
+    def flush(self) -> None:
+        pass
+
+    def isatty(self) -> bool:
+        return self._tty
+
+
+def _run_in_daemon(argv: list[str], cwd: str | None) -> int:
+    try:
+        args = build_parser().parse_args(argv)
+        if args.cmd == "daemon":
+            print("daemon já está rodando neste socket", file=sys.stderr)
+            return 2
+        if getattr(args, "batch", None) == "-":
+            print("--batch - não funciona via daemon (o stdin não é repassado): use um arquivo", file=sys.stderr)
+            return 2
+        process_flags = [flag for name, flag in PROCESS_FLAGS.items() if getattr(args, name) is not None]
+        if args.metrics_file != METRICS_FILE:
+            process_flags.append("--metrics-file")
+        # Métricas do daemon saem pelo exporter único do comando daemon
+        args.metrics_file = None
+        if process_flags:
+            print(
+                f"{', '.join(process_flags)} vale para o daemon inteiro: passe ao subir o daemon "
+                f"(ex: gateway_cli.py {process_flags[0]} ... daemon)",
+                file=sys.stderr,
+            )
+            return 2
+        # Caminhos relativos são do diretório do cliente, não do daemon ("-" = stdout)
+        if cwd:
+            for name in DAEMON_PATH_ARGS:
+                value = getattr(args, name, None)
+                if isinstance(value, str) and value and value != "-" and not os.path.isabs(value):
+                    setattr(args, name, os.path.join(cwd, value))
+        execute(args)
+        return 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except (BrokenPipeError, ConnectionResetError):
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline() or b"{}")
+        except ValueError:
+            return
+        lock = threading.Lock()
+        closed = threading.Event()
+        out = _FrameWriter(self.request, b"1", lock, closed, bool(request.get("tty")))
+        err = _FrameWriter(self.request, b"2", lock, closed, False)
+
+        def watch_disconnect() -> None:
+            # O cliente não manda mais nada depois do request: EOF = desconectou
+            try:
+                self.rfile.read(1)
+            except OSError:
+                pass
+            closed.set()
+
+        threading.Thread(target=watch_disconnect, daemon=True).start()
+
+        def serve() -> int:
+            _client_streams.set((out, err))
+            return _run_in_daemon(list(request.get("argv") or []), request.get("cwd"))
+
+        code = contextvars.copy_context().run(serve)
+        try:
+            payload = str(code).encode()
+            with lock:
+                self.request.sendall(b"x" + len(payload).to_bytes(4, "big") + payload)
+        except OSError:
+            pass
+
+
+def run_daemon(socket_path: str, metrics_file: str | None = None) -> None:
+    if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        raise SystemExit("daemon requer sockets Unix (Linux/macOS)")
+    path = Path(socket_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        # Socket de um daemon anterior: só remove se ninguém está atendendo
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(path))
+        except OSError:
+            path.unlink()
+        else:
+            raise SystemExit(f"já existe um daemon em {path}")
+        finally:
+            probe.close()
+
+    sys.stdout = _ClientStream(sys.stdout, 0)
+    sys.stderr = _ClientStream(sys.stderr, 1)
+    # 0600: quem fala com o socket usa a API key do daemon
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(str(path), _DaemonHandler)
+    finally:
+        os.umask(old_umask)
+    server.daemon_threads = True
+    get_session()
+    # Um exporter para o processo inteiro: METRICS soma os comandos de todos os clientes
+    exporter = MetricsExporter(metrics_file).start() if metrics_file else None
+    print(f"[daemon] escutando em {path} (pid {os.getpid()})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+        if exporter is not None:
+            exporter.stop()
 
 
 # ----------------------------
 # CLI Entrypoint
 # ----------------------------
-def main():
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="CLI para testar /gateway (chat read, send e media) no WhatsApp Gateway"
     )
+    parser.add_argument(
+        "--rate-limit",
+        default=None,
+        help='Limites por família de endpoint, ex: "send=20,delta=10" (sobrepõe GATEWAY_RATE_LIMITS)',
+    )
+    parser.add_argument("--phone-rate", type=float, default=None, help="Envios/s por phone_number_id")
+    parser.add_argument("--compact", action="store_true", help="Saída JSON compacta (1 linha) em vez de indentada")
+    parser.add_argument(
+        "--transport-stats",
+        action="store_true",
+        help="Ao sair, imprime no stderr requests/conexões abertas/reusadas do pool HTTP",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Ao sair, imprime no stderr latência (p50/p95/p99), status, erros e retries por endpoint",
+    )
+    parser.add_argument(
+        "--hedge",
+        default=None,
+        metavar="FAMÍLIAS",
+        help='GETs com hedging, ex: "delta" (2º request se o 1º passar do p95; default GATEWAY_HEDGE)',
+    )
+    parser.add_argument(
+        "--hedge-budget",
+        type=float,
+        default=None,
+        help="Teto de requests extras do hedging, fração dos requests (default GATEWAY_HEDGE_BUDGET ou 0.05)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=METRICS_FILE,
+        help="Arquivo OpenMetrics reescrito a cada GATEWAY_METRICS_INTERVAL s (poll, lotes, daemon) e ao sair",
+    )
     sub = parser.add_subparsers(dest="cmd", required=True)
 
     p_conv = sub.add_parser("conversations", help="Listar conversas do tenant")
@@ -325,100 +4307,422 @@ def main():
     p_conv.add_argument("--phone-number-id", default=None)
 
     p_state = sub.add_parser("conversation-state", help="Consultar estado técnico de uma conversa por external_id")
-    p_state.add_argument("external_id", help="wa_id / telefone do cliente")
+    p_state.add_argument("external_id", nargs="?", help="wa_id / telefone do cliente")
     p_state.add_argument("--phone-number-id", default=None)
+    p_state.add_argument("--batch", default=None, help="Arquivo com um external_id por linha (\"-\" = stdin); saída NDJSON")
+    p_state.add_argument("--workers", type=int, default=16, help="--batch: consultas em paralelo")
+    p_state.add_argument("--max-age", type=float, default=300.0, help="--batch: reaproveita estados consultados há menos de N s (0 = sempre consultar)")
+    p_state.add_argument("--out", default="-", help="--batch: arquivo NDJSON de saída (default stdout)")
+    p_state.add_argument("--cache", default=CACHE_DB, help="--batch: SQLite onde os estados consultados ficam guardados")
+    p_state.add_argument("--no-cache", dest="cache", action="store_const", const=None, help="Não usar cache local")
 
-    p_hist = sub.add_parser("messages", help="Listar histórico de mensagens de uma conversa (1 página)")
-    p_hist.add_argument("conversation_id")
-    p_hist.add_argument("--limit", type=int, default=50)
+    p_hist = sub.add_parser("messages", help="Listar histórico de mensagens de uma conversa (1 página ou --all)")
+    p_hist.add_argument("conversation_id", nargs="?")
+    p_hist.add_argument("--limit", type=int, default=50, help="Itens por página")
     p_hist.add_argument("--cursor", default=None)
+    p_hist.add_argument("--all", action="store_true", help="Seguir os cursores e exportar tudo em NDJSON")
+    p_hist.add_argument("--all-conversations", action="store_true", help="Exportar todas as conversas do tenant (NDJSON)")
+    p_hist.add_argument("--phone-number-id", default=None, help="Filtro para --all-conversations")
+    p_hist.add_argument("--out", default=None, help="Arquivo NDJSON de saída (default stdout)")
 
     p_poll = sub.add_parser("poll", help="Rodar polling/delta para uma conversa")
     p_poll.add_argument("conversation_id")
     p_poll.add_argument("--history", type=int, default=50)
-    p_poll.add_argument("--interval", type=float, default=2.5)
+    p_poll.add_argument("--interval", type=float, default=2.5, help="Intervalo inicial (s)")
+    p_poll.add_argument("--min-interval", type=float, default=1.0, help="Intervalo com a conversa ativa (s)")
+    p_poll.add_argument("--max-interval", type=float, default=30.0, help="Teto do backoff quando ociosa/erro (s)")
     p_poll.add_argument("--delta-limit", type=int, default=200)
     p_poll.add_argument("--render", type=int, default=30)
+    p_poll.add_argument("--keep", type=int, default=1000, help="Mensagens mantidas em memória (as mais antigas ficam só no cache)")
+    p_poll.add_argument("--cache", default=CACHE_DB, help="SQLite com mensagens e watermarks (retoma sem baixar histórico)")
+    p_poll.add_argument("--no-cache", dest="cache", action="store_const", const=None, help="Não usar cache local")
+
+    p_exp = sub.add_parser("export", help="Exportar mensagens do tenant em formato colunar (Parquet/Arrow), incremental")
+    p_exp.add_argument("--out", required=True, help="Diretório do dataset (part-*.parquet + _watermarks.json)")
+    p_exp.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    p_exp.add_argument("--batch-rows", type=int, default=50_000, help="Linhas por row group / record batch")
+    p_exp.add_argument("--page-size", type=int, default=200)
+    p_exp.add_argument("--phone-number-id", default=None)
+    p_exp.add_argument("--full", action="store_true", help="Ignorar watermarks e exportar o histórico completo")
+
+    p_pall = sub.add_parser("poll-all", help="Acompanhar todas as conversas do tenant em um único event loop")
+    p_pall.add_argument("--concurrency", type=int, default=16, help="Máximo de get_delta simultâneos")
+    p_pall.add_argument("--limit", type=int, default=0, help="Máximo de conversas acompanhadas (0 = todas; a descoberta segue os cursores)")
+    p_pall.add_argument("--phone-number-id", default=None)
+    p_pall.add_argument("--delta-limit", type=int, default=200)
+    p_pall.add_argument("--interval", type=float, default=2.5, help="Intervalo inicial por conversa (s)")
+    p_pall.add_argument("--min-interval", type=float, default=1.0)
+    p_pall.add_argument("--max-interval", type=float, default=60.0)
+    p_pall.add_argument("--discover-every", type=float, default=60.0, help="Redescobrir conversas a cada N segundos")
+    p_pall.add_argument("--cache", default=CACHE_DB, help="SQLite com mensagens e watermarks por conversa")
+    p_pall.add_argument("--no-cache", dest="cache", action="store_const", const=None, help="Não usar cache local")
+
+    p_sub = sub.add_parser("subscribe", help="Acompanhar conversas por push (SSE), com fallback automático para o delta")
+    p_sub.add_argument("conversation_ids", nargs="+")
+    p_sub.add_argument("--delta-limit", type=int, default=200)
+    p_sub.add_argument("--interval", type=float, default=2.5, help="Fallback: intervalo inicial do delta (s)")
+    p_sub.add_argument("--min-interval", type=float, default=1.0)
+    p_sub.add_argument("--max-interval", type=float, default=30.0)
+    p_sub.add_argument("--retry-push-every", type=float, default=60.0, help="Fallback: tentar o push de novo a cada N s")
+    p_sub.add_argument("--keep", type=int, default=1000, help="Mensagens mantidas em memória por conversa")
+    p_sub.add_argument("--cache", default=CACHE_DB, help="SQLite com mensagens e watermarks por conversa")
+    p_sub.add_argument("--no-cache", dest="cache", action="store_const", const=None, help="Não usar cache local")
 
     p_up = sub.add_parser("media-upload", help="Upload de mídia (multipart) e retorna media_asset_id")
     p_up.add_argument("file")
     p_up.add_argument("--idem", help="Idempotency-Key", default=None)
+    p_up.add_argument("--chunked", action="store_true", help="Upload resumível em chunks (retoma após queda)")
+    p_up.add_argument("--chunk-size", type=int, default=UPLOAD_CHUNK_SIZE // 1048576, help="Tamanho do chunk em MiB")
+    p_up.add_argument("--no-dedup", action="store_true", help="Ignorar o cache por conteúdo e sempre transferir")
+
+    p_updir = sub.add_parser("media-upload-dir", help="Upload concorrente de todos os arquivos de um diretório")
+    p_updir.add_argument("directory")
+    p_updir.add_argument("--pattern", default="*", help="Glob dos arquivos (default *)")
+    p_updir.add_argument("--recursive", action="store_true")
+    p_updir.add_argument("--workers", type=int, default=4)
+    p_updir.add_argument("--chunked", action="store_true")
+    p_updir.add_argument("--chunk-size", type=int, default=UPLOAD_CHUNK_SIZE // 1048576, help="Tamanho do chunk em MiB")
+    p_updir.add_argument("--no-dedup", action="store_true", help="Ignorar o cache por conteúdo e sempre transferir")
+
+    sub.add_parser("media-cache-prune", help="Remover do cache de dedup os assets expirados")
 
     p_info = sub.add_parser("media-info", help="Obter JSON de download (download_url etc.)")
     p_info.add_argument("media_asset_id")
 
     p_dl = sub.add_parser("media-download", help="Baixar o binário via signed URL retornada pelo gateway")
-    p_dl.add_argument("media_asset_id")
+    p_dl.add_argument("media_asset_id", nargs="+")
     p_dl.add_argument("--out", default=".", help="Diretório de saída")
+    p_dl.add_argument("--parallel", type=int, default=1, help="Quantos media_asset_id baixar ao mesmo tempo")
+    p_dl.add_argument("--connections", type=int, default=4, help="Conexões com Range por arquivo grande (>= 16 MiB); menores baixam em 1 stream, que também retoma do .part se o servidor aceita Range")
 
     p_send = sub.add_parser("send-media", help="Enviar mensagem com mídia via /gateway/send")
     p_send.add_argument("--to", required=True, help="Destinatário (wa_id/telefone), ex: 5511999999999")
-    p_send.add_argument("--media-asset-id", required=True)
+    p_send_src = p_send.add_mutually_exclusive_group(required=True)
+    p_send_src.add_argument("--media-asset-id")
+    p_send_src.add_argument("--file", help="Arquivo local: reaproveita o media_asset_id do cache ou faz upload")
     p_send.add_argument("--type", required=True, choices=["audio", "document"])
     p_send.add_argument("--message-id", default=None)
     p_send.add_argument("--caption", default=None)
     p_send.add_argument("--phone-number-id", default=None)
+    p_send.add_argument("--outbox", action="store_true", help="Só enfileira na outbox (entregue por outbox-drain); sem --message-id, o id vem do conteúdo")
 
     p_send_text = sub.add_parser("send-text", help="Enviar mensagem de texto via /gateway/send")
     p_send_text.add_argument("--to", required=True)
     p_send_text.add_argument("--text", required=True)
     p_send_text.add_argument("--message-id", default=None)
     p_send_text.add_argument("--phone-number-id", default=None)
+    p_send_text.add_argument("--outbox", action="store_true", help="Só enfileira na outbox (entregue por outbox-drain); sem --message-id, o id vem do conteúdo")
 
     p_send_tpl = sub.add_parser("send-template", help="Enviar template via /gateway/send")
     p_send_tpl.add_argument("--to", required=True)
     p_send_tpl.add_argument("--name", required=True, help="Nome do template")
     p_send_tpl.add_argument("--lang", default="pt_BR", help="Idioma do template (default pt_BR)")
+    p_send_tpl.add_argument("--param", action="append", default=None, help="Variável do corpo ({{1}}, {{2}}...), na ordem; repetível")
     p_send_tpl.add_argument("--message-id", default=None)
     p_send_tpl.add_argument("--phone-number-id", default=None)
+    p_send_tpl.add_argument("--outbox", action="store_true", help="Só enfileira na outbox (entregue por outbox-drain); sem --message-id, o id vem do conteúdo")
+
+    p_bulk = sub.add_parser("send-bulk", help="Enviar mensagens em lote (JSONL ou CSV) com workers concorrentes")
+    p_bulk.add_argument("file", help=f"Arquivo .jsonl ou .csv com campos: {', '.join(BULK_FIELDS)}")
+    p_bulk.add_argument("--out", default="bulk_results.jsonl", help="Arquivo JSONL com o resultado de cada linha")
+    p_bulk.add_argument("--workers", type=int, default=8)
+    p_bulk.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Máximo de envios/s por phone_number_id neste lote (default 10 se o processo não tem --phone-rate/GATEWAY_PHONE_RATE; 0 = sem teto próprio)",
+    )
+    p_bulk.add_argument("--phone-number-id", default=None, help="phone_number_id padrão para linhas sem esse campo")
+    p_bulk_ids = p_bulk.add_mutually_exclusive_group()
+    p_bulk_ids.add_argument(
+        "--run-id",
+        default=None,
+        help="Execução do lote: message_id = conteúdo + run id. Repetir o mesmo --run-id retoma sem reenviar "
+        "(default: um novo a cada execução, mostrado no resumo)",
+    )
+    p_bulk_ids.add_argument(
+        "--once",
+        action="store_true",
+        help="message_id só pelo conteúdo: uma linha já enviada em qualquer execução anterior não sai de novo",
+    )
+
+    p_ccreate = sub.add_parser("campaign-create", help="Criar (ou atualizar) uma campanha de template a partir de JSONL/CSV")
+    p_ccreate.add_argument("name")
+    p_ccreate.add_argument("file", help="Destinatários: to, params (JSONL) ou param1..paramN (CSV), phone_number_id, lang, template")
+    p_ccreate.add_argument("--template", required=True, help="Template padrão")
+    p_ccreate.add_argument("--lang", default="pt_BR")
+    p_ccreate.add_argument("--rate", type=float, default=1.0, help="Envios/s por phone_number_id, espaçados uniformemente")
+    p_ccreate.add_argument("--window", action="append", default=None, help='Janela de envio, ex: "mon-fri 09:00-18:00" (repetível; default sempre)')
+    p_ccreate.add_argument("--tz", default=None, help="Fuso das janelas, ex: America/Sao_Paulo (default fuso local)")
+    p_ccreate.add_argument("--phone-number-id", default=None, help="phone_number_id padrão para linhas sem esse campo")
+    p_ccreate.add_argument(
+        "--replace",
+        action="store_true",
+        help="Trocar os destinatários de uma campanha existente (quem já recebeu a mesma mensagem não recebe de novo)",
+    )
+
+    p_crun = sub.add_parser("campaign-run", help="Enviar (ou retomar) uma campanha respeitando ritmo e janelas")
+    p_crun.add_argument("name")
+    p_crun.add_argument("--workers", type=int, default=4, help="Envios em voo ao mesmo tempo")
+    p_crun.add_argument("--max-attempts", type=int, default=5)
+    p_crun.add_argument("--retry-failed", action="store_true", help="Devolve as falhas para a fila antes de rodar")
+
+    p_cpause = sub.add_parser("campaign-pause", help="Pausar uma campanha em andamento (retoma com campaign-run)")
+    p_cpause.add_argument("name")
+
+    p_cstat = sub.add_parser("campaign-status", help="Contadores de campanhas (enviados, falhas, restantes)")
+    p_cstat.add_argument("name", nargs="?")
+    p_cstat.add_argument("--watch", type=float, default=None, metavar="S", help="Reimprime a cada S segundos")
+
+    p_oenq = sub.add_parser("outbox-enqueue", help="Enfileirar envios de um arquivo (JSONL ou CSV) na outbox")
+    p_oenq.add_argument("file", help=f"Arquivo .jsonl ou .csv com campos: {', '.join(BULK_FIELDS)}")
+    p_oenq.add_argument("--phone-number-id", default=None, help="phone_number_id padrão para linhas sem esse campo")
+
+    p_odrain = sub.add_parser("outbox-drain", help="Entregar a outbox com workers concorrentes, retries e ack")
+    p_odrain.add_argument("--workers", type=int, default=8)
+    p_odrain.add_argument("--follow", action="store_true", help="Continua rodando e entrega o que for enfileirado depois")
+    p_odrain.add_argument("--lease", type=float, default=120.0, help="Segundos até um envio em voo ser reentregue")
+    p_odrain.add_argument("--max-attempts", type=int, default=8)
+    p_odrain.add_argument("--rate", type=float, default=None, help="Máximo de envios/s por phone_number_id neste comando")
+
+    p_ostat = sub.add_parser("outbox-status", help="Contagem da outbox por estado")
+    p_ostat.add_argument("--failed", type=int, default=10, help="Quantas falhas recentes listar")
+    p_ostat.add_argument("--requeue-failed", action="store_true", help="Volta as falhas para pending")
+    p_ostat.add_argument("--purge-sent-days", type=float, default=None, help="Apaga enviados mais antigos que N dias")
+
+    p_daemon = sub.add_parser("daemon", help="Servir comandos por socket Unix (cliente: gateway_client.py)")
+    p_daemon.add_argument("--socket", default=DAEMON_SOCKET)
+
+    return parser
+
+
+# Flags globais que configuram o processo (limiter, hedger; e --metrics-file, tratado à parte):
+# no daemon valem para todos os clientes, então só são aceitas no próprio comando daemon
+PROCESS_FLAGS = {"rate_limit": "--rate-limit", "phone_rate": "--phone-rate", "hedge": "--hedge", "hedge_budget": "--hedge-budget"}
+
+
+def configure_process(args: argparse.Namespace) -> None:
+    if args.rate_limit or args.phone_rate is not None:
+        RATE_LIMITER.configure(parse_rate_limits(args.rate_limit), phone_rate=args.phone_rate)
+    if args.hedge is not None or args.hedge_budget is not None:
+        HEDGER.configure(args.hedge, args.hedge_budget)
 
-    args = parser.parse_args()
 
+def main(argv: list[str] | None = None) -> None:
+    args = build_parser().parse_args(argv)
+    configure_process(args)
+    if args.cmd == "daemon":
+        run_daemon(args.socket, metrics_file=args.metrics_file)
+        return
+    execute(args)
+
+
+def execute(args: argparse.Namespace) -> None:
+    # Escopo do comando: --compact, --stats/--transport-stats e tetos próprios (--rate) não
+    # vazam para outros comandos do daemon
+    scope = CommandScope(compact=args.compact)
+    token = _scope.set(scope)
+    # Processo avulso: o exporter vive o tempo do comando. No daemon, metrics_file chega None
+    # (_run_in_daemon) e quem exporta é o exporter do próprio daemon (run_daemon)
+    exporter = MetricsExporter(args.metrics_file).start() if args.metrics_file else None
+
+    try:
+        run_command(args)
+    finally:
+        _scope.reset(token)
+        if exporter is not None:
+            exporter.stop()
+        if args.transport_stats:
+            print_transport_stats(scope)
+        if args.stats:
+            print_stats(scope)
+
+
+def run_command(args: argparse.Namespace) -> None:
     if args.cmd == "conversations":
         data = list_conversations(limit=args.limit, phone_number_id=args.phone_number_id)
-        print(json.dumps(data, indent=2, ensure_ascii=False))
+        print_json(data)
         return
 
     if args.cmd == "conversation-state":
+        if args.batch:
+            summary = run_state_batch(
+                args.batch,
+                out_path=args.out,
+                workers=args.workers,
+                phone_number_id=args.phone_number_id,
+                cache=open_cache(args.cache),
+                max_age=args.max_age,
+            )
+            print(json_dumps(summary), file=sys.stderr)
+            return
+        if not args.external_id:
+            raise SystemExit("informe external_id ou --batch")
         data = get_conversation_state(args.external_id, phone_number_id=args.phone_number_id)
-        print(json.dumps(data, indent=2, ensure_ascii=False))
+        print_json(data)
         return
 
     if args.cmd == "messages":
+        if args.all or args.all_conversations:
+            if args.all_conversations:
+                conversation_ids = (
+                    cid
+                    for cid in map(_conversation_id, iter_conversations(phone_number_id=args.phone_number_id))
+                    if cid
+                )
+            elif args.conversation_id:
+                conversation_ids = [args.conversation_id]
+            else:
+                raise SystemExit("ERRO: informe conversation_id ou --all-conversations")
+            out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+            try:
+                n = export_messages_ndjson(
+                    out,
+                    conversation_ids,
+                    page_size=max(args.limit, 1),
+                    cursor=None if args.all_conversations else args.cursor,
+                )
+            finally:
+                if args.out:
+                    out.close()
+            print(f"[export] {n} mensagens", file=sys.stderr)
+            return
+        if not args.conversation_id:
+            raise SystemExit("ERRO: informe conversation_id")
         data = list_messages(args.conversation_id, limit=args.limit, cursor=args.cursor)
-        print(json.dumps(data, indent=2, ensure_ascii=False))
+        print_json(data)
         return
 
     if args.cmd == "poll":
         print(args.conversation_id)
-        run_poll(args.conversation_id, args.history, args.interval, args.delta_limit, args.render)
+        run_poll(
+            args.conversation_id,
+            args.history,
+            args.interval,
+            args.delta_limit,
+            args.render,
+            min_interval=args.min_interval,
+            max_interval=args.max_interval,
+            cache=open_cache(args.cache),
+            keep=args.keep,
+        )
+        return
+
+    if args.cmd == "export":
+        summary = run_columnar_export(
+            args.out,
+            fmt=args.format,
+            batch_rows=args.batch_rows,
+            page_size=args.page_size,
+            phone_number_id=args.phone_number_id,
+            full=args.full,
+        )
+        print_json(summary)
+        return
+
+    if args.cmd == "poll-all":
+        asyncio.run(
+            run_poll_all(
+                concurrency=args.concurrency,
+                conversations_limit=args.limit,
+                phone_number_id=args.phone_number_id,
+                delta_limit=args.delta_limit,
+                poll_interval=args.interval,
+                min_interval=args.min_interval,
+                max_interval=args.max_interval,
+                discover_every=args.discover_every,
+                cache=open_cache(args.cache),
+            )
+        )
+        return
+
+    if args.cmd == "subscribe":
+        Subscriber(
+            args.conversation_ids,
+            delta_limit=args.delta_limit,
+            poll_interval=args.interval,
+            min_interval=args.min_interval,
+            max_interval=args.max_interval,
+            retry_push_every=args.retry_push_every,
+            cache=open_cache(args.cache),
+            keep=args.keep,
+        ).run()
         return
 
     if args.cmd == "media-upload":
-        resp = media_upload(args.file, idempotency_key=args.idem)
-        print(json.dumps(resp, indent=2, ensure_ascii=False))
+        resp = media_upload_dedup(
+            args.file,
+            None if args.no_dedup else open_cache(CACHE_DB),
+            idempotency_key=args.idem,
+            chunked=args.chunked,
+            chunk_size=args.chunk_size * 1048576,
+        )
+        print_json(resp)
+        return
+
+    if args.cmd == "media-cache-prune":
+        expired, gone = open_cache(CACHE_DB).evict_media()
+        print(f"OK: {expired} assets expirados e {gone} hashes de arquivos inexistentes removidos")
+        return
+
+    if args.cmd == "media-upload-dir":
+        ok = failed = 0
+        for res in media_upload_dir(
+            args.directory,
+            pattern=args.pattern,
+            recursive=args.recursive,
+            workers=args.workers,
+            chunked=args.chunked,
+            chunk_size=args.chunk_size * 1048576,
+            cache=None if args.no_dedup else open_cache(CACHE_DB),
+        ):
+            ok += res["ok"]
+            failed += not res["ok"]
+            print(json_dumps(res), flush=True)
+        print(f"[upload-dir] {ok} ok, {failed} falhas", file=sys.stderr)
         return
 
     if args.cmd == "media-info":
         resp = media_download_info(args.media_asset_id)
-        print(json.dumps(resp, indent=2, ensure_ascii=False))
+        print_json(resp)
         return
 
     if args.cmd == "media-download":
-        out = media_download_file(args.media_asset_id, out_dir=args.out)
-        print(f"OK: baixado em {out}")
+        failed = 0
+        for media_asset_id, out, err in media_download_many(
+            args.media_asset_id, out_dir=args.out, parallel=args.parallel, connections=args.connections
+        ):
+            if err:
+                failed += 1
+                print(f"ERRO: {media_asset_id}: {err}")
+            else:
+                print(f"OK: baixado em {out}")
+        if failed:
+            sys.exit(1)
+        return
+
+    if args.cmd in ("send-media", "send-text", "send-template") and args.outbox:
+        if args.cmd == "send-media" and args.file:
+            args.media_asset_id = media_upload_dedup(args.file, open_cache(CACHE_DB))["media_asset_id"]
+        t0 = time.perf_counter()
+        message_id = open_outbox().enqueue(outbox_row_from_args(args))
+        elapsed_ms = round((time.perf_counter() - t0) * 1000, 3)
+        print_json({"queued": True, "message_id": message_id, "enqueue_ms": elapsed_ms})
         return
 
     if args.cmd == "send-media":
+        media_asset_id = args.media_asset_id
+        if args.file:
+            media_asset_id = media_upload_dedup(args.file, open_cache(CACHE_DB))["media_asset_id"]
         resp = send_media(
             to=args.to,
-            media_asset_id=args.media_asset_id,
+            media_asset_id=media_asset_id,
             msg_type=args.type,
             message_id=args.message_id,
             caption=args.caption,
             phone_number_id=args.phone_number_id,
         )
-        print(json.dumps(resp, indent=2, ensure_ascii=False))
+        print_json(resp)
         return
 
     if args.cmd == "send-text":
@@ -428,7 +4732,7 @@ def main():
             message_id=args.message_id,
             phone_number_id=args.phone_number_id,
         )
-        print(json.dumps(resp, indent=2, ensure_ascii=False))
+        print_json(resp)
         return
 
     if args.cmd == "send-template":
@@ -438,8 +4742,124 @@ def main():
             language=args.lang,
             message_id=args.message_id,
             phone_number_id=args.phone_number_id,
+            components=template_components({"params": args.param}),
+        )
+        print_json(resp)
+        return
+
+    if args.cmd == "send-bulk":
+        summary = run_send_bulk(
+            args.file,
+            out_path=args.out,
+            workers=args.workers,
+            rate=args.rate,
+            phone_number_id=args.phone_number_id,
+            run_id=None if args.once else args.run_id or new_message_id("run"),
+        )
+        print_json(summary)
+        return
+
+    if args.cmd == "campaign-create":
+        try:
+            for w in args.window or []:
+                SendWindow.parse(w)
+            if args.tz:
+                ZoneInfo(args.tz)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        except KeyError:
+            raise SystemExit(f"fuso desconhecido: {args.tz}")
+        if args.rate <= 0:
+            raise SystemExit("--rate deve ser > 0")
+        config = {
+            "template": args.template,
+            "lang": args.lang,
+            "rate": args.rate,
+            "windows": args.window or [],
+            "tz": args.tz,
+            "source": os.path.abspath(args.file),
+        }
+        store = open_campaigns()
+        try:
+            rows = load_campaign_rows(args.file, args.name, args.phone_number_id)
+            added = store.create(args.name, config, rows, replace=args.replace)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        print_json({"campaign": args.name, "added": added, **store.counts(args.name)})
+        return
+
+    if args.cmd == "campaign-run":
+        store = open_campaigns()
+        try:
+            if args.retry_failed:
+                print(f"[campaign] {store.retry_failed(args.name)} falhas devolvidas para a fila", file=sys.stderr)
+            summary = run_campaign(store, args.name, workers=args.workers, max_attempts=args.max_attempts)
+        except KeyError:
+            raise SystemExit(f"campanha não encontrada: {args.name}")
+        except RuntimeError as e:
+            raise SystemExit(str(e))
+        print_json(summary)
+        return
+
+    if args.cmd == "campaign-pause":
+        store = open_campaigns()
+        if store.state(args.name) is None:
+            raise SystemExit(f"campanha não encontrada: {args.name}")
+        store.set_state(args.name, "paused")
+        print_json({"campaign": args.name, "state": "paused"})
+        return
+
+    if args.cmd == "campaign-status":
+        store = open_campaigns()
+        if not args.watch:
+            print_json(store.status(args.name))
+            return
+        try:
+            while True:
+                for r in store.status(args.name):
+                    print(f"{r['name']:<24} {r['state']:<8} enviados={r['sent']} falhas={r['failed']} restantes={r['pending']} total={r['total']}")
+                time.sleep(args.watch)
+        except KeyboardInterrupt:
+            return
+
+    if args.cmd == "outbox-enqueue":
+        # Mesmo id por conteúdo do send-bulk, com prefixo próprio: reenfileirar o arquivo é
+        # idempotente, mas um send-bulk do mesmo arquivo não faz a outbox descartar os envios
+        rows = []
+        seen_ids: dict[str, int] = {}
+        try:
+            for row in read_bulk_rows(args.file):
+                if args.phone_number_id and not row.get("phone_number_id"):
+                    row["phone_number_id"] = args.phone_number_id
+                if not row.get("message_id"):
+                    row["message_id"] = bulk_message_id(row, seen_ids, prefix="outbox")
+                rows.append(row)
+        except ValueError as e:
+            raise SystemExit(f"nada enfileirado: {e}")
+        t0 = time.perf_counter()
+        ids = open_outbox().enqueue_many(rows)
+        elapsed = time.perf_counter() - t0
+        print_json(
+            {"enqueued": len(ids), "elapsed_ms": round(elapsed * 1000, 2), "us_per_row": round(elapsed * 1e6 / max(len(ids), 1), 1)}
         )
-        print(json.dumps(resp, indent=2, ensure_ascii=False))
+        return
+
+    if args.cmd == "outbox-drain":
+        if args.rate is not None:
+            limit_command_sends(args.rate)
+        summary = run_outbox_drain(open_outbox(), args.workers, args.follow, args.lease, args.max_attempts)
+        print_json(summary)
+        return
+
+    if args.cmd == "outbox-status":
+        outbox = open_outbox()
+        result = {}
+        if args.requeue_failed:
+            result["requeued"] = outbox.requeue_failed()
+        if args.purge_sent_days is not None:
+            result["purged"] = outbox.purge_sent(args.purge_sent_days * 86400)
+        result.update(outbox.status(failed_limit=args.failed))
+        print_json(result)
         return
 
 
@@ -0,0 +1,66 @@
+"""
+Cliente fino do daemon do gateway_cli: repassa argv pelo socket Unix e devolve
+stdout, stderr e exit code. Não importa requests nem lê .env, então cada chamada
+custa só o interpretador + 1 conexão local.
+
+Sem daemon rodando, executa gateway_cli.py direto (mesmo resultado, sem o ganho).
+
+Uso:
+    python gateway_cli.py daemon &
+    python gateway_client.py conversations --limit 5
+
+Variáveis de ambiente:
+- GATEWAY_DAEMON_SOCKET (opcional, default ~/.gateway_cli/daemon.sock)
+
+O daemon usa o próprio ambiente (API key, base URL, limites): variáveis GATEWAY_* do
+cliente não são repassadas. Flags que configuram o processo inteiro (--rate-limit,
+--phone-rate, --hedge, --hedge-budget, --metrics-file) são recusadas aqui: passe-as ao
+subir o daemon.
+--stats e --transport-stats mostram só o comando do cliente.
+"""
+
+import os
+import sys
+import json
+import socket
+
+SOCKET = os.getenv("GATEWAY_DAEMON_SOCKET") or os.path.join(os.path.expanduser("~"), ".gateway_cli", "daemon.sock")
+
+
+def main(argv: list[str]) -> int:
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(SOCKET)
+    except (OSError, AttributeError):
+        cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gateway_cli.py")
+        os.execv(sys.executable, [sys.executable, cli, *argv])
+
+    request = {"argv": argv, "cwd": os.getcwd(), "tty": sys.stdout.isatty()}
+    sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+    rfile = sock.makefile("rb")
+    streams = {b"1": sys.stdout.buffer, b"2": sys.stderr.buffer}
+    while True:
+        head = rfile.read(5)
+        if len(head) < 5:
+            print("gateway_client: daemon encerrou a conexão", file=sys.stderr)
+            return 1
+        kind, size = head[:1], int.from_bytes(head[1:], "big")
+        data = rfile.read(size)
+        if kind == b"x":
+            return int(data)
+        stream = streams.get(kind)
+        if stream is not None:
+            stream.write(data)
+            stream.flush()
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        # Saída canalizada para head/grep que já fechou
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
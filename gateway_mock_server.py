@@ -0,0 +1,632 @@
+"""
+Gateway WhatsApp de mentira (stand-in local) para testar e medir o gateway_cli.py offline.
+
+Implementa os endpoints /gateway/* que o CLI usa:
+- POST /gateway/send (idempotente por message_id)
+- GET  /gateway/conversations, /gateway/conversations/{external_id}
+- GET  /gateway/conversations/{id}/messages e /messages/delta
+- POST /gateway/media/upload (multipart) e o upload resumível /gateway/media/uploads/*
+- GET  /gateway/media/{id}/download + /files/{id} (com suporte a Range)
+- GET  /gateway/events (Server-Sent Events, retoma por Last-Event-ID)
+
+Listas de conversas, estado de conversa e download info mandam ETag e respondem 304 a If-None-Match.
+GET /_stats devolve contadores por rota (inclusive bytes de corpo enviados).
+
+Latência, erros e volume de dados são configuráveis.
+
+Uso:
+    python gateway_mock_server.py --port 8000 --latency-ms 40 --jitter-ms 20 --error-rate 0.01
+    GATEWAY_BASE_URL=http://127.0.0.1:8000 WHATSAPP_GATEWAY_API_KEY=teste python gateway_cli.py conversations
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import deque
+from itertools import islice
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+@dataclass
+class MockConfig:
+    conversations: int = 50
+    messages_per_conversation: int = 200
+    inbound_rate: float = 2.0        # mensagens novas/s (somando todas as conversas)
+    hot_fraction: float = 0.1        # fração de conversas que recebe 80% do tráfego
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    slow_rate: float = 0.0           # probabilidade de uma resposta lenta (cauda)
+    slow_ms: float = 0.0
+    error_rate: float = 0.0          # probabilidade de 503
+    send_rate: float = 0.0           # capacidade de /gateway/send em msg/s (0 = ilimitado)
+    media_size: int = 4 * 1024 * 1024
+    push: bool = True                # False = /gateway/events responde 404 (testa o fallback do subscribe)
+    event_log: int = 10_000          # eventos guardados para replay por Last-Event-ID
+    seed: int = 42
+
+
+def iso(dt: datetime) -> str:
+    return dt.isoformat()
+
+
+def now_utc() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class GatewayState:
+    """
+    Estado em memória: conversas, mensagens (ordenadas por created_at, id), envios
+    idempotentes, sessões de upload e assets de mídia. Um lock protege tudo.
+    """
+    def __init__(self, cfg: MockConfig):
+        self.cfg = cfg
+        self.lock = threading.RLock()  # _send_json conta status sob o mesmo lock (respostas de erro saem de dentro dele)
+        self.events_changed = threading.Condition(self.lock)
+        self.events: deque[tuple[int, str, dict]] = deque(maxlen=cfg.event_log)
+        self.event_seq = 0
+        self.rng = random.Random(cfg.seed)
+        self.conversations: dict[str, dict] = {}
+        self.by_external: dict[str, str] = {}
+        self.messages: dict[str, list[dict]] = {}
+        self.sent: dict[str, dict] = {}
+        self.uploads: dict[str, dict] = {}
+        self.assets: dict[str, dict] = {}
+        self.counters: dict[str, int] = {}
+        self._seq = 0
+        self._send_tokens = max(cfg.send_rate, 1.0)
+        self._send_updated = time.monotonic()
+        self._populate()
+
+    def _next_id(self, prefix: str) -> str:
+        self._seq += 1
+        return f"{prefix}{self._seq:09d}"
+
+    def publish(self, cid: str, msg: dict) -> None:
+        # Chamado com o lock em mãos, a cada mensagem nova ou alterada
+        self.event_seq += 1
+        self.events.append((self.event_seq, cid, dict(msg)))
+        self.events_changed.notify_all()
+
+    def count(self, key: str) -> None:
+        self.counters[key] = self.counters.get(key, 0) + 1
+
+    def _populate(self) -> None:
+        start = now_utc() - timedelta(days=1)
+        for c in range(self.cfg.conversations):
+            cid = f"conv-{c:05d}"
+            external_id = f"55119{c:08d}"
+            self.conversations[cid] = {
+                "id": cid,
+                "external_id": external_id,
+                "phone_number_id": "pn-1",
+                "status": "open",
+                "created_at": iso(start),
+            }
+            self.by_external[external_id] = cid
+            msgs = []
+            for i in range(self.cfg.messages_per_conversation):
+                created = start + timedelta(seconds=i * 30 + c)
+                msgs.append(self._make_message(cid, "inbound" if i % 2 else "outbound", f"mensagem {i}", created))
+            self.messages[cid] = msgs
+
+    def _make_message(self, cid: str, direction: str, text: str, created: datetime | None = None) -> dict:
+        created = created or now_utc()
+        return {
+            "id": self._next_id("msg-"),
+            "conversation_id": cid,
+            "direction": direction,
+            "message_type": "text",
+            "status": "received" if direction == "inbound" else "sent",
+            "created_at": iso(created),
+            "updated_at": iso(created),
+            "content": {"text": text},
+            "provider_message_id": None,
+            "metadata": {"source": "mock"},
+        }
+
+    def _hot_conversation(self) -> str:
+        ids = list(self.conversations)
+        hot = max(1, int(len(ids) * self.cfg.hot_fraction))
+        if self.rng.random() < 0.8:
+            return ids[self.rng.randrange(hot)]
+        return ids[self.rng.randrange(len(ids))]
+
+    def tick_inbound(self) -> None:
+        # Chamado pela thread geradora: 1 mensagem nova e, às vezes, atualização de status
+        with self.lock:
+            if not self.conversations:
+                return
+            cid = self._hot_conversation()
+            msg = self._make_message(cid, "inbound", f"inbound {self._seq}")
+            self.messages[cid].append(msg)
+            self.publish(cid, msg)
+            outbound = [m for m in self.messages[cid][-10:] if m["direction"] == "outbound" and m["status"] == "sent"]
+            if outbound and self.rng.random() < 0.5:
+                m = outbound[0]
+                m["status"] = "delivered"
+                m["updated_at"] = iso(now_utc())
+                self.publish(cid, m)
+
+    def allow_send(self) -> bool:
+        if not self.cfg.send_rate:
+            return True
+        now = time.monotonic()
+        cap = max(self.cfg.send_rate / 10, 1.0)
+        self._send_tokens = min(cap, self._send_tokens + (now - self._send_updated) * self.cfg.send_rate)
+        self._send_updated = now
+        if self._send_tokens >= 1:
+            self._send_tokens -= 1
+            return True
+        return False
+
+
+def _key(m: dict) -> tuple[str, str]:
+    return (m["created_at"], m["id"])
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers e corpo saem em writes separados: sem isso, +40ms de delayed ACK
+    state: GatewayState  # definido em make_server
+
+    def log_message(self, fmt, *args):  # silencioso
+        pass
+
+    # ---------- infra ----------
+    def _send_json(self, code: int, obj=None, headers: dict | None = None, etag: bool = False) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8") if obj is not None else b""
+        if etag and code == 200:
+            tag = '"' + hashlib.md5(body).hexdigest() + '"'
+            headers = {**(headers or {}), "ETag": tag, "Cache-Control": "no-cache"}
+            if tag in (self.headers.get("If-None-Match") or ""):
+                code, body = 304, b""
+        with self.state.lock:
+            self.state.count(f"status {code}")
+            self.state.counters["body_bytes_out"] = self.state.counters.get("body_bytes_out", 0) + len(body)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def _inject(self) -> bool:
+        # Latência (+ cauda lenta) e erros configurados; True = já respondeu com erro
+        cfg = self.state.cfg
+        delay = cfg.latency_ms + random.uniform(0, cfg.jitter_ms)
+        if cfg.slow_rate and random.random() < cfg.slow_rate:
+            delay += cfg.slow_ms
+        if delay:
+            time.sleep(delay / 1000)
+        if cfg.error_rate and random.random() < cfg.error_rate:
+            self._send_json(503, {"detail": "erro injetado"}, {"Retry-After": "1"})
+            return True
+        return False
+
+    def _authorized(self) -> bool:
+        if self.headers.get("X-API-Key"):
+            return True
+        self._send_json(401, {"detail": "X-API-Key ausente"})
+        return False
+
+    # ---------- roteamento ----------
+    def do_GET(self):
+        u = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        with self.state.lock:
+            self.state.count("GET " + re.sub(r"/[^/]*\d[^/]*", "/{id}", u.path))
+
+        if u.path.startswith("/files/"):
+            return self._file(u.path[len("/files/"):])
+        if u.path == "/_stats":
+            with self.state.lock:
+                counters = dict(self.state.counters)
+            return self._send_json(200, counters)
+        if not self._authorized() or self._inject():
+            return
+
+        if u.path == "/gateway/events":
+            return self._events(parse_qs(u.query).get("conversation_id") or [])
+        if u.path == "/gateway/conversations":
+            return self._list_conversations(q)
+        m = re.fullmatch(r"/gateway/conversations/([^/]+)/messages/delta", u.path)
+        if m:
+            return self._delta(m.group(1), q)
+        m = re.fullmatch(r"/gateway/conversations/([^/]+)/messages", u.path)
+        if m:
+            return self._list_messages(m.group(1), q)
+        m = re.fullmatch(r"/gateway/conversations/([^/]+)", u.path)
+        if m:
+            return self._conversation_state(m.group(1))
+        m = re.fullmatch(r"/gateway/media/uploads/([^/]+)", u.path)
+        if m:
+            return self._upload_status(m.group(1))
+        m = re.fullmatch(r"/gateway/media/([^/]+)/download", u.path)
+        if m:
+            return self._download_info(m.group(1))
+        return self._send_json(404, {"detail": "not found"})
+
+    def do_POST(self):
+        u = urlparse(self.path)
+        with self.state.lock:
+            self.state.count("POST " + re.sub(r"/[^/]*\d[^/]*", "/{id}", u.path))
+        body = self._read_body()
+        if not self._authorized() or self._inject():
+            return
+        if u.path == "/gateway/send":
+            return self._send_message(body)
+        if u.path == "/gateway/media/upload":
+            return self._media_upload(body)
+        if u.path == "/gateway/media/uploads":
+            return self._upload_create(body)
+        m = re.fullmatch(r"/gateway/media/uploads/([^/]+)/complete", u.path)
+        if m:
+            return self._upload_complete(m.group(1))
+        return self._send_json(404, {"detail": "not found"})
+
+    def do_PUT(self):
+        u = urlparse(self.path)
+        body = self._read_body()
+        if not self._authorized() or self._inject():
+            return
+        m = re.fullmatch(r"/gateway/media/uploads/([^/]+)", u.path)
+        if m:
+            return self._upload_chunk(m.group(1), body)
+        return self._send_json(404, {"detail": "not found"})
+
+    # ---------- conversas / mensagens ----------
+    def _list_conversations(self, q: dict) -> None:
+        limit = int(q.get("limit", 20))
+        offset = int(q.get("cursor") or 0)
+        with self.state.lock:
+            items = list(self.state.conversations.values())
+            page = items[offset:offset + limit]
+        nxt = str(offset + limit) if offset + limit < len(items) else None
+        self._send_json(200, {"items": page, "next_cursor": nxt}, etag=True)
+
+    def _conversation_state(self, external_id: str) -> None:
+        with self.state.lock:
+            cid = self.state.by_external.get(external_id)
+            if not cid:
+                return self._send_json(404, {"detail": "conversa não encontrada"})
+            msgs = self.state.messages[cid]
+            last_in = next((m for m in reversed(msgs) if m["direction"] == "inbound"), None)
+        last_in_at = last_in["created_at"] if last_in else None
+        window_open = bool(last_in_at) and (
+            now_utc() - datetime.fromisoformat(last_in_at) < timedelta(hours=24)
+        )
+        self._send_json(
+            200,
+            {
+                "external_id": external_id,
+                "conversation_id": cid,
+                "status": "open",
+                "last_inbound_at": last_in_at,
+                "window_open": window_open,
+            },
+            etag=True,
+        )
+
+    def _list_messages(self, cid: str, q: dict) -> None:
+        # Página mais recente primeiro; itens dentro da página em ordem cronológica.
+        # cursor = índice (exclusivo) do fim da página seguinte, indo para o passado.
+        limit = int(q.get("limit", 50))
+        with self.state.lock:
+            msgs = self.state.messages.get(cid)
+            if msgs is None:
+                return self._send_json(404, {"detail": "conversa não encontrada"})
+            end = int(q["cursor"]) if q.get("cursor") else len(msgs)
+            start = max(0, end - limit)
+            page = [dict(m) for m in msgs[start:end]]
+        self._send_json(200, {"items": page, "next_cursor": str(start) if start > 0 else None})
+
+    def _delta(self, cid: str, q: dict) -> None:
+        limit = int(q.get("limit", 200))
+        since = tuple(q["since_cursor"].split("|", 1)) if q.get("since_cursor") else None
+        updated_since = q.get("updated_since")
+        server_time = iso(now_utc())
+        with self.state.lock:
+            msgs = self.state.messages.get(cid)
+            if msgs is None:
+                return self._send_json(404, {"detail": "conversa não encontrada"})
+            new = [m for m in msgs if since is None or _key(m) > since][:limit]
+            seen = {m["id"] for m in new}
+            updated = []
+            if updated_since:
+                updated = [
+                    m for m in msgs
+                    if m["id"] not in seen and (m.get("updated_at") or "") > updated_since
+                ][: max(0, limit - len(new))]
+            items = [dict(m) for m in new + updated]
+        nxt = f"{new[-1]['created_at']}|{new[-1]['id']}" if new else q.get("since_cursor")
+        self._send_json(200, {"items": items, "next_since_cursor": nxt, "server_time": server_time})
+
+    def _send_message(self, body: bytes) -> None:
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return self._send_json(400, {"detail": "JSON inválido"})
+        if not payload.get("to") or not payload.get("type"):
+            return self._send_json(422, {"detail": "to e type são obrigatórios"})
+        with self.state.lock:
+            if not self.state.allow_send():
+                self.state.count("send 429")
+                return self._send_json(429, {"detail": "limite de envio"}, {"Retry-After": "1"})
+            message_id = payload.get("message_id")
+            if message_id and message_id in self.state.sent:
+                self.state.count("send duplicate")
+                return self._send_json(200, {**self.state.sent[message_id], "duplicate": True})
+            cid = self.state.by_external.get(payload["to"])
+            if cid is None:
+                cid = f"conv-x{len(self.state.conversations):05d}"
+                self.state.conversations[cid] = {
+                    "id": cid,
+                    "external_id": payload["to"],
+                    "phone_number_id": payload.get("phone_number_id") or "pn-1",
+                    "status": "open",
+                    "created_at": iso(now_utc()),
+                }
+                self.state.by_external[payload["to"]] = cid
+                self.state.messages[cid] = []
+            text = payload.get("text") or json.dumps(payload.get("template") or payload.get("media_asset_id"))
+            msg = self.state._make_message(cid, "outbound", text)
+            msg["message_type"] = payload["type"]
+            self.state.messages[cid].append(msg)
+            self.state.publish(cid, msg)
+            result = {"id": msg["id"], "message_id": message_id, "conversation_id": cid, "status": "queued"}
+            if message_id:
+                self.state.sent[message_id] = result
+        self._send_json(200, result)
+
+    # ---------- push (SSE) ----------
+    def _events(self, conversation_ids: list[str]) -> None:
+        if not self.state.cfg.push:
+            return self._send_json(404, {"detail": "push desabilitado"})
+        wanted = set(conversation_ids) or None
+        last = self.headers.get("Last-Event-ID")
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        st = self.state
+        with st.lock:
+            pos = st.event_seq
+            reset = False
+            if last and last.isdigit():
+                oldest = st.events[0][0] if st.events else st.event_seq + 1
+                if int(last) + 1 < oldest or int(last) > st.event_seq:
+                    reset = True  # fora da janela de replay (ou servidor reiniciado): o cliente recupera pelo delta
+                else:
+                    pos = int(last)
+        try:
+            self._chunk(b"retry: 1000\n\n")
+            if reset:
+                self._chunk(f"event: reset\nid: {pos}\ndata: {{}}\n\n".encode())
+            while True:
+                with st.events_changed:
+                    st.events_changed.wait_for(lambda: st.event_seq > pos, timeout=15)
+                    start = len(st.events) - (st.event_seq - pos)
+                    batch = list(islice(st.events, max(start, 0), None))
+                if not batch:
+                    self._chunk(b": ping\n\n")
+                    continue
+                out = []
+                for seq, cid, msg in batch:
+                    pos = seq
+                    if wanted is None or cid in wanted:
+                        data = json.dumps({"conversation_id": cid, "item": msg}, ensure_ascii=False)
+                        out.append(f"event: message\nid: {seq}\ndata: {data}\n\n")
+                if out:
+                    self._chunk("".join(out).encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    # ---------- mídia ----------
+    def _register_asset(self, data: bytes, file_name: str) -> dict:
+        digest = hashlib.sha256(data).hexdigest()
+        asset_id = "ma-" + digest[:16]
+        expires = now_utc() + timedelta(days=30)
+        self.state.assets[asset_id] = {"data": data, "file_name": file_name}
+        return {
+            "media_asset_id": asset_id,
+            "file_name": file_name,
+            "size": len(data),
+            "sha256": digest,
+            "expires_at": iso(expires),
+        }
+
+    def _media_upload(self, body: bytes) -> None:
+        # Multipart mínimo: extrai o primeiro arquivo do corpo
+        ctype = self.headers.get("Content-Type", "")
+        m = re.search(r"boundary=(.+)", ctype)
+        if not m:
+            return self._send_json(400, {"detail": "multipart esperado"})
+        boundary = m.group(1).strip('"').encode()
+        file_name, data = "upload.bin", b""
+        for part in body.split(b"--" + boundary):
+            head, _, content = part.partition(b"\r\n\r\n")
+            fm = re.search(rb'filename="([^"]*)"', head)
+            if fm:
+                file_name = fm.group(1).decode("utf-8", "replace")
+                data = content[:-2] if content.endswith(b"\r\n") else content
+                break
+        with self.state.lock:
+            resp = self._register_asset(data, file_name)
+        self._send_json(200, resp)
+
+    def _upload_create(self, body: bytes) -> None:
+        meta = json.loads(body or b"{}")
+        key = self.headers.get("Idempotency-Key") or hashlib.sha1(body).hexdigest()
+        with self.state.lock:
+            up = self.state.uploads.get(key)
+            if up is None:
+                up = {"upload_id": "up-" + hashlib.sha1(key.encode()).hexdigest()[:16], "data": bytearray(), "meta": meta}
+                self.state.uploads[key] = up
+                self.state.uploads[up["upload_id"]] = up
+        self._send_json(200, {"upload_id": up["upload_id"], "offset": len(up["data"])})
+
+    def _upload_status(self, upload_id: str) -> None:
+        with self.state.lock:
+            up = self.state.uploads.get(upload_id)
+        if up is None:
+            return self._send_json(404, {"detail": "upload não encontrado"})
+        self._send_json(200, {"upload_id": upload_id, "offset": len(up["data"]), "size": up["meta"].get("size")})
+
+    def _upload_chunk(self, upload_id: str, body: bytes) -> None:
+        m = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", self.headers.get("Content-Range", ""))
+        with self.state.lock:
+            up = self.state.uploads.get(upload_id)
+            if up is None or not m:
+                return self._send_json(400, {"detail": "upload ou Content-Range inválido"})
+            start = int(m.group(1))
+            if start == len(up["data"]):
+                up["data"].extend(body)
+            elif start > len(up["data"]):
+                return self._send_json(409, {"detail": "offset à frente", "offset": len(up["data"])})
+            offset = len(up["data"])
+        self._send_json(200, {"upload_id": upload_id, "offset": offset})
+
+    def _upload_complete(self, upload_id: str) -> None:
+        with self.state.lock:
+            up = self.state.uploads.get(upload_id)
+            if up is None:
+                return self._send_json(404, {"detail": "upload não encontrado"})
+            resp = self._register_asset(bytes(up["data"]), up["meta"].get("file_name") or "upload.bin")
+        self._send_json(200, resp)
+
+    def _download_info(self, asset_id: str) -> None:
+        with self.state.lock:
+            asset = self.state.assets.get(asset_id)
+        host = self.headers.get("Host") or f"127.0.0.1:{self.server.server_port}"
+        self._send_json(
+            200,
+            {
+                "media_asset_id": asset_id,
+                "file_name": (asset or {}).get("file_name") or f"{asset_id}.bin",
+                "download_url": f"http://{host}/files/{asset_id}",
+            },
+            etag=True,
+        )
+
+    def _file(self, asset_id: str) -> None:
+        # "Signed URL": sem X-API-Key, com Range. Assets desconhecidos viram bytes determinísticos.
+        if self._inject():
+            return
+        with self.state.lock:
+            asset = self.state.assets.get(asset_id)
+            if asset is None:
+                rnd = random.Random(asset_id)
+                asset = {"data": rnd.randbytes(self.state.cfg.media_size), "file_name": f"{asset_id}.bin"}
+                self.state.assets[asset_id] = asset
+        data = asset["data"]
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        rng = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if rng:
+            start = int(rng.group(1))
+            end = int(rng.group(2)) if rng.group(2) else len(data) - 1
+            end = min(end, len(data) - 1)
+            part = data[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            part = data
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(part)))
+        self.end_headers()
+        self.wfile.write(part)
+
+
+class MockServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Cliente que desistiu (timeout, hedge cancelado) não é erro do mock
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def make_server(cfg: MockConfig, host: str = "127.0.0.1", port: int = 8000) -> ThreadingHTTPServer:
+    state = GatewayState(cfg)
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = MockServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    return server
+
+
+def start_in_thread(cfg: MockConfig, host: str = "127.0.0.1", port: int = 0) -> tuple[ThreadingHTTPServer, str]:
+    # Sobe o servidor (e o gerador de inbound) em threads daemon; devolve a base URL
+    server = make_server(cfg, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if cfg.inbound_rate > 0:
+        def generate():
+            while True:
+                time.sleep(1.0 / cfg.inbound_rate)
+                server.state.tick_inbound()
+        threading.Thread(target=generate, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in local do WhatsApp Gateway (/gateway/*)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=200, help="Mensagens iniciais por conversa")
+    parser.add_argument("--inbound-rate", type=float, default=2.0, help="Mensagens novas/s (0 = estático)")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Probabilidade de resposta lenta (cauda)")
+    parser.add_argument("--slow-ms", type=float, default=0.0, help="Atraso extra das respostas lentas")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilidade de 503")
+    parser.add_argument("--send-rate", type=float, default=0.0, help="Capacidade de /gateway/send (msg/s, 0 = ilimitado)")
+    parser.add_argument("--media-size", type=int, default=4 * 1024 * 1024, help="Bytes dos assets gerados")
+    parser.add_argument("--no-push", dest="push", action="store_false", help="Desabilita /gateway/events (SSE)")
+    args = parser.parse_args()
+
+    cfg = MockConfig(
+        conversations=args.conversations,
+        messages_per_conversation=args.messages,
+        inbound_rate=args.inbound_rate,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms,
+        error_rate=args.error_rate,
+        send_rate=args.send_rate,
+        media_size=args.media_size,
+        push=args.push,
+    )
+    server, url = start_in_thread(cfg, args.host, args.port)
+    print(f"Mock gateway em {url} ({cfg.conversations} conversas). Ctrl+C para sair.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print("\nSaindo.")
+
+
+if __name__ == "__main__":
+    main()
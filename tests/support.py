@@ -0,0 +1,84 @@
+"""
+Infra dos testes do gateway_cli: um gateway_mock_server por processo (porta livre, sem
+inbound automático) e o gateway_cli importado já apontando para ele, com outbox, cache e
+campanhas num diretório temporário.
+
+Rodar da raiz do repositório (só stdlib + requests):
+    python -m unittest discover -s tests
+"""
+
+import io
+import os
+import sys
+import atexit
+import shutil
+import contextvars
+import tempfile
+import unittest
+import contextlib
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import gateway_mock_server as mock
+
+SERVER, BASE_URL = mock.start_in_thread(
+    mock.MockConfig(conversations=20, messages_per_conversation=30, inbound_rate=0)
+)
+TMP_DIR = tempfile.mkdtemp(prefix="gateway-tests-")
+atexit.register(shutil.rmtree, TMP_DIR, ignore_errors=True)
+
+os.environ.update(
+    {
+        "GATEWAY_BASE_URL": BASE_URL,
+        "WHATSAPP_GATEWAY_API_KEY": "teste",
+        "GATEWAY_CACHE_DB": os.path.join(TMP_DIR, "cache.db"),
+        "GATEWAY_OUTBOX_DB": os.path.join(TMP_DIR, "outbox.db"),
+        "GATEWAY_CAMPAIGN_DB": os.path.join(TMP_DIR, "campaigns.db"),
+        # Cada teste mede o próprio comportamento: sem breaker/timeout adaptativo herdado de outro teste
+        "GATEWAY_BREAKER_FAILURES": "0",
+        "GATEWAY_TIMEOUT_FACTOR": "0",
+        "GATEWAY_RATE_RETRIES": "2",
+    }
+)
+for name in ("GATEWAY_PHONE_RATE", "GATEWAY_RATE_LIMITS", "GATEWAY_HEDGE", "GATEWAY_METRICS_FILE"):
+    os.environ.pop(name, None)
+
+# O import imprime URL e chave (banner do CLI): não polui a saída dos testes
+with contextlib.redirect_stdout(io.StringIO()):
+    import gateway_cli as gw
+
+
+def reset_mock() -> None:
+    # Mock sem erros/limites injetados e RATE_LIMITER sem o AIMD aprendido em outro teste
+    cfg = SERVER.state.cfg
+    cfg.error_rate = 0.0
+    cfg.send_rate = 0.0
+    cfg.push = True
+    cfg.latency_ms = 0.0
+    with SERVER.state.lock:
+        SERVER.state.counters.clear()
+    gw.RATE_LIMITER.configure()
+
+
+def run_command(fn, *args, **kwargs):
+    # Como o execute(): o comando roda com o próprio CommandScope e não o deixa no teste seguinte
+    def call():
+        gw._scope.set(gw.CommandScope())
+        return fn(*args, **kwargs)
+    return contextvars.copy_context().run(call)
+
+
+class MockGatewayTestCase(unittest.TestCase):
+    def setUp(self):
+        reset_mock()
+        self.tmp = Path(tempfile.mkdtemp(dir=TMP_DIR))
+
+    def tearDown(self):
+        reset_mock()
+
+    def counter(self, key: str) -> int:
+        with SERVER.state.lock:
+            return SERVER.state.counters.get(key, 0)
@@ -0,0 +1,153 @@
+import io
+import json
+import time
+import unittest
+import contextlib
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import requests
+
+from support import SERVER, MockGatewayTestCase, gw
+
+SEND = "POST /gateway/send"
+
+
+class SendWindowTest(unittest.TestCase):
+    def test_parse(self):
+        w = gw.SendWindow.parse("seg-sex 08:00-20:00")
+        self.assertEqual((w.days, w.start.hour, w.end.hour), (frozenset(range(5)), 8, 20))
+        self.assertEqual(gw.SendWindow.parse("fri-mon 10:00-12:00").days, frozenset({4, 5, 6, 0}))
+        self.assertEqual(gw.SendWindow.parse("09:00-18:00").days, frozenset(range(7)))
+        for bad in ("mon-fri", "xyz 09:00-10:00", "mon tue 09:00-10:00", "09h-18h"):
+            with self.assertRaises(ValueError):
+                gw.SendWindow.parse(bad)
+
+    def test_window_state(self):
+        tz = timezone(timedelta(hours=-3))
+        weekdays = [gw.SendWindow.parse("mon-fri 09:00-18:00")]
+        saturday = datetime(2025, 3, 1, 10, 0, tzinfo=tz)
+        self.assertEqual(gw.window_state(weekdays, saturday), (False, datetime(2025, 3, 3, 9, 0, tzinfo=tz)))
+        monday = datetime(2025, 3, 3, 17, 59, tzinfo=tz)
+        self.assertEqual(gw.window_state(weekdays, monday), (True, datetime(2025, 3, 3, 18, 0, tzinfo=tz)))
+
+        # Cruza a meia-noite: aberta às 23h até as 6h do dia seguinte
+        night = [gw.SendWindow.parse("22:00-06:00")]
+        self.assertEqual(gw.window_state(night, datetime(2025, 3, 3, 23, 0, tzinfo=tz)), (True, datetime(2025, 3, 4, 6, 0, tzinfo=tz)))
+        self.assertEqual(gw.window_state(night, datetime(2025, 3, 4, 3, 0, tzinfo=tz)), (True, datetime(2025, 3, 4, 6, 0, tzinfo=tz)))
+        self.assertEqual(gw.window_state([], saturday), (True, None))
+
+
+class CampaignRunTest(MockGatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = gw.CampaignStore(str(self.tmp / "campaigns.db"))
+        self.addCleanup(self.store.conn.close)
+
+    def create(self, name: str, rows: list[dict], **config) -> None:
+        source = self.tmp / f"{name}.jsonl"
+        source.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+        config = {"template": "promo", "lang": "pt_BR", "rate": 20.0, "windows": [], "tz": None, **config}
+        self.store.create(name, config, gw.load_campaign_rows(str(source), name, None))
+
+    def test_paced_per_phone_number_and_resumable(self):
+        rows = [{"to": f"55119555{i:05d}", "params": [f"cliente {i}"], "phone_number_id": f"pn-{i % 2}"} for i in range(8)]
+        self.create("ritmo", rows)
+        t0 = time.perf_counter()
+        summary = gw.run_campaign(self.store, "ritmo", workers=4, max_attempts=3, progress_every=0)
+        elapsed = time.perf_counter() - t0
+        self.assertEqual((summary["state"], summary["sent"], summary["remaining"]), ("done", 8, 0))
+        self.assertEqual(self.counter(SEND), 8)
+        # 4 envios por número a 20/s: o último sai 3 intervalos depois do primeiro; os dois números intercalam
+        self.assertGreaterEqual(elapsed, 3 / 20)
+        self.assertLess(elapsed, 8 / 20)
+        with SERVER.state.lock:
+            sent = [m for msgs in SERVER.state.messages.values() for m in msgs if "cliente 3" in m["content"]["text"]]
+        self.assertEqual(len(sent), 1)
+        self.assertIn('"promo"', sent[0]["content"]["text"])
+
+        again = gw.run_campaign(self.store, "ritmo", workers=4, max_attempts=3, progress_every=0)
+        self.assertEqual((again["state"], again["sent"]), ("done", 0))
+        self.assertEqual(self.counter(SEND), 8)
+
+    def test_waits_for_the_window_to_open(self):
+        self.create("janela", [{"to": "5511955500001"}, {"to": "5511955500002"}], windows=["mon 09:00-10:00"])
+        opens = datetime(2025, 3, 3, 9, 0).astimezone()
+        t0 = time.monotonic()
+        clock = lambda self: opens - timedelta(seconds=0.3) + timedelta(seconds=time.monotonic() - t0)  # noqa: E731
+
+        err = io.StringIO()
+        with mock.patch.object(gw.CampaignRunner, "now", clock), contextlib.redirect_stderr(err):
+            summary = gw.run_campaign(self.store, "janela", workers=2, max_attempts=3, progress_every=0)
+        self.assertEqual((summary["state"], summary["sent"]), ("done", 2))
+        self.assertGreaterEqual(summary["elapsed_s"], 0.25)
+        self.assertIn("fora da janela, retoma às", err.getvalue())
+
+    def test_transient_errors_retry_and_permanent_ones_fail(self):
+        self.create("falhas", [{"to": "5511955500003"}, {"to": "5511955500004"}])
+        real = gw.CampaignRunner._send
+        calls: dict[str, int] = {}
+
+        def flaky(runner, row):
+            calls[row["to"]] = calls.get(row["to"], 0) + 1
+            if row["to"].endswith("3") and calls[row["to"]] == 1:
+                raise requests.ConnectionError("conexão caiu")
+            if row["to"].endswith("4"):
+                resp = requests.Response()
+                resp.status_code = 400
+                raise requests.HTTPError("template rejeitado", response=resp)
+            return real(runner, row)
+
+        with mock.patch.object(gw.CampaignRunner, "_send", flaky):
+            summary = gw.run_campaign(self.store, "falhas", workers=1, max_attempts=5, progress_every=0)
+        self.assertEqual((summary["sent"], summary["retried"], summary["failed"]), (1, 1, 1))
+        self.assertEqual(calls, {"5511955500003": 2, "5511955500004": 1})
+        self.assertEqual(self.counter(SEND), 1)
+
+        self.assertEqual(self.store.retry_failed("falhas"), 1)
+        self.assertEqual(self.store.counts("falhas")["pending"], 1)
+
+
+class CampaignCreateCliTest(MockGatewayTestCase):
+    def cli(self, *argv) -> dict:
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            gw.execute(gw.build_parser().parse_args(["--compact", *argv]))
+        return json.loads(out.getvalue())
+
+    def write(self, name: str, phones: list[str]) -> str:
+        path = self.tmp / name
+        path.write_text("".join(json.dumps({"to": p, "params": ["Ana"]}) + "\n" for p in phones), encoding="utf-8")
+        return str(path)
+
+    def test_replace_guard(self):
+        name = f"guarda-{id(self)}"
+        first = self.write("a.jsonl", ["5511955510001", "5511955510002"])
+        self.assertEqual(self.cli("campaign-create", name, first, "--template", "promo")["added"], 2)
+        # Mesma lista: só atualiza a config
+        self.assertEqual(self.cli("campaign-create", name, first, "--template", "promo", "--rate", "5")["added"], 0)
+        self.assertEqual(gw.open_campaigns().config(name)["rate"], 5.0)
+
+        other = self.write("b.jsonl", ["5511955510002", "5511955510003"])
+        with self.assertRaises(SystemExit) as ctx:
+            self.cli("campaign-create", name, other, "--template", "promo")
+        self.assertIn("--replace", str(ctx.exception.code))
+        self.assertEqual(gw.open_campaigns().counts(name)["total"], 2)
+
+        gw.open_campaigns().set_state(name, "running")
+        with self.assertRaises(SystemExit) as ctx:
+            self.cli("campaign-create", name, other, "--template", "promo", "--replace")
+        self.assertIn("campaign-pause", str(ctx.exception.code))
+        gw.open_campaigns().set_state(name, "paused")
+
+        self.assertEqual(self.cli("campaign-create", name, other, "--template", "promo", "--replace")["total"], 2)
+        recipients = {r["to"] for _, _, r in gw.open_campaigns().pending(name, 0, 10)}
+        self.assertEqual(recipients, {"5511955510002", "5511955510003"})
+
+    def test_invalid_window_and_rate(self):
+        source = self.write("c.jsonl", ["5511955510004"])
+        with self.assertRaises(SystemExit) as ctx:
+            self.cli("campaign-create", f"inv-{id(self)}", source, "--template", "promo", "--window", "seg-sex 9h")
+        self.assertIn("janela inválida", str(ctx.exception.code))
+        with self.assertRaises(SystemExit):
+            self.cli("campaign-create", f"inv-{id(self)}", source, "--template", "promo", "--rate", "0")
@@ -0,0 +1,129 @@
+import io
+import time
+import threading
+import contextlib
+from unittest import mock
+
+import requests
+
+from support import SERVER, MockGatewayTestCase, gw
+
+DELTA = "GET /gateway/conversations/{id}/messages/delta"
+
+
+class CircuitBreakerTest(MockGatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.breaker = gw.CircuitBreaker("delta", failure_threshold=3, cooldown=0.2, timeout_factor=0)
+        registry = gw.BreakerRegistry()
+        registry._breakers["delta"] = self.breaker
+        # Sem retentativa nem pausa por Retry-After: cada chamada é 1 request e o teste não espera 1s por 503
+        for patcher in (
+            mock.patch.object(gw, "BREAKERS", registry),
+            mock.patch.object(gw.RATE_LIMITER, "observe", return_value=None),
+            contextlib.redirect_stderr(io.StringIO()),
+        ):
+            patcher.__enter__()
+            self.addCleanup(patcher.__exit__, None, None, None)
+
+    def delta(self):
+        return gw.get_delta("conv-00001", None, None, limit=5)
+
+    def fail(self, n: int) -> None:
+        SERVER.state.cfg.error_rate = 1.0
+        for _ in range(n):
+            with self.assertRaises(requests.HTTPError):
+                self.delta()
+        SERVER.state.cfg.error_rate = 0.0
+
+    def test_opens_after_consecutive_failures_and_closes_on_probe(self):
+        self.fail(3)
+        self.assertEqual(self.breaker.state, "open")
+        with self.assertRaises(gw.CircuitOpen) as ctx:
+            self.delta()
+        self.assertLessEqual(ctx.exception.retry_in, 0.2)
+        self.assertEqual(gw.retry_hint(ctx.exception), ctx.exception.retry_in)
+        # Rejeitado sem sair do processo
+        self.assertEqual(self.counter(DELTA), 3)
+
+        time.sleep(0.25)
+        self.delta()
+        self.assertEqual((self.breaker.state, self.breaker.failures), ("closed", 0))
+        self.assertEqual(self.breaker.stats, {"opened": 1, "rejected": 1})
+        self.assertEqual(self.counter(DELTA), 4)
+
+    def test_success_resets_the_count(self):
+        self.fail(2)
+        self.delta()
+        self.fail(2)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_client_errors_do_not_count(self):
+        self.breaker.failure_threshold = 1
+        with self.assertRaises(requests.HTTPError):
+            gw.get_delta("conv-inexistente", None, None, limit=5)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_failed_probe_doubles_the_cooldown(self):
+        self.fail(3)
+        time.sleep(0.25)
+        self.fail(1)
+        self.assertEqual((self.breaker.state, self.breaker.cooldown), ("open", 0.4))
+        with self.assertRaises(gw.CircuitOpen):
+            self.delta()
+        time.sleep(0.45)
+        self.delta()
+        self.assertEqual((self.breaker.state, self.breaker.cooldown), ("closed", 0.2))
+
+    def test_half_open_lets_a_single_probe_through(self):
+        self.fail(3)
+        time.sleep(0.25)
+        SERVER.state.cfg.latency_ms = 200
+        outcomes: list[str] = []
+
+        def call():
+            try:
+                self.delta()
+                outcomes.append("ok")
+            except gw.CircuitOpen:
+                outcomes.append("rejeitado")
+
+        threads = [threading.Thread(target=gw.contextvars.copy_context().run, args=(call,)) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(outcomes), ["ok", "rejeitado", "rejeitado", "rejeitado"])
+        self.assertEqual(self.counter(DELTA), 4)
+
+    def test_disabled_with_zero_threshold(self):
+        self.breaker.failure_threshold = 0
+        self.fail(5)
+        self.assertEqual(self.breaker.state, "closed")
+        self.delta()
+
+
+class AdaptiveTimeoutTest(MockGatewayTestCase):
+    def test_timeout_follows_observed_latency(self):
+        breaker = gw.CircuitBreaker("delta", failure_threshold=0, timeout_factor=3.0, min_timeout=0.1)
+        registry = gw.BreakerRegistry()
+        registry._breakers["delta"] = breaker
+        # Sem a retentativa do urllib3: mede o timeout de uma tentativa só
+        with mock.patch.object(gw, "BREAKERS", registry), mock.patch.object(gw, "_session", gw.build_session(get_retries=0)):
+            for _ in range(19):
+                gw.get_delta("conv-00002", None, None, limit=5)
+            self.assertEqual(breaker.timeout(30), 30)  # poucas amostras: vale o timeout pedido
+            gw.get_delta("conv-00002", None, None, limit=5)
+            self.assertEqual(breaker.timeout(30), 0.1)
+
+            # Gateway travado: falha em ~min_timeout em vez de esperar os 30s do chamador
+            SERVER.state.cfg.latency_ms = 600
+            t0 = time.perf_counter()
+            with self.assertRaises(requests.RequestException):
+                gw.get_delta("conv-00002", None, None, limit=5)
+            self.assertLess(time.perf_counter() - t0, 0.5)
+
+    def test_media_keeps_the_fixed_timeout(self):
+        registry = gw.BreakerRegistry()
+        self.assertEqual(registry.get("media").timeout_factor, 0.0)
+        self.assertEqual(registry.get("media").timeout(120), 120)
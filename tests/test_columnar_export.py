@@ -0,0 +1,53 @@
+import json
+import unittest
+
+from support import SERVER, MockGatewayTestCase, gw
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+
+@unittest.skipUnless(pa is not None, "exportação colunar requer pyarrow")
+class ColumnarExportTest(MockGatewayTestCase):
+    def total_messages(self) -> int:
+        with SERVER.state.lock:
+            return sum(len(msgs) for msgs in SERVER.state.messages.values())
+
+    def test_full_then_incremental_parquet(self):
+        out = self.tmp / "dataset"
+        first = gw.run_columnar_export(str(out), batch_rows=100, page_size=50)
+        table = pq.read_table(first["file"])
+        self.assertEqual(first["rows"], self.total_messages())
+        self.assertEqual(table.num_rows, first["rows"])
+        self.assertEqual(table.schema.field("created_at").type, pa.timestamp("us", tz="UTC"))
+        # batch_rows limita a memória: cada lote vira um row group
+        self.assertGreater(pq.ParquetFile(first["file"]).num_row_groups, 1)
+        watermarks = json.loads((out / "_watermarks.json").read_text(encoding="utf-8"))
+        self.assertEqual(len(watermarks), first["conversations"])
+
+        # Sem mensagens novas: nenhum arquivo, watermarks intactos
+        idle = gw.run_columnar_export(str(out), page_size=50)
+        self.assertEqual((idle["rows"], idle["file"]), (0, None))
+        self.assertEqual(len(list(out.glob("part-*.parquet"))), 1)
+
+        with SERVER.state.lock:
+            external_id = SERVER.state.conversations["conv-00002"]["external_id"]
+        sent = gw.send_text(external_id, "nova depois do export")
+        delta = gw.run_columnar_export(str(out), page_size=50)
+        rows = pq.read_table(delta["file"]).to_pylist()
+        self.assertEqual([(r["id"], r["conversation_id"], r["text"]) for r in rows],
+                         [(sent["id"], "conv-00002", "nova depois do export")])
+        self.assertEqual(len(list(out.glob("part-*.parquet"))), 2)
+
+    def test_arrow_ipc_and_full_rewrite(self):
+        out = self.tmp / "arrow"
+        gw.run_columnar_export(str(out), fmt="arrow", page_size=50)
+        again = gw.run_columnar_export(str(out), fmt="arrow", page_size=50, full=True)
+        with pa.memory_map(again["file"]) as source:
+            table = pa.ipc.open_file(source).read_all()
+        self.assertEqual(table.num_rows, self.total_messages())
+        self.assertEqual(len(set(table.column("id").to_pylist())), table.num_rows)
+        self.assertEqual(list(out.glob(".part-*")), [])
@@ -0,0 +1,129 @@
+import io
+import os
+import json
+import sys
+import time
+import socket
+import subprocess
+import tempfile
+import contextlib
+from pathlib import Path
+
+from support import ROOT, TMP_DIR, MockGatewayTestCase, gw, run_command
+
+
+class DaemonTest(MockGatewayTestCase):
+    """Daemon de verdade (subprocesso) contra o mock; o cliente é o gateway_client.py."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = Path(tempfile.mkdtemp(dir=TMP_DIR))
+        cls.socket = str(cls.dir / "daemon.sock")
+        cls.env = {**os.environ, "GATEWAY_DAEMON_SOCKET": cls.socket, "GATEWAY_OUTBOX_DB": str(cls.dir / "outbox.db")}
+        cls.daemon = subprocess.Popen(
+            [sys.executable, str(ROOT / "gateway_cli.py"), "daemon"],
+            env=cls.env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        deadline = time.monotonic() + 15
+        while not os.path.exists(cls.socket):
+            if cls.daemon.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"daemon não subiu: {cls.daemon.communicate()[1]}")
+            time.sleep(0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.daemon.terminate()
+        cls.daemon_out, cls.daemon_err = cls.daemon.communicate(timeout=10)
+
+    def client(self, *argv: str, cwd: str | None = None) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, str(ROOT / "gateway_client.py"), *argv],
+            env=self.env,
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+
+    def test_worker_thread_output_reaches_the_client(self):
+        # Linha em voo de um drainer que morreu: quem avisa que ela voltou é a thread do drainer
+        outbox = gw.Outbox(self.env["GATEWAY_OUTBOX_DB"])
+        self.addCleanup(outbox.close)
+        outbox.enqueue({"type": "text", "to": "5511966660001", "text": "órfã", "message_id": f"dm-{self.id()}"})
+        outbox.claim(10, lease_s=3600)
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        with outbox.conn:
+            outbox.conn.execute("UPDATE outbox SET lease_owner = ?", (f"{socket.gethostname()}:{dead.pid}",))
+
+        result = self.client("--compact", "outbox-drain")
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("voltaram para a fila", result.stderr)
+        self.assertEqual(json.loads(result.stdout)["sent"], 1)
+
+    def test_frames_and_exit_code(self):
+        # Protocolo cru: 1 linha JSON de request; frames kind(1) + tamanho(4) + dados; "x" fecha com o exit code
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket)
+            sock.sendall(json.dumps({"argv": ["--compact", "conversations", "--limit", "3"], "tty": False}).encode() + b"\n")
+            rfile = sock.makefile("rb")
+            frames: dict[bytes, bytes] = {}
+            while True:
+                head = rfile.read(5)
+                kind, data = head[:1], rfile.read(int.from_bytes(head[1:], "big"))
+                frames[kind] = frames.get(kind, b"") + data
+                if kind == b"x":
+                    break
+        self.assertEqual(frames[b"x"], b"0")
+        self.assertEqual(len(json.loads(frames[b"1"])["items"]), 3)
+
+    def test_process_flags_are_rejected(self):
+        for argv in (["--phone-rate", "1", "conversations"], ["--hedge", "delta", "conversations"], ["daemon"]):
+            result = self.client(*argv)
+            self.assertEqual(result.returncode, 2, argv)
+            self.assertEqual(result.stdout, "")
+        self.assertIn("--phone-rate vale para o daemon inteiro", self.client("--phone-rate", "1", "conversations").stderr)
+        self.assertEqual(self.counter("GET /gateway/conversations"), 0)
+
+    def test_command_errors_keep_their_exit_code(self):
+        result = self.client("messages")
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("informe conversation_id", result.stderr)
+
+    def test_relative_paths_are_from_the_client_cwd(self):
+        cwd = Path(tempfile.mkdtemp(dir=TMP_DIR))
+        result = self.client("messages", "conv-00001", "--all", "--out", "historico.ndjson", cwd=str(cwd))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(len((cwd / "historico.ndjson").read_text(encoding="utf-8").splitlines()), 30)
+
+    def test_concurrent_clients_get_their_own_output(self):
+        procs = {
+            cid: subprocess.Popen(
+                [sys.executable, str(ROOT / "gateway_client.py"), "--compact", "messages", cid, "--limit", "5"],
+                env=self.env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            for cid in (f"conv-0000{i}" for i in range(5))
+        }
+        for cid, proc in procs.items():
+            out, err = proc.communicate(timeout=30)
+            self.assertEqual(proc.returncode, 0, err)
+            self.assertEqual({m["conversation_id"] for m in json.loads(out)["items"]}, {cid})
+
+
+class CompactOutputTest(MockGatewayTestCase):
+    def test_compact_applies_to_worker_threads(self):
+        def command():
+            gw._scope.get().compact = True
+            with gw.ScopedThreadPool(max_workers=1) as pool:
+                pool.submit(gw.print_json, {"a": 1, "b": [2]}).result()
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            run_command(command)
+        self.assertEqual(out.getvalue(), '{"a":1,"b":[2]}\n')
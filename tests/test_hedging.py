@@ -0,0 +1,101 @@
+import time
+import random
+from unittest import mock
+
+from support import SERVER, MockGatewayTestCase, gw
+
+import gateway_mock_server as mock_server
+
+DELTA = "GET /gateway/conversations/{id}/messages/delta"
+
+
+class HedgerTest(MockGatewayTestCase):
+    def use_hedger(self, families: str = "delta", budget: float = 0.5, min_samples: int = 5) -> gw.Hedger:
+        hedger = gw.Hedger(families, budget, min_samples=min_samples)
+        patcher = mock.patch.object(gw, "HEDGER", hedger)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return hedger
+
+    def test_no_hedge_until_there_is_a_p95(self):
+        hedger = self.use_hedger(min_samples=20)
+        for _ in range(20):
+            gw.get_delta("conv-00001", None, None, limit=5)
+        self.assertEqual((hedger.stats["requests"], hedger.stats["hedged"]), (20, 0))
+        self.assertEqual(self.counter(DELTA), 20)
+        self.assertIsNotNone(hedger._delay("/gateway/conversations/{id}/messages/delta"))
+
+    def test_slow_primary_loses_to_the_hedge(self):
+        hedger = self.use_hedger()
+        url = f"{gw.BASE_URL}/gateway/conversations/conv-00002/messages/delta"
+        slow = {"next": False}
+
+        def fetch():
+            # Só a 1ª execução da chamada medida cai na cauda lenta
+            if slow["next"]:
+                slow["next"] = False
+                time.sleep(0.5)
+            return gw.decode_json(gw.http_request("GET", "/gateway/conversations/conv-00002/messages/delta", params={"limit": 5}, timeout=30, stream=True))
+
+        for _ in range(5):
+            hedger.call(url, fetch)
+        before = dict(hedger.stats)
+        slow["next"] = True
+        t0 = time.perf_counter()
+        result = hedger.call(url, fetch)
+        self.assertLess(time.perf_counter() - t0, 0.4)
+        self.assertEqual(len(result["items"]), 5)
+        self.assertEqual([hedger.stats[k] - before[k] for k in ("hedged", "hedge_won")], [1, 1])
+
+    def test_budget_caps_extra_requests(self):
+        hedger = self.use_hedger(budget=0.1)
+        url = f"{gw.BASE_URL}/gateway/conversations/conv-00003/messages/delta"
+        slow = {"on": False}
+
+        def fetch():
+            if slow["on"]:
+                time.sleep(0.02)
+            return gw.get_session().get(url, headers=gw.HEADERS, params={"limit": 1}, timeout=5).json()
+
+        # Aquecimento longo: o p95 segue rápido e o bucket chega ao burst
+        for _ in range(500):
+            hedger.call(url, fetch)
+        before = dict(hedger.stats)
+        slow["on"] = True
+        for _ in range(20):
+            hedger.call(url, fetch)
+        hedger._pool.shutdown(wait=True)  # perdedores ainda em voo também chegam ao mock
+        stats = hedger.stats
+        hedged, over = (stats[k] - before[k] for k in ("hedged", "over_budget"))
+        # Todo request lento quis um hedge; cada hedge gasta 1 ficha: no máximo burst + 0.1 por request
+        self.assertEqual(hedged + over, 20)
+        self.assertLessEqual(hedged, hedger.burst + 0.1 * 20)
+        self.assertGreater(over, 0)
+        self.assertEqual(self.counter(DELTA), 520 + stats["hedged"])
+
+    def test_hedged_polling_against_a_slow_tail(self):
+        # Cauda lenta do mock (15% dos requests levam +300ms): o p95 aprendido no aquecimento
+        # segue rápido e o hedge tira a cauda da latência vista pelo poll
+        hedger = self.use_hedger(min_samples=10)
+        for _ in range(200):
+            gw.get_delta("conv-00004", None, None, limit=5)
+        latencies = []
+        with mock.patch.object(mock_server, "random", random.Random(11)), \
+                mock.patch.object(SERVER.state.cfg, "slow_rate", 0.15), mock.patch.object(SERVER.state.cfg, "slow_ms", 300):
+            for _ in range(40):
+                t0 = time.perf_counter()
+                self.assertEqual(len(gw.get_delta("conv-00004", None, None, limit=5)["items"]), 5)
+                latencies.append(time.perf_counter() - t0)
+        self.assertGreater(hedger.stats["hedge_won"], 0)
+        self.assertLess(sorted(latencies)[len(latencies) // 2], 0.1)
+
+    def test_only_configured_families(self):
+        hedger = self.use_hedger(families="delta")
+        self.assertTrue(hedger.enabled("delta"))
+        self.assertFalse(hedger.enabled("read"))
+        gw.list_messages("conv-00005", limit=5)
+        self.assertEqual(hedger.stats["requests"], 0)
+        hedger.configure(budget=0)
+        self.assertFalse(hedger.enabled("delta"))
+        gw.get_delta("conv-00005", None, None, limit=5)
+        self.assertEqual(hedger.stats["requests"], 0)
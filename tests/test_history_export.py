@@ -0,0 +1,57 @@
+import io
+import json
+import contextlib
+from unittest import mock
+
+from support import SERVER, MockGatewayTestCase, gw
+
+MESSAGES = "GET /gateway/conversations/{id}/messages"
+
+
+class HistoryExportTest(MockGatewayTestCase):
+    def messages_of(self, cid: str) -> list[dict]:
+        with SERVER.state.lock:
+            return [dict(m) for m in SERVER.state.messages[cid]]
+
+    def cli(self, *argv) -> tuple[list[dict], str]:
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            gw.execute(gw.build_parser().parse_args(["messages", *argv]))
+        return [json.loads(line) for line in out.getvalue().splitlines()], err.getvalue()
+
+    def test_all_follows_every_cursor(self):
+        expected = self.messages_of("conv-00003")
+        rows, err = self.cli("conv-00003", "--all", "--limit", "7")
+        self.assertEqual(sorted(r["id"] for r in rows), sorted(m["id"] for m in expected))
+        self.assertTrue(all(r["conversation_id"] == "conv-00003" for r in rows))
+        # 30 mensagens em páginas de 7: 5 GETs, nenhum repetido
+        self.assertEqual(self.counter(MESSAGES), 5)
+        self.assertIn(f"[export] {len(expected)} mensagens", err)
+
+    def test_output_is_streamed_page_by_page(self):
+        # O primeiro item sai antes de a última página ser buscada
+        fetched: list[str | None] = []
+        real = gw.list_messages
+
+        def recording(conversation_id, limit=50, cursor=None):
+            fetched.append(cursor)
+            return real(conversation_id, limit=limit, cursor=cursor)
+
+        with mock.patch.object(gw, "list_messages", recording):
+            stream = gw.iter_messages("conv-00001", page_size=5)
+            next(stream)
+            self.assertLessEqual(len(fetched), 2)
+            rest = list(stream)
+        self.assertEqual(len(rest) + 1, 30)
+        self.assertEqual(len(fetched), 6)
+
+    def test_all_conversations_to_file(self):
+        out = self.tmp / "tudo.ndjson"
+        self.cli("--all-conversations", "--limit", "50", "--out", str(out))
+        rows = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+        with SERVER.state.lock:
+            total = sum(len(msgs) for msgs in SERVER.state.messages.values())
+            conversations = set(SERVER.state.messages)
+        self.assertEqual(len(rows), total)
+        self.assertEqual(len({r["id"] for r in rows}), total)
+        self.assertEqual({r["conversation_id"] for r in rows}, conversations)
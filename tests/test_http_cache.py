@@ -0,0 +1,92 @@
+from unittest import mock
+
+import requests
+
+from support import SERVER, MockGatewayTestCase, gw
+
+STATE = "GET /gateway/conversations/{id}"
+
+
+class HttpCacheTest(MockGatewayTestCase):
+    def use_cache(self, **kwargs) -> gw.HttpCache:
+        cache = gw.HttpCache(**kwargs)
+        patcher = mock.patch.object(gw, "HTTP_CACHE", cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return cache
+
+    def external_id(self, i: int) -> str:
+        with SERVER.state.lock:
+            return SERVER.state.conversations[f"conv-{i:05d}"]["external_id"]
+
+    def test_repeated_read_is_revalidated_with_304(self):
+        cache = self.use_cache()
+        first = gw.list_conversations(limit=5)
+        first["items"].clear()  # quem chama pode mutar o dict: o corpo guardado não muda
+        second = gw.list_conversations(limit=5)
+        self.assertEqual(len(second["items"]), 5)
+        self.assertEqual(self.counter("status 304"), 1)
+        self.assertEqual(self.counter("GET /gateway/conversations"), 2)
+        stats = cache.stats()
+        self.assertEqual((stats["miss"], stats["not_modified"], stats["entries"]), (1, 1, 1))
+        self.assertGreater(stats["bytes_saved"], 0)
+
+    def test_changed_resource_is_fetched_again(self):
+        self.use_cache()
+        before = gw.list_conversations(limit=1000)
+        gw.send_text("5511977770001", "conversa nova")
+        after = gw.list_conversations(limit=1000)
+        self.assertEqual(self.counter("status 304"), 0)
+        self.assertEqual(len(after["items"]), len(before["items"]) + 1)
+
+    def test_params_are_part_of_the_key(self):
+        self.use_cache()
+        gw.list_conversations(limit=2)
+        self.assertEqual(len(gw.list_conversations(limit=3)["items"]), 3)
+        self.assertEqual(self.counter("status 304"), 0)
+
+    def test_lru_is_bounded_by_bytes(self):
+        size = len(requests.get(
+            f"{gw.BASE_URL}/gateway/conversations/{self.external_id(0)}", headers={"X-API-Key": "teste"}, timeout=5
+        ).content)
+        cache = self.use_cache(max_bytes=2 * size + size // 2)
+        a, b, c = (self.external_id(i) for i in range(3))
+        gw.get_conversation_state(a)
+        gw.get_conversation_state(b)
+        gw.get_conversation_state(a)  # a vira a mais recente
+        gw.get_conversation_state(c)  # não cabe: sai b, a menos usada
+        self.assertEqual(self.counter("status 304"), 1)
+        self.assertLessEqual(cache.stats()["bytes"], cache.max_bytes)
+        self.assertEqual(cache.stats()["entries"], 2)
+
+        gw.get_conversation_state(a)
+        self.assertEqual(self.counter("status 304"), 2)
+        gw.get_conversation_state(b)
+        self.assertEqual(self.counter("status 304"), 2)
+
+    def test_ttl_and_disabled_cache(self):
+        self.use_cache(ttl=0)
+        gw.list_conversations(limit=5)
+        gw.list_conversations(limit=5)
+        self.assertEqual(self.counter("status 304"), 0)
+
+        cache = self.use_cache(max_bytes=0)
+        gw.list_conversations(limit=5)
+        gw.list_conversations(limit=5)
+        self.assertEqual((self.counter("status 304"), cache.stats()["entries"]), (0, 0))
+
+    def test_max_age_is_served_from_memory(self):
+        cache = self.use_cache()
+        r = requests.Response()
+        r.status_code = 200
+        r._content = b'{"items": []}'
+        r.headers.update({"Cache-Control": "max-age=60"})
+        key = cache.key("/gateway/conversations", {"limit": 7})
+        cache.store(key, r)
+        self.assertEqual(gw.list_conversations(limit=7), {"items": []})
+        self.assertEqual(self.counter("GET /gateway/conversations"), 0)
+        self.assertEqual(cache.stats()["fresh"], 1)
+
+        r.headers["Cache-Control"] = "no-store, max-age=60"
+        cache.store(key, r)
+        self.assertEqual(cache.stats()["entries"], 0)
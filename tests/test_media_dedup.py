@@ -0,0 +1,60 @@
+import os
+import time
+
+from support import MockGatewayTestCase, gw
+
+UPLOAD = "POST /gateway/media/upload"
+
+
+class MediaDedupTest(MockGatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = gw.LocalCache(str(self.tmp / "cache.db"))
+        self.addCleanup(self.cache.close)
+        self.path = self.tmp / "foto.jpg"
+        self.path.write_bytes(os.urandom(50_000))
+
+    def test_same_content_is_uploaded_once(self):
+        first = gw.media_upload_dedup(str(self.path), self.cache)
+        self.assertFalse(first["dedup"])
+        self.assertEqual(self.counter(UPLOAD), 1)
+
+        # Outro nome, mesmo conteúdo: reaproveita o asset sem transferir
+        copy = self.tmp / "copia.jpg"
+        copy.write_bytes(self.path.read_bytes())
+        second = gw.media_upload_dedup(str(copy), self.cache)
+        self.assertTrue(second["dedup"])
+        self.assertEqual(second["media_asset_id"], first["media_asset_id"])
+        self.assertEqual(self.counter(UPLOAD), 1)
+
+    def test_changed_content_is_uploaded_again(self):
+        first = gw.media_upload_dedup(str(self.path), self.cache)
+        self.path.write_bytes(os.urandom(50_000))
+        os.utime(self.path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+        second = gw.media_upload_dedup(str(self.path), self.cache)
+        self.assertFalse(second["dedup"])
+        self.assertNotEqual(second["media_asset_id"], first["media_asset_id"])
+        self.assertEqual(self.counter(UPLOAD), 2)
+
+    def test_asset_close_to_expiry_is_not_reused(self):
+        digest = self.cache.file_sha256(self.path)
+        self.cache.remember_media(digest, "ma-quase-expirado", 50_000, self.path.name, time.time() + 60)
+        resp = gw.media_upload_dedup(str(self.path), self.cache)
+        self.assertFalse(resp["dedup"])
+        self.assertNotEqual(resp["media_asset_id"], "ma-quase-expirado")
+        self.assertEqual(self.counter(UPLOAD), 1)
+
+    def test_without_cache_always_uploads(self):
+        for _ in range(2):
+            self.assertFalse(gw.media_upload_dedup(str(self.path), None).get("dedup", False))
+        self.assertEqual(self.counter(UPLOAD), 2)
+
+    def test_upload_dir_skips_known_files(self):
+        for i in range(3):
+            (self.tmp / f"arq{i}.bin").write_bytes(os.urandom(10_000))
+        first = list(gw.media_upload_dir(str(self.tmp), pattern="*.bin", workers=2, cache=self.cache))
+        self.assertEqual(self.counter(UPLOAD), 3)
+        second = list(gw.media_upload_dir(str(self.tmp), pattern="*.bin", workers=2, cache=self.cache))
+        self.assertEqual(self.counter(UPLOAD), 3)
+        self.assertTrue(all(r["response"]["dedup"] for r in second))
+        self.assertEqual([r["media_asset_id"] for r in first], [r["media_asset_id"] for r in second])
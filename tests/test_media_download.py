@@ -0,0 +1,103 @@
+import json
+import random
+from unittest import mock
+
+import requests
+
+from support import SERVER, MockGatewayTestCase, gw
+
+SIZE = 1024 * 1024
+SEGMENT = 128 * 1024
+
+
+class DownloadResumeTest(MockGatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        media_size = SERVER.state.cfg.media_size
+        SERVER.state.cfg.media_size = SIZE
+        self.addCleanup(setattr, SERVER.state.cfg, "media_size", media_size)
+        # Mídia pequena, mas pelo caminho segmentado (o mesmo de arquivos >= 16 MiB)
+        patcher = mock.patch.object(gw, "DOWNLOAD_PARALLEL_MIN_SIZE", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.asset_id = f"asset{len(SERVER.state.assets)}"
+        # Mesmos bytes que o mock gera para um asset desconhecido
+        self.expected = random.Random(self.asset_id).randbytes(SIZE)
+        self.out_path = self.tmp / f"{self.asset_id}.bin"
+        self.sidecar = self.tmp / f"{self.asset_id}.bin.part.json"
+
+    def _download(self):
+        return gw.media_download_file(self.asset_id, str(self.tmp), connections=2, segment_size=SEGMENT)
+
+    def test_interrupted_download_resumes_missing_segments_only(self):
+        real_segment = gw._download_segment
+
+        def flaky(url, fd, start, end, lock, retries=3):
+            if start >= SIZE // 2:
+                raise requests.ConnectionError("conexão caiu")
+            return real_segment(url, fd, start, end, lock, retries)
+
+        with mock.patch.object(gw, "_download_segment", flaky), self.assertRaises(requests.ConnectionError):
+            self._download()
+        self.assertFalse(self.out_path.exists())
+        self.assertEqual(json.loads(self.sidecar.read_text(encoding="utf-8"))["done"], [0, 1, 2, 3])
+
+        with SERVER.state.lock:
+            SERVER.state.counters.clear()
+        path = self._download()
+        # Sonda de Range + só os 4 segmentos que faltavam
+        self.assertEqual(self.counter("GET /files/{id}"), 1 + 4)
+        self.assertEqual(path.read_bytes(), self.expected)
+        self.assertFalse(self.sidecar.exists())
+        self.assertFalse(path.with_name(path.name + ".part").exists())
+
+    def test_sidecar_for_another_version_is_ignored(self):
+        # Sidecar de uma versão antiga do arquivo (outro ETag): nada dele pode ser reaproveitado
+        self.out_path.with_name(self.out_path.name + ".part").write_bytes(b"\0" * SIZE)
+        self.sidecar.write_text(
+            json.dumps({"size": SIZE, "segment_size": SEGMENT, "validator": '"antigo"', "done": list(range(8))}),
+            encoding="utf-8",
+        )
+        path = self._download()
+        self.assertEqual(self.counter("GET /files/{id}"), 1 + 8)
+        self.assertEqual(path.read_bytes(), self.expected)
+
+    def _stream_download(self):
+        # connections=1: stream único, o caminho dos arquivos pequenos
+        return gw.media_download_file(self.asset_id, str(self.tmp), connections=1)
+
+    def test_interrupted_stream_resumes_from_part_size(self):
+        real_iter = requests.Response.iter_content
+
+        def cut_short(response, chunk_size=1, decode_unicode=False):
+            sent = 0
+            for chunk in real_iter(response, chunk_size=64 * 1024):
+                if sent >= SIZE // 4:
+                    raise requests.ConnectionError("conexão caiu")
+                sent += len(chunk)
+                yield chunk
+
+        with mock.patch.object(requests.Response, "iter_content", cut_short), self.assertRaises(requests.ConnectionError):
+            self._stream_download()
+        part = self.out_path.with_name(self.out_path.name + ".part")
+        self.assertEqual(part.stat().st_size, SIZE // 4)
+        self.assertEqual(json.loads(self.sidecar.read_text(encoding="utf-8"))["mode"], "stream")
+
+        session = gw.get_session()
+        with mock.patch.object(session, "get", wraps=session.get) as get:
+            path = self._stream_download()
+        ranges = [c.kwargs.get("headers", {}).get("Range") for c in get.call_args_list]
+        # Sonda (bytes=0-0) + só o resto do arquivo
+        self.assertEqual(ranges, ["bytes=0-0", f"bytes={SIZE // 4}-"])
+        self.assertEqual(path.read_bytes(), self.expected)
+        self.assertFalse(self.sidecar.exists())
+
+    def test_stream_part_of_another_version_starts_over(self):
+        part = self.out_path.with_name(self.out_path.name + ".part")
+        part.write_bytes(b"\0" * (SIZE // 2))
+        self.sidecar.write_text(json.dumps({"mode": "stream", "size": SIZE, "validator": '"antigo"'}), encoding="utf-8")
+        session = gw.get_session()
+        with mock.patch.object(session, "get", wraps=session.get) as get:
+            path = self._stream_download()
+        self.assertEqual([c.kwargs.get("headers", {}).get("Range") for c in get.call_args_list], ["bytes=0-0", None])
+        self.assertEqual(path.read_bytes(), self.expected)
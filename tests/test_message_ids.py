@@ -0,0 +1,106 @@
+import io
+import json
+import contextlib
+
+from support import SERVER, MockGatewayTestCase, gw, run_command
+
+
+class BulkMessageIdTest(MockGatewayTestCase):
+    def test_id_follows_content_not_position(self):
+        row = {"to": "5511999990001", "text": "oi"}
+        self.assertEqual(gw.bulk_message_id(dict(row), {}), gw.bulk_message_id(dict(row), {}))
+        self.assertNotEqual(gw.bulk_message_id(row, {}), gw.bulk_message_id({**row, "text": "tchau"}, {}))
+        # type implícito (text) e explícito são o mesmo envio
+        self.assertEqual(gw.bulk_message_id(row, {}), gw.bulk_message_id({**row, "type": "text"}, {}))
+
+    def test_identical_rows_are_distinct_sends(self):
+        seen: dict[str, int] = {}
+        row = {"to": "5511999990001", "text": "oi"}
+        first, second = gw.bulk_message_id(row, seen), gw.bulk_message_id(row, seen)
+        self.assertNotEqual(first, second)
+        self.assertTrue(second.startswith(first))
+
+    def test_outbox_and_bulk_never_share_ids(self):
+        row = {"to": "5511999990001", "text": "oi"}
+        self.assertNotEqual(gw.bulk_message_id(row, {}), gw.bulk_message_id(row, {}, prefix="outbox"))
+
+    def test_run_id_salts_the_id(self):
+        row = {"to": "5511999990001", "text": "oi"}
+        self.assertEqual(gw.bulk_message_id(row, {}, run_id="r1"), gw.bulk_message_id(row, {}, run_id="r1"))
+        self.assertNotEqual(gw.bulk_message_id(row, {}, run_id="r1"), gw.bulk_message_id(row, {}, run_id="r2"))
+        self.assertNotEqual(gw.bulk_message_id(row, {}, run_id="r1"), gw.bulk_message_id(row, {}))
+
+    def _send_bulk(self, source, run_id=None):
+        out = self.tmp / "out.jsonl"
+        summary = run_command(gw.run_send_bulk, str(source), str(out), workers=4, rate=0, progress_every=0, run_id=run_id)
+        results = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+        return summary, results
+
+    def _write_rows(self, source):
+        rows = [
+            {"to": "5511999990001", "text": "oi"},
+            {"to": "5511999990001", "text": "oi"},
+            {"to": "5511999990002", "text": "olá"},
+        ]
+        source.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+
+    def test_same_run_id_resumes_without_resending(self):
+        source = self.tmp / "lote.jsonl"
+        self._write_rows(source)
+        summary, results = self._send_bulk(source, run_id="r1")
+        self.assertEqual((summary["ok"], summary["duplicates"], summary["failed"]), (3, 0, 0))
+        ids = {r["message_id"] for r in results}
+        self.assertEqual(len(ids), 3)
+        self.assertTrue(ids <= set(SERVER.state.sent))
+
+        # Mesmo run id (retomada depois de uma queda): o gateway reconhece todos, e o resultado diz isso
+        summary, results = self._send_bulk(source, run_id="r1")
+        self.assertEqual((summary["ok"], summary["duplicates"]), (0, 3))
+        self.assertTrue(all(r["ok"] and r["duplicate"] for r in results))
+
+        # Mesmo caminho e run id, conteúdo novo: nada é confundido com o lote anterior
+        source.write_text(json.dumps({"to": "5511999990001", "text": "mensagem nova"}) + "\n", encoding="utf-8")
+        summary, results = self._send_bulk(source, run_id="r1")
+        self.assertEqual((summary["ok"], summary["duplicates"]), (1, 0))
+        self.assertNotIn(results[0]["message_id"], ids)
+
+    def test_recurring_job_sends_every_run(self):
+        # Lembrete diário: mesmo arquivo, execuções diferentes
+        source = self.tmp / "lembrete.jsonl"
+        self._write_rows(source)
+        self.assertEqual(self._send_bulk(source, run_id="dia-1")[0]["ok"], 3)
+        self.assertEqual(self._send_bulk(source, run_id="dia-2")[0]["ok"], 3)
+
+    def test_cli_default_is_a_new_run_and_once_is_content_only(self):
+        source = self.tmp / "lote.jsonl"
+        self._write_rows(source)
+
+        def cli(*extra):
+            args = gw.build_parser().parse_args(["--compact", "send-bulk", str(source), "--out", str(self.tmp / "r.jsonl"), "--rate", "0", *extra])
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                gw.execute(args)
+            return json.loads(out.getvalue())
+
+        first, second = cli(), cli()
+        self.assertNotEqual(first["run_id"], second["run_id"])
+        self.assertEqual((first["ok"], second["ok"]), (3, 3))
+
+        once = cli("--once")
+        self.assertIsNone(once["run_id"])
+        self.assertEqual(once["ok"], 3)
+        self.assertEqual((cli("--once")["ok"], cli("--once")["duplicates"]), (0, 3))
+
+    def test_malformed_line_is_a_row_error(self):
+        source = self.tmp / "lote.jsonl"
+        source.write_text(
+            json.dumps({"to": "5511999990003", "text": "antes"}) + "\n"
+            + "{isto não é json\n"
+            + json.dumps({"to": "5511999990003", "text": "depois"}) + "\n",
+            encoding="utf-8",
+        )
+        summary, results = self._send_bulk(source)
+        self.assertEqual((summary["total"], summary["ok"], summary["failed"]), (3, 2, 1))
+        bad = [r for r in results if not r["ok"]]
+        self.assertEqual(bad[0]["row"], 2)
+        self.assertIn("JSON inválido", bad[0]["error"])
@@ -0,0 +1,105 @@
+import io
+import random
+import unittest
+import contextlib
+from unittest import mock
+
+from support import SERVER, MockGatewayTestCase, gw
+
+
+def item(i: int, status: str = "received") -> dict:
+    return {
+        "id": f"m{i:06d}",
+        "created_at": f"2025-01-01T00:00:00.{i:06d}+00:00",
+        "direction": "inbound",
+        "message_type": "text",
+        "status": status,
+        "content": {"text": f"msg {i}"},
+    }
+
+
+class MessageStoreTest(unittest.TestCase):
+    def test_out_of_order_inserts_keep_the_index_sorted(self):
+        store = gw.MessageStore()
+        order = list(range(200))
+        random.Random(3).shuffle(order)
+        for i in order:
+            self.assertTrue(store.upsert(item(i)))
+        self.assertEqual([r.id for r in store.tail(200)], [f"m{i:06d}" for i in range(200)])
+        self.assertEqual(store.last().id, "m000199")
+
+    def test_only_real_changes_bump_the_version(self):
+        store = gw.MessageStore()
+        store.upsert(item(1))
+        version = store.version
+        self.assertFalse(store.upsert(item(1)))
+        self.assertEqual(store.version, version)
+        self.assertTrue(store.upsert(item(1, status="read")))
+        self.assertEqual(store.version, version + 1)
+        self.assertEqual(len(store), 1)
+
+
+class BoundedStoreTest(unittest.TestCase):
+    def test_capacity_keeps_the_newest_messages(self):
+        store = gw.MessageStore(capacity=100)
+        for i in range(1000):
+            store.upsert(item(i))
+        # Descarte em lote: nunca passa de capacity + folga, e o que fica é o mais recente
+        self.assertLessEqual(len(store), 125)
+        self.assertEqual(len(store), len(store._keys))
+        self.assertEqual(store.evicted + len(store), 1000)
+        self.assertEqual([r.id for r in store.tail(100)], [f"m{i:06d}" for i in range(900, 1000)])
+        self.assertNotIn("m000000", store.by_id)
+
+    def test_messages_older_than_the_window_are_ignored(self):
+        store = gw.MessageStore(capacity=10)
+        for i in range(100, 110):
+            store.upsert(item(i))
+        version = store.version
+        self.assertFalse(store.upsert(item(5)))
+        self.assertEqual((len(store), store.version), (10, version))
+
+    def test_records_are_compact(self):
+        store = gw.MessageStore()
+        big = {**item(1), "content": {"text": "x" * 100_000}, "metadata": {"raw": "y" * 10_000}}
+        store.upsert(big)
+        store.upsert(item(2))
+        rec = store.by_id["m000001"]
+        self.assertEqual(len(rec.body), gw.BODY_MAX)
+        self.assertFalse(hasattr(rec, "__dict__"))
+        self.assertIs(rec.direction, store.by_id["m000002"].direction)
+
+
+class Stop(Exception):
+    pass
+
+
+class RunPollKeepTest(MockGatewayTestCase):
+    def test_long_running_poll_stays_within_keep(self):
+        conv = SERVER.state.conversations["conv-00006"]
+        stores: list[gw.MessageStore] = []
+
+        class Recording(gw.MessageStore):
+            def __init__(self, capacity=None):
+                super().__init__(capacity)
+                stores.append(self)
+
+        ticks = {"n": 0}
+
+        def tick(seconds):
+            ticks["n"] += 1
+            if ticks["n"] > 5:
+                raise Stop
+            for k in range(40):
+                gw.send_text(conv["external_id"], f"tick {ticks['n']} #{k}")
+
+        with mock.patch.object(gw, "MessageStore", Recording), mock.patch.object(gw.time, "sleep", side_effect=tick), \
+                mock.patch.object(gw.TerminalRenderer, "render"), contextlib.redirect_stdout(io.StringIO()), \
+                self.assertRaises(Stop):
+            gw.run_poll(conv["id"], history_limit=30, poll_interval=1.0, delta_limit=500, max_render=10, keep=50)
+
+        (store,) = stores
+        self.assertEqual(store.capacity, 50)
+        self.assertLessEqual(len(store), 50 + 16)
+        self.assertGreater(store.evicted, 0)
+        self.assertEqual(store.last().body, "tick 5 #39")
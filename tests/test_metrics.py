@@ -0,0 +1,109 @@
+import re
+import io
+import time
+import contextlib
+from unittest import mock
+
+import requests
+
+from support import SERVER, MockGatewayTestCase, gw, run_command
+
+SAMPLE = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+HIST = "gateway_http_request_duration_seconds"
+DELTA = 'method="GET",endpoint="/gateway/conversations/{id}/messages/delta"'
+
+
+def parse(text: str) -> dict[tuple[str, str], float]:
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        m = SAMPLE.match(line)
+        assert m, f"linha inválida: {line!r}"
+        samples[(m.group(1), m.group(2))] = float(m.group(3))
+    return samples
+
+
+class OpenMetricsTest(MockGatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.registry = gw.MetricsRegistry()
+        patcher = mock.patch.object(gw, "METRICS", self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def exported(self) -> tuple[str, dict]:
+        path = self.tmp / "gateway.prom"
+        gw.write_metrics_file(str(path))
+        text = path.read_text(encoding="utf-8")
+        return text, parse(text)
+
+    def test_histogram_and_counters_per_endpoint(self):
+        for cid in ("conv-00001", "conv-00002", "conv-00003"):
+            gw.get_delta(cid, None, None, limit=5)
+        SERVER.state.cfg.error_rate = 1.0
+        with self.assertRaises(requests.HTTPError):
+            gw.http_post_json("/gateway/send", {"to": "5511900000001", "type": "text", "text": "x"})
+        SERVER.state.cfg.error_rate = 0.0
+
+        text, samples = self.exported()
+        self.assertTrue(text.startswith(f"# TYPE {HIST} histogram\n"))
+        self.assertTrue(text.endswith("# EOF\n"))
+        # Ids viram {id}: uma série para as 3 conversas
+        self.assertEqual(samples[(f"{HIST}_count", DELTA)], 3)
+        buckets = [samples[(f"{HIST}_bucket", f'{DELTA},le="{b}"')] for b in (*gw.LATENCY_BUCKETS, "+Inf")]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(buckets[-1], 3)
+        self.assertGreater(samples[(f"{HIST}_sum", DELTA)], 0)
+        self.assertEqual(samples[("gateway_http_responses_total", f'{DELTA},code="200"')], 3)
+        self.assertGreater(samples[("gateway_http_received_bytes_total", DELTA)], 0)
+        send = 'method="POST",endpoint="/gateway/send"'
+        self.assertEqual(samples[("gateway_http_responses_total", f'{send},code="503"')], 1)
+        self.assertGreater(samples[("gateway_http_sent_bytes_total", send)], 0)
+
+    def test_transport_errors_are_counted_by_type(self):
+        with mock.patch.object(requests.Session, "request", side_effect=requests.ConnectionError("recusada")), \
+                self.assertRaises(requests.ConnectionError):
+            gw.http_post_json("/gateway/send", {"to": "5511900000001", "type": "text", "text": "x"})
+        _, samples = self.exported()
+        self.assertEqual(
+            samples[("gateway_http_errors_total", 'method="POST",endpoint="/gateway/send",error="ConnectionError"')], 1
+        )
+
+    def test_command_scope_has_its_own_registry(self):
+        gw.list_conversations(limit=2)
+        scopes = []
+
+        def command():
+            gw.get_delta("conv-00004", None, None, limit=5)
+            scopes.append(gw._scope.get())
+
+        run_command(command)
+        self.assertEqual([r["endpoint"] for r in scopes[0].metrics.summary()], ["/gateway/conversations/{id}/messages/delta"])
+        self.assertEqual(len(self.registry.summary()), 2)
+
+    def test_exporter_rewrites_the_file(self):
+        path = self.tmp / "sub" / "gateway.prom"
+        exporter = gw.MetricsExporter(str(path), interval=0.05).start()
+        try:
+            gw.list_conversations(limit=2)
+            deadline = time.monotonic() + 2
+            while "/gateway/conversations" not in (path.read_text(encoding="utf-8") if path.exists() else ""):
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.02)
+        finally:
+            exporter.stop()
+        self.assertFalse(path.with_name("gateway.prom.tmp").exists())
+
+    def test_metrics_file_flag_writes_at_exit(self):
+        path = self.tmp / "cli.prom"
+        args = gw.build_parser().parse_args(["--metrics-file", str(path), "conversations", "--limit", "1"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            gw.execute(args)
+        samples = parse(path.read_text(encoding="utf-8"))
+        self.assertEqual(samples[(f"{HIST}_count", 'method="GET",endpoint="/gateway/conversations"')], 1)
+
+    def test_label_values_are_escaped(self):
+        self.registry.observe("GET", 'external:a"b\\c', 200, 0.01)
+        text, _ = self.exported()
+        self.assertIn('endpoint="external:a\\"b\\\\c"', text)
@@ -0,0 +1,74 @@
+import requests
+
+from support import BASE_URL, SERVER, MockGatewayTestCase, gw
+
+import gateway_bench as bench
+
+HEADERS = {"X-API-Key": "teste"}
+
+
+class MockContractTest(MockGatewayTestCase):
+    # O que o mock promete aos benchmarks e aos testes do cliente
+    def test_requires_api_key(self):
+        self.assertEqual(requests.get(f"{BASE_URL}/gateway/conversations", timeout=5).status_code, 401)
+
+    def test_send_is_idempotent_by_message_id(self):
+        body = {"to": "5511900000001", "type": "text", "text": "oi", "message_id": f"mock-{self.id()}"}
+        first = requests.post(f"{BASE_URL}/gateway/send", json=body, headers=HEADERS, timeout=5).json()
+        again = requests.post(f"{BASE_URL}/gateway/send", json=body, headers=HEADERS, timeout=5).json()
+        self.assertEqual(again["id"], first["id"])
+        self.assertTrue(again["duplicate"])
+        self.assertEqual(self.counter("send duplicate"), 1)
+
+    def test_delta_cursor_walks_history(self):
+        url = f"{BASE_URL}/gateway/conversations/conv-00004/messages/delta"
+        page = requests.get(url, params={"limit": 20}, headers=HEADERS, timeout=5).json()
+        rest = requests.get(url, params={"limit": 20, "since_cursor": page["next_since_cursor"]}, headers=HEADERS, timeout=5).json()
+        ids = [m["id"] for m in page["items"] + rest["items"]]
+        with SERVER.state.lock:
+            self.assertEqual(ids, [m["id"] for m in SERVER.state.messages["conv-00004"]])
+
+    def test_conversation_list_answers_304_to_its_etag(self):
+        url = f"{BASE_URL}/gateway/conversations"
+        etag = requests.get(url, headers=HEADERS, timeout=5).headers["ETag"]
+        resp = requests.get(url, headers={**HEADERS, "If-None-Match": etag}, timeout=5)
+        self.assertEqual((resp.status_code, resp.content), (304, b""))
+
+    def test_injected_errors_and_send_limit(self):
+        SERVER.state.cfg.error_rate = 1.0
+        resp = requests.get(f"{BASE_URL}/gateway/conversations", headers=HEADERS, timeout=5)
+        self.assertEqual((resp.status_code, resp.headers.get("Retry-After")), (503, "1"))
+        SERVER.state.cfg.error_rate = 0.0
+
+        SERVER.state.cfg.send_rate = 1.0
+        codes = [
+            requests.post(f"{BASE_URL}/gateway/send", json={"to": "5511900000002", "type": "text", "text": str(i)},
+                          headers=HEADERS, timeout=5).status_code
+            for i in range(3)
+        ]
+        self.assertIn(429, codes)
+        self.assertEqual(self.counter("send 429"), codes.count(429))
+
+
+class BenchScenariosTest(MockGatewayTestCase):
+    def test_online_scenarios_run_against_the_mock(self):
+        poll = bench.bench_poll(gw, conversations=4, workers=2, duration=0.3)
+        self.assertEqual(poll["scenario"], "poll")
+        self.assertGreater(poll["ops"], 0)
+        self.assertEqual(poll["errors"], 0)
+
+        send = bench.bench_send(gw, count=20, workers=4)
+        self.assertEqual((send["ops"], send["errors"]), (20, 0))
+        self.assertEqual(self.counter("POST /gateway/send"), 20)
+
+    def test_offline_scenarios(self):
+        codec = bench.bench_codec(gw, [20], rounds=2)
+        self.assertEqual([(r["scenario"], r["items"]) for r in codec], [("codec", 20)])
+        store = bench.bench_store(gw, [300], ticks=10, max_render=5, keep=50)
+        self.assertEqual(store[0]["scenario"], "store")
+        self.assertLess(store[0]["window_kib"], store[0]["store_kib"])
+
+    def test_percentile(self):
+        self.assertEqual(bench.percentile([], 99), 0.0)
+        self.assertEqual(bench.percentile([1.0, 2.0, 3.0, 4.0, 5.0], 50), 3.0)
+        self.assertAlmostEqual(bench.percentile([0.0, 10.0], 95), 9.5)
@@ -0,0 +1,90 @@
+import io
+import socket
+import subprocess
+import sys
+import time
+import contextlib
+
+from support import SERVER, MockGatewayTestCase, gw
+
+
+class OutboxLeaseTest(MockGatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.outbox = gw.Outbox(str(self.tmp / "outbox.db"))
+        self.addCleanup(self.outbox.close)
+        rows = [
+            {"type": "text", "to": "5511977770001", "text": f"fila {i}", "message_id": f"ob-{self.id()}-{i}"}
+            for i in range(5)
+        ]
+        self.ids = self.outbox.enqueue_many(rows)
+        # Reenfileirar o mesmo lote não duplica nada
+        self.outbox.enqueue_many(rows)
+
+    def _drain(self) -> gw.OutboxDrainer:
+        drainer = gw.OutboxDrainer(self.outbox, workers=4, idle_sleep=0.05)
+        with contextlib.redirect_stderr(io.StringIO()):
+            drainer.start(until_empty=True)
+            drainer._thread.join(10)
+        self.assertFalse(drainer.is_alive())
+        return drainer
+
+    def test_expired_lease_is_redelivered_with_same_message_id(self):
+        claimed = self.outbox.claim(10, lease_s=0.2)
+        self.assertEqual([row["message_id"] for _, _, row in claimed], self.ids)
+        self.assertEqual({attempts for _, attempts, _ in claimed}, {1})
+        # Lease ainda válido: outro drainer não pega as mesmas linhas
+        self.assertEqual(self.outbox.claim(10, lease_s=0.2), [])
+
+        # O "drainer que morreu" chegou a enviar duas antes de cair
+        for _, _, row in claimed[:2]:
+            gw.dispatch_row(row)
+
+        time.sleep(0.3)
+        self.assertEqual({attempts for _, attempts, _ in self.outbox.claim(10, lease_s=0.2)}, {2})
+        time.sleep(0.3)
+        drainer = self._drain()
+
+        self.assertEqual(drainer.stats["sent"], 5)
+        self.assertEqual(self.outbox.status()["sent"], 5)
+        self.assertTrue(set(self.ids) <= set(SERVER.state.sent))
+        # As duas reentregues foram deduplicadas pelo gateway, não enviadas de novo
+        self.assertEqual(self.counter("send duplicate"), 2)
+
+    def test_orphans_of_dead_drainer_are_recovered_without_waiting(self):
+        self.outbox.claim(10, lease_s=3600)
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        with self.outbox.conn:
+            self.outbox.conn.execute(
+                "UPDATE outbox SET lease_owner = ? WHERE state = 'inflight'", (f"{socket.gethostname()}:{dead.pid}",)
+            )
+        self.assertEqual(self.outbox.claim(10, lease_s=3600), [])
+
+        drainer = self._drain()
+        self.assertEqual(drainer.stats["sent"], 5)
+        self.assertEqual(self.outbox.outstanding(), 0)
+
+    def test_invalid_row_fails_without_retry(self):
+        self.outbox.enqueue({"type": "text", "text": "sem destino", "message_id": f"ob-{self.id()}-bad"})
+        drainer = self._drain()
+        self.assertEqual((drainer.stats["sent"], drainer.stats["failed"], drainer.stats["retried"]), (5, 1, 0))
+        self.assertEqual(self.outbox.status()["failed"], 1)
+
+
+class OutboxEnqueueIdTest(MockGatewayTestCase):
+    def test_rerun_of_send_outbox_does_not_queue_twice(self):
+        outbox = gw.Outbox(str(self.tmp / "outbox.db"))
+        self.addCleanup(outbox.close)
+        argv = ["send-text", "--to", "5511977770009", "--text", "lembrete", "--outbox"]
+        # Produtor roda, "cai" e roda de novo com os mesmos argumentos
+        first = outbox.enqueue(gw.outbox_row_from_args(gw.build_parser().parse_args(argv)))
+        second = outbox.enqueue(gw.outbox_row_from_args(gw.build_parser().parse_args(argv)))
+        self.assertEqual(first, second)
+        self.assertEqual(outbox.status()["pending"], 1)
+        # Mesmo conteúdo vindo de outbox-enqueue cai no mesmo id
+        self.assertEqual(first, gw.bulk_message_id({"type": "text", "to": "5511977770009", "text": "lembrete"}, {}, prefix="outbox"))
+
+        other = gw.outbox_row_from_args(gw.build_parser().parse_args(argv + ["--message-id", "explicito-1"]))
+        self.assertEqual(outbox.enqueue(other), "explicito-1")
+        self.assertEqual(outbox.status()["pending"], 2)
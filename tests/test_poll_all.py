@@ -0,0 +1,65 @@
+import io
+import asyncio
+import functools
+import threading
+import contextlib
+from collections import Counter
+from unittest import mock
+
+from support import SERVER, MockGatewayTestCase, gw, run_command
+
+
+class PollAllTest(MockGatewayTestCase):
+    def _run(self, seconds: float, poll_once) -> tuple[str, str]:
+        async def main():
+            try:
+                await asyncio.wait_for(
+                    gw.run_poll_all(
+                        concurrency=4,
+                        conversations_limit=0,
+                        phone_number_id=None,
+                        delta_limit=50,
+                        poll_interval=0.2,
+                        min_interval=0.1,
+                        max_interval=0.4,
+                        discover_every=60,
+                        status_every=0,
+                    ),
+                    timeout=seconds,
+                )
+            except asyncio.TimeoutError:
+                pass
+
+        out, err = io.StringIO(), io.StringIO()
+        # Página de 7: a descoberta precisa seguir o next_cursor para achar todas
+        paged = functools.partial(gw.iter_conversations, page_size=7)
+        with mock.patch.object(gw, "iter_conversations", paged), \
+                mock.patch.object(gw, "_poll_conversation_once", poll_once), \
+                contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            run_command(asyncio.run, main())
+        return out.getvalue(), err.getvalue()
+
+    def test_follows_every_conversation_and_survives_a_broken_one(self):
+        with SERVER.state.lock:
+            all_ids = set(SERVER.state.conversations)
+            target = SERVER.state.conversations[sorted(all_ids)[0]]
+        broken = sorted(all_ids)[-1]
+        polled = Counter()
+        real = gw._poll_conversation_once
+
+        def poll_once(st, delta_limit, cache=None):
+            polled[st.conversation_id] += 1
+            if st.conversation_id == broken:
+                raise ValueError("resposta inesperada")
+            return real(st, delta_limit, cache)
+
+        timer = threading.Timer(0.8, gw.send_text, (target["external_id"], "nova no poll-all"), {"message_id": f"pa-{self.id()}"})
+        timer.start()
+        self.addCleanup(timer.cancel)
+        out, err = self._run(2.0, poll_once)
+
+        self.assertEqual(set(polled), all_ids)
+        # A conversa quebrada continua na fila, com backoff
+        self.assertGreaterEqual(polled[broken], 2)
+        self.assertIn("ValueError", err)
+        self.assertIn("nova no poll-all", out)
@@ -0,0 +1,46 @@
+import requests
+
+from support import SERVER, MockGatewayTestCase, gw
+
+
+class PollSchedulerTest(MockGatewayTestCase):
+    def _sched(self) -> gw.PollScheduler:
+        return gw.PollScheduler(base_interval=2.0, min_interval=0.5, max_interval=8.0, jitter=0)
+
+    def test_idle_grows_to_max_and_activity_snaps_back(self):
+        sched = self._sched()
+        waits = [sched.on_success(0) for _ in range(6)]
+        self.assertEqual(waits, sorted(waits))
+        self.assertEqual(waits[-1], 8.0)
+        self.assertEqual(sched.on_success(3), 0.5)
+
+    def test_errors_back_off_and_retry_after_is_a_floor(self):
+        sched = self._sched()
+        self.assertGreater(sched.on_error(), 2.0)
+        self.assertGreater(sched.on_error(), sched.base_interval * sched.factor)
+        self.assertGreaterEqual(sched.on_error(retry_after=5.0), 5.0)
+        # Sucesso depois de erros zera a contagem
+        sched.on_success(1)
+        self.assertEqual(sched.errors, 0)
+
+    def test_polling_the_mock(self):
+        conv = next(iter(SERVER.state.conversations.values()))
+        st = gw.ConversationCursor(conv["id"], self._sched())
+
+        # Primeira rodada: só prime + delta, nada novo
+        self.assertEqual(gw._poll_conversation_once(st, 50), [])
+        idle = st.sched.on_success(0)
+        self.assertGreater(idle, 2.0)
+
+        gw.send_text(conv["external_id"], "nova mensagem", message_id=f"sched-{self.id()}")
+        items = gw._poll_conversation_once(st, 50)
+        self.assertEqual([it["content"]["text"] for it in items], ["nova mensagem"])
+        self.assertEqual(st.sched.on_success(len(items)), 0.5)
+        # O cursor avançou: a mesma mensagem não volta
+        self.assertEqual(gw._poll_conversation_once(st, 50), [])
+
+        SERVER.state.cfg.error_rate = 1.0
+        with self.assertRaises(requests.HTTPError) as ctx:
+            gw._poll_conversation_once(st, 50)
+        wait_s = st.sched.on_error(gw.parse_retry_after(ctx.exception.response))
+        self.assertGreaterEqual(wait_s, 1.0)
@@ -0,0 +1,44 @@
+import time
+from unittest import mock
+
+import requests
+
+from support import SERVER, MockGatewayTestCase, gw
+
+
+class RateLimiterTest(MockGatewayTestCase):
+    def _send_many(self, n: int, workers: int = 6) -> list[dict]:
+        with gw.ScopedThreadPool(max_workers=workers) as pool:
+            futures = [
+                pool.submit(gw.send_text, "5511988880001", f"msg {i}", message_id=f"rl-{self.id()}-{i}")
+                for i in range(n)
+            ]
+            return [f.result() for f in futures]
+
+    def test_send_429_is_absorbed_and_rate_adapts(self):
+        SERVER.state.cfg.send_rate = 20
+        with mock.patch.object(gw, "RATE_RETRIES", 5):
+            results = self._send_many(30)
+        self.assertEqual(len({r["message_id"] for r in results}), 30)
+        self.assertGreaterEqual(self.counter("send 429"), 1)
+        # Depois do 429 o bucket do número passa a ter taxa (AIMD), abaixo da rajada inicial
+        bucket = gw.RATE_LIMITER.buckets_for("send", None)[-1]
+        self.assertIsNotNone(bucket.rate)
+        self.assertLess(bucket.rate, 30)
+
+    def test_phone_rate_caps_sends(self):
+        gw.RATE_LIMITER.configure(phone_rate=10)
+        self.addCleanup(gw.RATE_LIMITER.configure, phone_rate=0)
+        t0 = time.monotonic()
+        self._send_many(15)
+        # 10 de rajada (capacidade do bucket) + 5 a 10/s
+        self.assertGreaterEqual(time.monotonic() - t0, 0.4)
+        self.assertEqual(self.counter("send 429"), 0)
+
+    def test_retry_after_503_is_retried_by_one_layer_only(self):
+        SERVER.state.cfg.error_rate = 1.0
+        with self.assertRaises(requests.HTTPError) as ctx:
+            gw.http_get("/gateway/conversations", params={"limit": 5})
+        self.assertEqual(ctx.exception.response.status_code, 503)
+        # 1 tentativa + RATE_RETRIES do http_request; o Retry do urllib3 não repete por cima
+        self.assertEqual(self.counter("status 503"), gw.RATE_RETRIES + 1)
@@ -0,0 +1,107 @@
+import io
+import json
+import unittest
+import contextlib
+from unittest import mock
+
+from support import SERVER, MockGatewayTestCase, gw
+
+
+class IterSseTest(unittest.TestCase):
+    def test_fields_comments_and_multiline_data(self):
+        lines = [
+            "retry: 1000",
+            "",
+            ": ping",
+            "",
+            "event: message",
+            "id: 7",
+            "data: {\"a\":",
+            "data:1}",
+            "",
+            "id: 8",
+            "data: x",
+            "",
+        ]
+        events = list(gw.iter_sse(lines))
+        self.assertEqual([(e.event, e.id, e.data) for e in events], [("message", "7", '{"a":\n1}'), ("message", "8", "x")])
+
+
+class EventStreamTest(MockGatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conv = next(iter(SERVER.state.conversations.values()))
+
+    def _first_message(self, last_event_id: str | None = None) -> gw.SseEvent:
+        with gw.open_event_stream([self.conv["id"]], last_event_id) as r:
+            for ev in gw.iter_sse(gw.sse_lines(r)):
+                if ev.event in ("message", "reset"):
+                    return ev
+        self.fail("stream terminou sem eventos")
+
+    def test_utf8_text_survives_the_stream(self):
+        # U+2028 no meio do JSON: str.splitlines quebraria a linha do data
+        text = "ação ✓ 😀 linha\u2028separada"
+        with SERVER.state.lock:
+            last = str(SERVER.state.event_seq)
+        gw.send_text(self.conv["external_id"], text, message_id=f"sse-{self.id()}")
+        ev = self._first_message(last)
+        payload = json.loads(ev.data)
+        self.assertEqual(payload["conversation_id"], self.conv["id"])
+        self.assertEqual(payload["item"]["content"]["text"], text)
+
+    def test_last_event_id_replays_only_newer_events(self):
+        with SERVER.state.lock:
+            last = str(SERVER.state.event_seq)
+        gw.send_text(self.conv["external_id"], "primeira", message_id=f"sse-{self.id()}-1")
+        first = self._first_message(last)
+        gw.send_text(self.conv["external_id"], "segunda", message_id=f"sse-{self.id()}-2")
+        second = self._first_message(first.id)
+        self.assertGreater(int(second.id), int(first.id))
+        self.assertEqual(json.loads(second.data)["item"]["content"]["text"], "segunda")
+
+    def test_unknown_last_event_id_asks_for_reset(self):
+        with SERVER.state.lock:
+            future = str(SERVER.state.event_seq + 1000)
+        self.assertEqual(self._first_message(future).event, "reset")
+
+    def test_push_disabled_raises_push_unavailable(self):
+        SERVER.state.cfg.push = False
+        with self.assertRaises(gw.PushUnavailable):
+            gw.open_event_stream([self.conv["id"]], None)
+
+
+class SubscriberTest(MockGatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conv = next(iter(SERVER.state.conversations.values()))
+        self.sub = gw.Subscriber([self.conv["id"]])
+
+    def test_malformed_event_is_skipped_and_stream_goes_on(self):
+        gw.send_text(self.conv["external_id"], "depois do lixo", message_id=f"sse-{self.id()}")
+        with SERVER.state.lock:
+            item = dict(SERVER.state.messages[self.conv["id"]][-1])
+        bad = ["{não é json", "[1, 2]", json.dumps({"conversation_id": ["x"], "item": {}}), json.dumps({"conversation_id": self.conv["id"], "item": "x"})]
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            for i, data in enumerate(bad):
+                self.sub.on_event(gw.SseEvent(event="message", data=data, id=str(i)))
+            self.sub.on_event(gw.SseEvent(event="message", data=json.dumps({"conversation_id": self.conv["id"], "item": item}), id="9"))
+        self.assertEqual(err.getvalue().count("ignorado"), len(bad))
+        self.assertEqual(self.sub.stats["events"], 1)
+        self.assertIn("depois do lixo", out.getvalue())
+        self.assertEqual(self.sub.last_event_id, "9")
+
+    def test_normal_close_waits_before_reconnecting(self):
+        class Stop(Exception):
+            pass
+
+        with mock.patch.object(self.sub, "run_push", side_effect=[None, None, Stop()]) as run_push, \
+                mock.patch.object(gw.time, "sleep") as sleep, \
+                contextlib.redirect_stdout(io.StringIO()), self.assertRaises(Stop):
+            self.sub.run()
+        self.assertEqual(run_push.call_count, 3)
+        waits = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(len(waits), 2)
+        # Intervalo mínimo do backoff (1s), com jitter de até 20% para baixo
+        self.assertTrue(all(w >= 0.8 for w in waits), waits)
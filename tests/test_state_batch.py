@@ -0,0 +1,63 @@
+import io
+import json
+import contextlib
+
+from support import SERVER, MockGatewayTestCase, gw
+
+STATE = "GET /gateway/conversations/{id}"
+
+
+class StateBatchTest(MockGatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        with SERVER.state.lock:
+            self.known = [SERVER.state.conversations[f"conv-{i:05d}"]["external_id"] for i in range(8)]
+        self.source = self.tmp / "ids.csv"
+        lines = ["external_id,nome", "# comentário", *(f"{e},cliente" for e in self.known), self.known[0], "5511900009999", ""]
+        self.source.write_text("\n".join(lines), encoding="utf-8")
+        self.cache = gw.LocalCache(str(self.tmp / "cache.db"))
+        self.addCleanup(self.cache.close)
+        self.out = self.tmp / "states.ndjson"
+
+    def run_batch(self, **kwargs) -> tuple[dict, dict[str, dict]]:
+        summary = gw.run_state_batch(str(self.source), str(self.out), workers=4, progress_every=0, **kwargs)
+        rows = [json.loads(line) for line in self.out.read_text(encoding="utf-8").splitlines()]
+        by_id = {r["external_id"]: r for r in rows}
+        self.assertEqual(len(by_id), len(rows))
+        return summary, by_id
+
+    def test_duplicates_are_fetched_once(self):
+        summary, rows = self.run_batch(cache=self.cache)
+        self.assertEqual((summary["read"], summary["unique"]), (10, 9))
+        self.assertEqual((summary["ok"], summary["failed"], summary["cached"]), (8, 1, 0))
+        self.assertEqual(self.counter(STATE), 9)
+        self.assertEqual(rows["5511900009999"]["status_code"], 404)
+        self.assertEqual(rows[self.known[3]]["state"]["conversation_id"], "conv-00003")
+
+    def test_cache_answers_within_max_age(self):
+        self.run_batch(cache=self.cache)
+        summary, rows = self.run_batch(cache=self.cache)
+        # Só a que falhou volta ao gateway: falhas não entram no cache
+        self.assertEqual((summary["cached"], summary["fetched"], summary["ok"]), (8, 1, 8))
+        self.assertEqual(self.counter(STATE), 10)
+        self.assertTrue(rows[self.known[0]]["cached"])
+        self.assertEqual(rows[self.known[0]]["state"]["conversation_id"], "conv-00000")
+
+        summary, _ = self.run_batch(cache=self.cache, max_age=0)
+        self.assertEqual((summary["cached"], summary["fetched"]), (0, 9))
+        self.assertEqual(self.counter(STATE), 19)
+
+    def test_phone_number_id_has_its_own_cache(self):
+        self.run_batch(cache=self.cache)
+        summary, _ = self.run_batch(cache=self.cache, phone_number_id="pn-1")
+        self.assertEqual(summary["cached"], 0)
+
+    def test_cli_writes_summary_to_stderr(self):
+        err = io.StringIO()
+        args = gw.build_parser().parse_args(
+            ["conversation-state", "--batch", str(self.source), "--out", str(self.out), "--cache", str(self.tmp / "cli.db"), "--workers", "2"]
+        )
+        with contextlib.redirect_stderr(err):
+            gw.execute(args)
+        self.assertEqual(json.loads(err.getvalue().splitlines()[-1])["unique"], 9)
+        self.assertEqual(len(self.out.read_text(encoding="utf-8").splitlines()), 9)
@@ -0,0 +1,33 @@
+import io
+import contextlib
+from unittest import mock
+
+from support import SERVER, MockGatewayTestCase, gw
+
+
+class Stop(Exception):
+    pass
+
+
+class RunPollRenderTest(MockGatewayTestCase):
+    def test_idle_ticks_do_not_redraw(self):
+        conv = next(iter(SERVER.state.conversations.values()))
+        ticks = {"n": 0}
+
+        def tick(seconds):
+            ticks["n"] += 1
+            if ticks["n"] == 4:
+                # Mensagem nova no meio do polling: só ela provoca um novo frame
+                gw.send_text(conv["external_id"], "chegou agora", message_id=f"render-{self.id()}")
+            if ticks["n"] == 8:
+                raise Stop
+
+        with mock.patch.object(gw.TerminalRenderer, "render") as render, \
+                mock.patch.object(gw.time, "sleep", side_effect=tick), \
+                contextlib.redirect_stdout(io.StringIO()), self.assertRaises(Stop):
+            gw.run_poll(conv["id"], history_limit=10, poll_interval=1.0, delta_limit=50, max_render=10)
+
+        # 8 deltas: o frame inicial + o da mensagem nova; os ticks ociosos não redesenham
+        self.assertEqual(render.call_count, 2)
+        last_frame = render.call_args.args[0]
+        self.assertTrue(any("chegou agora" in line for line in last_frame))
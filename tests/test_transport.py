@@ -0,0 +1,40 @@
+from unittest import mock
+
+from support import SERVER, MockGatewayTestCase, gw, run_command
+
+
+class TransportTest(MockGatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        # Session nova: as conexões abertas por outros testes não contam aqui
+        patcher = mock.patch.object(gw, "_session", gw.build_session())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conv_id = next(iter(SERVER.state.conversations))
+
+    def _deltas(self, n: int, workers: int = 1) -> dict:
+        def command():
+            with gw.ScopedThreadPool(max_workers=workers) as pool:
+                for fut in [pool.submit(gw.get_delta, self.conv_id, None, None, 5) for _ in range(n)]:
+                    fut.result()
+            return gw.transport_stats(gw._scope.get())
+        return run_command(command)
+
+    def test_sequential_requests_share_one_keep_alive_connection(self):
+        stats = self._deltas(20)
+        self.assertEqual(stats["requests"], 20)
+        self.assertEqual(stats["connections_opened"], 1)
+        self.assertEqual(stats["connections_reused"], 19)
+
+    def test_concurrent_requests_open_at_most_one_connection_per_worker(self):
+        stats = self._deltas(60, workers=4)
+        self.assertEqual(stats["requests"], 60)
+        self.assertLessEqual(stats["connections_opened"], 4)
+
+    def test_configure_transport_only_grows(self):
+        session = gw.get_session()
+        gw.configure_transport(1)
+        self.assertIs(gw.get_session(), session)
+        with mock.patch.object(gw, "_session_pool_size", gw._session_pool_size):
+            gw.configure_transport(gw._session_pool_size + 8)
+            self.assertIsNot(gw.get_session(), session)